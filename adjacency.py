@@ -0,0 +1,204 @@
+# adjacency.py
+"""Tumanlar qo'shnichilik grafi va moslashtirish halqalari.
+
+Graf regions.py'dan bir marta quriladi:
+  - markazlari ADJACENCY_RADIUS_KM ichidagi tumanlar qo'shni (DISTRICT_CENTERS);
+  - har bir tuman eng yaqin tuman bilan albatta qo'shni - chekka, siyrak
+    hududlarda (Qoraqalpog'iston, Navoiy) ham qo'shnisiz tuman qolmaydi;
+  - bir viloyatdagi "X shahri" va "X tumani" qo'shni;
+  - _EXTRA_NEIGHBOURS'dagi qo'lda kiritilgan qo'shnilar.
+Har bir tuman uchun DISTRICT_RINGS[tuman_id] = {boshqa_tuman_id: halqa}:
+0 - o'sha tuman, 1 - qo'shni tuman, 2 - o'sha viloyatning qolgan tumanlari.
+"""
+import os
+
+from geo import haversine_km
+from regions import DISTRICT_IDS, district_id, regions
+
+RING_EXACT = 0
+RING_NEIGHBOUR = 1
+RING_REGION = 2
+
+ADJACENCY_RADIUS_KM = float(os.getenv("ADJACENCY_RADIUS_KM", 35))
+
+# Tuman markazlarining taxminiy koordinatalari (kenglik, uzunlik) - tuman markazi yoki shahar
+DISTRICT_CENTERS = {
+    "Toshkent shahri": {
+        "Toshkent shahri": (41.311, 69.280), "Olmazor tumani": (41.350, 69.220), "Bektemir tumani": (41.210, 69.340),
+        "Mirobod tumani": (41.290, 69.290), "Mirzo Ulug'bek tumani": (41.330, 69.340), "Sergeli tumani": (41.220, 69.220),
+        "Uchtepa tumani": (41.290, 69.170), "Chilonzor tumani": (41.270, 69.200), "Shayxontohur tumani": (41.320, 69.240),
+        "Yunusobod tumani": (41.370, 69.290), "Yaqqasaroy tumani": (41.280, 69.250), "Yashnobod tumani": (41.290, 69.350),
+    },
+    "Toshkent viloyati": {
+        "Nurafshon shahri": (41.040, 69.360), "Angren shahri": (41.020, 70.140), "Bekobod shahri": (40.220, 69.270),
+        "Olmaliq shahri": (40.850, 69.600), "Ohangaron shahri": (40.910, 69.640), "Chirchiq shahri": (41.470, 69.580),
+        "Yangiyo'l shahri": (41.110, 69.050), "Oqqo'rg'on tumani": (40.870, 69.050), "Bostanliq tumani": (41.560, 69.770),
+        "Bo'ka tumani": (40.810, 69.200), "Zangiota tumani": (41.190, 69.150), "Qibray tumani": (41.390, 69.460),
+        "Quyi Chirchiq tumani": (40.950, 69.150), "O'rta Chirchiq tumani": (41.080, 69.400),
+        "Parkent tumani": (41.290, 69.680), "Piskent tumani": (40.900, 69.350), "Toshkent tumani": (41.420, 69.210),
+        "Chinoz tumani": (40.940, 68.770), "Yuqori Chirchiq tumani": (41.280, 69.550),
+    },
+    "Samarqand viloyati": {
+        "Samarqand shahri": (39.650, 66.960), "Samarqand tumani": (39.600, 66.950), "Bulung'ur tumani": (39.760, 67.270),
+        "Urgut tumani": (39.400, 67.240), "Jomboy tumani": (39.700, 67.090), "Ishtixon tumani": (39.970, 66.490),
+        "Kattaqo'rg'on tumani": (39.900, 66.260), "Narpay tumani": (39.920, 65.950), "Nurobod tumani": (39.600, 66.280),
+        "Oqdaryo tumani": (39.860, 66.790), "Paxtachi tumani": (40.050, 65.750), "Payariq tumani": (39.990, 66.910),
+        "Pastdarg'om tumani": (39.710, 66.660), "Qo'shrabot tumani": (40.280, 66.680), "Toyloq tumani": (39.600, 67.100),
+    },
+    "Qoraqalpog'iston Respublikasi": {
+        "Amudaryo tumani": (42.120, 60.060), "Beruniy tumani": (41.690, 60.750), "Bo'zatov tumani": (43.000, 59.300),
+        "Ellikqal'a tumani": (41.850, 60.930), "Kegeyli tumani": (42.780, 59.610), "Mo'ynoq tumani": (43.770, 59.020),
+        "Nukus tumani": (42.550, 59.750), "Nukus shahri": (42.460, 59.600), "Qo'ng'irot tumani": (43.050, 58.840),
+        "Qanliko'l tumani": (42.830, 59.000), "Qorao'zak tumani": (43.030, 60.000), "Shumanay tumani": (42.720, 58.920),
+        "Taxtako'pir tumani": (43.020, 60.280), "To'rtko'l tumani": (41.550, 61.000), "Xo'jayli tumani": (42.400, 59.450),
+        "Chimboy tumani": (42.930, 59.780),
+    },
+    "Andijon viloyati": {
+        "Andijon shahri": (40.780, 72.340), "Xonobod shahri": (40.800, 73.000), "Andijon tumani": (40.850, 72.300),
+        "Asaka tumani": (40.640, 72.240), "Baliqchi tumani": (40.900, 71.850), "Bo'z tumani": (40.680, 71.910),
+        "Buloqboshi tumani": (40.620, 72.500), "Izboskan tumani": (40.910, 72.250), "Jalaquduq tumani": (40.720, 72.640),
+        "Qo'rg'ontepa tumani": (40.730, 72.760), "Marhamat tumani": (40.500, 72.330), "Oltinko'l tumani": (40.800, 72.170),
+        "Paxtaobod tumani": (40.930, 72.500), "Shahrixon tumani": (40.710, 72.060), "Ulug'nor tumani": (40.760, 71.720),
+        "Xo'jaobod tumani": (40.670, 72.560),
+    },
+    "Buxoro viloyati": {
+        "Buxoro shahri": (39.770, 64.420), "Kogon shahri": (39.720, 64.550), "Olot tumani": (39.420, 63.800),
+        "Buxoro tumani": (39.860, 64.450), "Vobkent tumani": (40.030, 64.520), "G'ijduvon tumani": (40.100, 64.680),
+        "Jondor tumani": (39.730, 64.180), "Qorako'l tumani": (39.500, 63.850), "Qorovulbozor tumani": (39.500, 64.800),
+        "Peshku tumani": (40.100, 64.200), "Romitan tumani": (39.930, 64.380), "Shofirkon tumani": (40.120, 64.500),
+    },
+    "Jizzax viloyati": {
+        "Jizzax shahri": (40.120, 67.840), "Arnasoy tumani": (40.500, 67.900), "Baxmal tumani": (39.730, 67.630),
+        "Do'stlik tumani": (40.520, 68.040), "Forish tumani": (40.400, 67.100), "G'allaorol tumani": (40.030, 67.580),
+        "Jizzax tumani": (40.050, 67.900), "Mirzacho'l tumani": (40.660, 68.170), "Paxtakor tumani": (40.320, 67.950),
+        "Yangiobod tumani": (39.950, 68.350), "Zafarobod tumani": (40.420, 68.100), "Zarbdor tumani": (40.220, 68.290),
+        "Zomin tumani": (39.960, 68.400),
+    },
+    "Qashqadaryo viloyati": {
+        "Qarshi shahri": (38.860, 65.790), "Shahrisabz shahri": (39.060, 66.830), "Dehqonobod tumani": (38.400, 66.550),
+        "G'uzor tumani": (38.620, 66.250), "Qamashi tumani": (38.820, 66.460), "Qarshi tumani": (38.820, 65.650),
+        "Kasbi tumani": (38.950, 65.450), "Kitob tumani": (39.120, 66.880), "Koson tumani": (39.040, 65.580),
+        "Mirishkor tumani": (38.950, 65.150), "Muborak tumani": (39.250, 65.150), "Nishon tumani": (38.650, 65.680),
+        "Shahrisabz tumani": (39.000, 66.850), "Chiroqchi tumani": (39.030, 66.570), "Yakkabog' tumani": (38.980, 66.680),
+    },
+    "Navoiy viloyati": {
+        "Navoiy shahri": (40.100, 65.370), "Zarafshon shahri": (41.570, 64.200), "Karmana tumani": (40.140, 65.360),
+        "Konimex tumani": (40.280, 65.150), "Navbahor tumani": (40.220, 65.650), "Nurata tumani": (40.560, 65.690),
+        "Qiziltepa tumani": (40.030, 64.850), "Tomdi tumani": (41.730, 64.620), "Uchquduq tumani": (42.160, 63.550),
+        "Xatirchi tumani": (40.030, 65.970),
+    },
+    "Namangan viloyati": {
+        "Namangan shahri": (41.000, 71.670), "Kosonsoy tumani": (41.250, 71.550), "Mingbuloq tumani": (40.770, 71.390),
+        "Namangan tumani": (40.930, 71.620), "Norin tumani": (40.920, 72.050), "Pop tumani": (40.870, 71.100),
+        "To'raqo'rg'on tumani": (40.990, 71.510), "Uchqo'rg'on tumani": (41.110, 72.080), "Uychi tumani": (41.080, 71.920),
+        "Yangiqo'rg'on tumani": (41.190, 71.720), "Chust tumani": (41.000, 71.230), "Chortoq tumani": (41.070, 71.820),
+    },
+    "Surxondaryo viloyati": {
+        "Termiz shahri": (37.220, 67.280), "Angor tumani": (37.470, 67.170), "Boysun tumani": (38.200, 67.200),
+        "Denov tumani": (38.270, 67.900), "Jarqo'rg'on tumani": (37.500, 67.420), "Muzrabot tumani": (37.470, 66.930),
+        "Oltinsoy tumani": (38.100, 67.650), "Qiziriq tumani": (37.700, 67.250), "Qumqo'rg'on tumani": (37.830, 67.580),
+        "Sariosiyo tumani": (38.420, 67.950), "Sherobod tumani": (37.670, 67.000), "Sho'rchi tumani": (38.000, 67.780),
+        "Termiz tumani": (37.300, 67.350), "Uzun tumani": (38.370, 68.000),
+    },
+    "Sirdaryo viloyati": {
+        "Guliston shahri": (40.490, 68.780), "Yangiyer shahri": (40.270, 68.820), "Shirin shahri": (40.220, 69.100),
+        "Oqoltin tumani": (40.620, 68.470), "Boyovut tumani": (40.400, 68.980), "Guliston tumani": (40.550, 68.750),
+        "Mirzaobod tumani": (40.450, 68.550), "Sardoba tumani": (40.500, 68.250), "Sirdaryo tumani": (40.850, 68.650),
+        "Sayxunobod tumani": (40.650, 68.700), "Xovos tumani": (40.220, 68.850),
+    },
+    "Farg'ona viloyati": {
+        "Farg'ona shahri": (40.380, 71.780), "Marg'ilon shahri": (40.470, 71.720), "Quvasoy shahri": (40.300, 71.980),
+        "Qo'qon shahri": (40.530, 70.940), "Bog'dod tumani": (40.500, 71.220), "Beshariq tumani": (40.440, 70.610),
+        "Buvayda tumani": (40.600, 71.150), "Dang'ara tumani": (40.580, 70.920), "Oltiariq tumani": (40.390, 71.480),
+        "O'zbekiston tumani": (40.370, 70.820), "Rishton tumani": (40.360, 71.280), "So'x tumani": (39.970, 71.130),
+        "Toshloq tumani": (40.470, 71.770), "Uchko'prik tumani": (40.550, 71.050), "Farg'ona tumani": (40.280, 71.750),
+        "Furqat tumani": (40.550, 70.750), "Qo'shtepa tumani": (40.520, 71.650), "Quva tumani": (40.520, 72.070),
+        "Yozyovon tumani": (40.650, 71.720),
+    },
+    "Xorazm viloyati": {
+        "Urganch shahri": (41.550, 60.630), "Xiva shahri": (41.380, 60.360), "Bog'ot tumani": (41.350, 60.820),
+        "Gurlan tumani": (41.850, 60.400), "Qoshko'pir tumani": (41.540, 60.350), "Urganch tumani": (41.600, 60.600),
+        "Xazarasp tumani": (41.320, 61.070), "Xiva tumani": (41.400, 60.400), "Xonqa tumani": (41.470, 60.780),
+        "Shovot tumani": (41.650, 60.300), "Yangiariq tumani": (41.350, 60.580), "Yangibozor tumani": (41.720, 60.550),
+    },
+}
+
+# Nomidan ham, masofadan ham aniqlab bo'lmaydigan qo'shnilar: ((viloyat, tuman), (viloyat, tuman))
+_EXTRA_NEIGHBOURS = [
+    (("Toshkent shahri", "Toshkent shahri"), ("Toshkent viloyati", "Zangiota tumani")),
+    (("Toshkent shahri", "Toshkent shahri"), ("Toshkent viloyati", "Qibray tumani")),
+    (("Toshkent shahri", "Toshkent shahri"), ("Toshkent viloyati", "Toshkent tumani")),
+    (("Toshkent shahri", "Sergeli tumani"), ("Toshkent viloyati", "Zangiota tumani")),
+    (("Toshkent shahri", "Yunusobod tumani"), ("Toshkent viloyati", "Qibray tumani")),
+    (("Toshkent shahri", "Yunusobod tumani"), ("Toshkent viloyati", "Toshkent tumani")),
+    (("Toshkent viloyati", "Nurafshon shahri"), ("Toshkent viloyati", "Toshkent tumani")),
+    (("Toshkent viloyati", "Chirchiq shahri"), ("Toshkent viloyati", "Qibray tumani")),
+    (("Toshkent viloyati", "Chirchiq shahri"), ("Toshkent viloyati", "Bostanliq tumani")),
+]
+
+
+def _centers() -> dict:
+    return {district_id(region, district): center
+            for region, districts in DISTRICT_CENTERS.items() for district, center in districts.items()}
+
+
+def _build_neighbours(radius_km: float = ADJACENCY_RADIUS_KM) -> dict:
+    graph = {i: set() for i in DISTRICT_IDS.values()}
+
+    def link(a: int, b: int):
+        if a != b:
+            graph[a].add(b)
+            graph[b].add(a)
+
+    centers = _centers()
+    for a, center in centers.items():
+        distances = sorted((haversine_km(*center, *other), b) for b, other in centers.items() if b != a)
+        link(a, distances[0][1])
+        for distance, b in distances:
+            if distance > radius_km:
+                break
+            link(a, b)
+    for region, districts in regions.items():
+        # "Samarqand shahri" va "Samarqand tumani" kabi bir nomli shahar va tuman
+        stems = {}
+        for district in districts:
+            stems.setdefault(district.rsplit(" ", 1)[0], []).append(district_id(region, district))
+        for group in stems.values():
+            for a in group:
+                for b in group:
+                    link(a, b)
+    for a, b in _EXTRA_NEIGHBOURS:
+        link(district_id(*a), district_id(*b))
+    return graph
+
+
+NEIGHBOURS = _build_neighbours()
+
+
+def _build_rings() -> dict:
+    rings = {}
+    for region, districts in regions.items():
+        region_ids = [district_id(region, d) for d in districts]
+        for did in region_ids:
+            ring = dict.fromkeys(region_ids, RING_REGION)
+            ring.update(dict.fromkeys(NEIGHBOURS[did], RING_NEIGHBOUR))
+            ring[did] = RING_EXACT
+            rings[did] = ring
+    return rings
+
+
+DISTRICT_RINGS = _build_rings()
+
+
+def route_rings(from_district: int, to_district: int, max_ring: int = RING_REGION) -> dict:
+    """(from_district, to_district) juftliklari -> (halqa, halqalar yig'indisi) saralash kaliti.
+
+    Juftlik halqasi - ikki uchi halqalarining kattasi.
+    """
+    from_rings = DISTRICT_RINGS.get(from_district, {from_district: RING_EXACT})
+    to_rings = DISTRICT_RINGS.get(to_district, {to_district: RING_EXACT})
+    return {
+        (f, t): (max(rf, rt), rf + rt)
+        for f, rf in from_rings.items() if rf <= max_ring
+        for t, rt in to_rings.items() if rt <= max_ring
+    }
@@ -0,0 +1,88 @@
+# async_database.py
+"""database.py funksiyalarining async varianti.
+
+PyMongo chaqiruvlari cheklangan thread pool'da bajariladi, shuning uchun
+handler'lar `await get_user(...)` qilganda event loop bloklanmaydi.
+Sinxron API (database.py) skriptlar uchun o'zgarmagan holda qoladi.
+"""
+import asyncio
+import functools
+import itertools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", 16))
+
+_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="db")
+
+
+async def run_sync(fn, *args, **kwargs):
+    """Sinxron DB funksiyasini DB thread pool'ida bajarish."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+
+
+def _wrap(fn):
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        return await run_sync(fn, *args, **kwargs)
+    return wrapper
+
+
+connect = _wrap(database.connect)
+close = _wrap(database.close)
+init_db = _wrap(database.init_db)
+save_user = _wrap(database.save_user)
+save_trip = _wrap(database.save_trip)
+publish_trip = _wrap(database.publish_trip)
+get_user = _wrap(database.get_user)
+get_stats = _wrap(database.get_stats)
+get_role_counts = _wrap(database.get_role_counts)
+get_all_drivers = _wrap(database.get_all_drivers)
+get_all_passengers = _wrap(database.get_all_passengers)
+get_all_users = _wrap(database.get_all_users)
+get_matches = _wrap(database.get_matches)
+get_match_page = _wrap(database.get_match_page)
+get_user_trip = _wrap(database.get_user_trip)
+set_trip_location = _wrap(database.set_trip_location)
+get_nearby_drivers = _wrap(database.get_nearby_drivers)
+update_seats = _wrap(database.update_seats)
+delete_trip = _wrap(database.delete_trip)
+subscribe_route = _wrap(database.subscribe_route)
+get_user_subscriptions = _wrap(database.get_user_subscriptions)
+unsubscribe_all = _wrap(database.unsubscribe_all)
+get_route_subscribers = _wrap(database.get_route_subscribers)
+get_route_demand = _wrap(database.get_route_demand)
+delete_user = _wrap(database.delete_user)
+get_user_count = _wrap(database.get_user_count)
+get_driver_count = _wrap(database.get_driver_count)
+get_passenger_count = _wrap(database.get_passenger_count)
+get_all_drivers_chat_ids = _wrap(database.get_all_drivers_chat_ids)
+get_all_passengers_chat_ids = _wrap(database.get_all_passengers_chat_ids)
+get_all_users_chat_ids = _wrap(database.get_all_users_chat_ids)
+
+
+async def _stream(make_iter, batch_size: int):
+    # Generator DB thread'ida partiyalab o'qiladi, event loop esa bo'sh qoladi
+    it = await run_sync(make_iter)
+    while True:
+        batch = await run_sync(lambda: list(itertools.islice(it, batch_size)))
+        if not batch:
+            return
+        for item in batch:
+            yield item
+
+
+def iter_users(role=None, batch_size: int = database.USER_BATCH_SIZE):
+    """`async for user in iter_users("driver")` - database.iter_users'ning async varianti."""
+    return _stream(lambda: database.iter_users(role, batch_size), batch_size)
+
+
+def iter_drivers(batch_size: int = database.USER_BATCH_SIZE):
+    return iter_users("driver", batch_size)
+
+
+def iter_passengers(batch_size: int = database.USER_BATCH_SIZE):
+    return iter_users("passenger", batch_size)
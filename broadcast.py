@@ -0,0 +1,297 @@
+# broadcast.py
+"""Ommaviy xabar yuborish: tezlik cheklovi, parallel yuborish va 429 qayta urinish.
+
+Telegram cheklovlari: umumiy ~30 xabar/sekund va bitta chatga ~1 xabar/sekund.
+Umumiy cheklov token bucket bilan, chat cheklovi esa chat bo'yicha keyingi
+ruxsat vaqti bilan ta'minlanadi. RetryAfter (429) kelsa, server aytgan vaqtga
+butun bucket to'xtatiladi va xabar qayta yuboriladi.
+
+Telegram chegarasi bot uchun umumiy, worker'lar esa bir nechta: shuning uchun
+bucket holati MongoDB'da (SharedTokenBucket) - bitta admin xabari yolg'iz
+ishlasa to'liq BROADCAST_RATE'ni oladi, bir vaqtdagi yuborishlar esa uni
+bo'lishadi. Baza javob bermasa, jarayon tezligi BROADCAST_RATE / BROADCAST_WORKERS.
+"""
+import asyncio
+import collections
+import logging
+import os
+import time
+from datetime import timedelta
+
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+from telegram.error import BadRequest, ChatMigrated, Forbidden, NetworkError, RetryAfter, TelegramError
+
+from async_database import run_sync
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", 25))  # xabar/sekund, barcha worker'lar uchun jami
+BROADCAST_BURST = int(os.getenv("BROADCAST_BURST", 25))
+# Bir vaqtda xabar yuboradigan jarayonlar soni (Procfile: gunicorn -w ${WEB_CONCURRENCY:-4})
+BROADCAST_WORKERS = max(1, int(os.getenv("BROADCAST_WORKERS", os.getenv("WEB_CONCURRENCY", 4))))
+BROADCAST_CHAT_INTERVAL = float(os.getenv("BROADCAST_CHAT_INTERVAL", 1))  # bitta chatga xabarlar orasidagi sekund
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", 20))
+BROADCAST_MAX_RETRIES = int(os.getenv("BROADCAST_MAX_RETRIES", 3))
+BROADCAST_PROGRESS_EVERY = int(os.getenv("BROADCAST_PROGRESS_EVERY", 1000))
+BROADCAST_LEASE = int(os.getenv("BROADCAST_LEASE", 5))  # umumiy bucket'dan bitta so'rovda band qilinadigan slotlar
+BROADCAST_BUCKET_ID = "telegram"
+
+
+class TokenBucket:
+    """Async token bucket: sekundiga `rate` ta token, ko'pi bilan `capacity` ta."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        # Lock navbatni adolatli qiladi: kutayotganlar kelgan tartibida token oladi
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Keyingi `seconds` sekund davomida token bermaslik (RetryAfter)."""
+        self._refill()
+        self._tokens = min(self._tokens, 0) - seconds * self.rate
+
+
+def _buckets_collection():
+    from database import get_db
+    return get_db().broadcast_buckets
+
+
+class SharedTokenBucket:
+    """Barcha worker'lar uchun umumiy token bucket (GCRA), holati MongoDB'da.
+
+    broadcast_buckets'dagi hujjat {_id, tat} - keyingi bo'sh slot vaqti (epoch
+    sekund). Worker bitta atomik find_one_and_update bilan `lease` ta ketma-ket
+    slot band qiladi: birinchisi max(tat, hozir - (capacity - 1) / rate), keyingilari
+    har 1 / rate sekundda. Shuning uchun barcha worker'lar birga sekundiga `rate`
+    tadan (va `capacity` portlashdan) oshmaydi. Uzoq ishlatilmay qolgan slotlar
+    tashlab yuboriladi - tezlik biroz kamayadi, chegara buzilmaydi.
+    """
+
+    def __init__(self, rate: float = BROADCAST_RATE, capacity: int = BROADCAST_BURST,
+                 lease: int = BROADCAST_LEASE, bucket_id: str = BROADCAST_BUCKET_ID, get_collection=None):
+        self.rate = rate
+        self.capacity = capacity
+        self.lease = max(1, min(lease, capacity))
+        self.bucket_id = bucket_id
+        self._get_collection = get_collection or _buckets_collection
+        self._interval = 1 / rate
+        self._tolerance = (capacity - 1) / rate
+        self._slots = collections.deque()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+        self.fallback = TokenBucket(rate / BROADCAST_WORKERS, max(1, capacity // BROADCAST_WORKERS))
+        self.leases = 0
+        self.fallbacks = 0
+
+    def _reserve(self, count: int, not_before: float) -> float:
+        """count ta slot band qilib, birinchisining vaqtini qaytarish (DB thread'ida)."""
+        floor = max(time.time() - self._tolerance, not_before)
+        doc = self._get_collection().find_one_and_update(
+            {"_id": self.bucket_id},
+            [{"$set": {"tat": {"$add": [{"$max": [{"$ifNull": ["$tat", 0]}, floor]}, count * self._interval]}}}],
+            upsert=True, return_document=ReturnDocument.AFTER,
+        )
+        return doc["tat"] - count * self._interval
+
+    def _hold(self, until: float):
+        self._get_collection().update_one({"_id": self.bucket_id}, {"$max": {"tat": until}}, upsert=True)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.time()
+                # Band qilinib, ishlatilmay qolgan eski slotlar - ularni hozir ishlatsak portlash chiqadi
+                while self._slots and self._slots[0] < now - self._tolerance - 1:
+                    self._slots.popleft()
+                if self._slots:
+                    slot = self._slots.popleft()
+                    if slot > now:
+                        await asyncio.sleep(slot - now)
+                    return
+                try:
+                    start = await run_sync(self._reserve, self.lease, self._paused_until)
+                except PyMongoError as e:
+                    self.fallbacks += 1
+                    logger.warning(f"Umumiy bucket'ga ulanib bo'lmadi, jarayon bucket'i ishlatiladi: {e}")
+                    await self.fallback.acquire()
+                    return
+                self.leases += 1
+                self._slots.extend(start + i * self._interval for i in range(self.lease))
+
+    def pause(self, seconds: float):
+        """Keyingi `seconds` sekund davomida barcha worker'larda token bermaslik (RetryAfter)."""
+        until = time.time() + seconds
+        self._paused_until = max(self._paused_until, until)
+        self._slots.clear()
+        self.fallback.pause(seconds)
+        asyncio.get_running_loop().create_task(self._hold_async(until))
+
+    async def _hold_async(self, until: float):
+        try:
+            await run_sync(self._hold, until)
+        except PyMongoError as e:
+            logger.error(f"Umumiy bucket'ni to'xtatib bo'lmadi: {e}")
+
+    def stats(self) -> dict:
+        return {"leases": self.leases, "fallbacks": self.fallbacks}
+
+
+class ChatLimiter:
+    """Bitta chatga xabarlar orasida kamida `interval` sekund bo'lishini ta'minlash."""
+
+    def __init__(self, interval: float, max_chats: int = 100000):
+        self.interval = interval
+        self.max_chats = max_chats
+        self._next = {}  # chat_id -> keyingi ruxsat etilgan vaqt (monotonic)
+
+    async def wait(self, chat_id: int):
+        now = time.monotonic()
+        if len(self._next) >= self.max_chats:
+            self._next = {c: t for c, t in self._next.items() if t > now}
+        at = max(now, self._next.get(chat_id, now))
+        self._next[chat_id] = at + self.interval
+        if at > now:
+            await asyncio.sleep(at - now)
+
+
+def _seconds(retry_after) -> float:
+    return retry_after.total_seconds() if isinstance(retry_after, timedelta) else float(retry_after)
+
+
+async def _aiter(items):
+    # Bazadan oqim (async iterator) ham, oddiy ro'yxat ham qabul qilinadi
+    if hasattr(items, "__aiter__"):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+
+class Broadcaster:
+    """Xabarni ko'p chatga tezlik cheklovi ichida parallel yuboruvchi.
+
+    Bitta nusxa butun jarayon uchun: bir vaqtda ketayotgan bir nechta
+    ommaviy xabar ham umumiy chegaradan oshmaydi.
+    """
+
+    def __init__(self, rate: float = BROADCAST_RATE, burst: int = BROADCAST_BURST,
+                 chat_interval: float = BROADCAST_CHAT_INTERVAL, concurrency: int = BROADCAST_CONCURRENCY,
+                 max_retries: int = BROADCAST_MAX_RETRIES, bucket=None):
+        # bucket berilmasa - faqat shu jarayon uchun (sinov, bitta worker)
+        self.bucket = bucket or TokenBucket(rate, burst)
+        self.chats = ChatLimiter(chat_interval)
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.active = 0
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+
+    async def send(self, bot, chat_id: int, text: str) -> bool:
+        """Bitta xabarni cheklovlar ichida yuborish; 429 va tarmoq xatolarida qayta urinadi.
+
+        Hech qachon xato ko'tarmaydi: yuborilmagan xabar False bilan qaytadi.
+        """
+        for attempt in range(self.max_retries + 1):
+            last = attempt == self.max_retries
+            await self.chats.wait(chat_id)
+            await self.bucket.acquire()
+            try:
+                await bot.send_message(chat_id=chat_id, text=text)
+                self.sent += 1
+                return True
+            except RetryAfter as e:
+                delay = _seconds(e.retry_after)
+                logger.warning(f"Telegram cheklovi: {delay:g} sekund kutiladi")
+                self.bucket.pause(delay)
+            except ChatMigrated as e:
+                # Guruh superguruhga aylangan - xabar yangi id'ga yuboriladi
+                logger.info(f"{chat_id} chat {e.new_chat_id} ga ko'chgan")
+                chat_id = e.new_chat_id
+            except (BadRequest, Forbidden) as e:
+                # Botni bloklagan yoki o'chirilgan chat - qayta urinish foydasiz
+                logger.info(f"{chat_id} ga yuborilmadi: {e}")
+                break
+            except NetworkError as e:
+                logger.warning(f"{chat_id} ga yuborishda tarmoq xatosi: {e}")
+                if not last:
+                    await asyncio.sleep(2 ** attempt)
+            except TelegramError as e:
+                logger.warning(f"{chat_id} ga yuborilmadi: {e}")
+                break
+            except Exception as e:
+                logger.error(f"{chat_id} ga yuborishda kutilmagan xato: {e}")
+                break
+            if not last:
+                self.retried += 1
+        self.failed += 1
+        return False
+
+    async def run(self, bot, chat_ids, text: str, on_progress=None,
+                  progress_every: int = BROADCAST_PROGRESS_EVERY, result: dict = None) -> dict:
+        """chat_ids (async iterator yoki ro'yxat) bo'yicha yuborish; {"total", "sent", "failed"} qaytaradi.
+
+        Semafor bir vaqtdagi yuborishlarni va xotiradagi vazifalarni cheklaydi,
+        shuning uchun chat_id'lar bazadan oqim bilan o'qilishi mumkin. chat_ids
+        o'qishda xato bo'lsa, boshlangan yuborishlar tugashi kutiladi va xato
+        ko'tariladi; shu paytgacha natija `result` lug'atida qoladi.
+        """
+        slots = asyncio.Semaphore(self.concurrency)
+        if result is None:
+            result = {}
+        result.update(total=0, sent=0, failed=0)
+        tasks = set()
+
+        async def deliver(chat_id):
+            try:
+                ok = await self.send(bot, chat_id, text)
+            finally:
+                slots.release()
+            result["sent" if ok else "failed"] += 1
+            done = result["sent"] + result["failed"]
+            if on_progress and progress_every > 0 and done % progress_every == 0:
+                try:
+                    await on_progress(dict(result))
+                except Exception as e:
+                    logger.error(f"Jarayon hisobotini yuborishda xato: {e}")
+
+        self.active += 1
+        try:
+            async for chat_id in _aiter(chat_ids):
+                await slots.acquire()
+                result["total"] += 1
+                task = asyncio.create_task(deliver(chat_id))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        finally:
+            try:
+                if tasks:
+                    await asyncio.gather(*tasks, return_exceptions=True)
+            finally:
+                self.active -= 1
+        return result
+
+    def stats(self) -> dict:
+        stats = {"active": self.active, "sent": self.sent, "failed": self.failed, "retried": self.retried}
+        if isinstance(self.bucket, SharedTokenBucket):
+            stats["bucket"] = self.bucket.stats()
+        return stats
@@ -0,0 +1,100 @@
+# cache.py
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Hajmi cheklangan, TTL bo'yicha eskiradigan LRU kesh (thread-safe)."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # pop/clear har safar oshiradi: o'qish paytida bekor qilingan yozuv keshga qaytmasligi uchun
+        self.generation = 0
+
+    def _expired(self, entry, now) -> bool:
+        return entry[0] <= now
+
+    def _evict(self, now):
+        # Eng eski yozuvlar boshida turadi: avval eskirganlarini, keyin ortiqchasini chiqaramiz
+        while self._data:
+            entry = next(iter(self._data.values()))
+            if not self._expired(entry, now) and len(self._data) <= self.maxsize:
+                break
+            self._data.popitem(last=False)
+
+    def get(self, key, default=None, max_age: float = None):
+        """max_age berilsa, undan eski yozuvlar (TTL tugamagan bo'lsa ham) topilmagan hisoblanadi."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            if self._expired(entry, now):
+                del self._data[key]
+                self.misses += 1
+                return default
+            if max_age is not None and now - (entry[0] - self.ttl) > max_age:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, generation: int = None):
+        """generation berilsa va o'shandan beri pop/clear bo'lgan bo'lsa, yozilmaydi."""
+        now = time.monotonic()
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._data[key] = (now + self.ttl, value)
+            self._data.move_to_end(key)
+            self._evict(now)
+
+    def add(self, key, value=True) -> bool:
+        """Kalit yo'q (yoki eskirgan) bo'lsa qo'shadi va True qaytaradi."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and not self._expired(entry, now):
+                return False
+            self._data[key] = (now + self.ttl, value)
+            self._data.move_to_end(key)
+            self._evict(now)
+            return True
+
+    def pop(self, key, default=None):
+        with self._lock:
+            self.generation += 1
+            entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._data.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def __contains__(self, key) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+_MISSING = object()
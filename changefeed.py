@@ -0,0 +1,101 @@
+# changefeed.py
+"""Boshqa worker'lar yozgan o'zgarishlarni xotiradagi tuzilmalarga yetkazish.
+
+Har bir ChangeFeed bitta kolleksiyaning change stream'ini fon thread'ida
+kuzatadi: avval stream ochiladi, so'ng tuzilma to'liq qayta yuklanadi
+(on_reset) va keyingi har bir o'zgarish on_change bilan qo'llanadi. Stream
+navbati bo'shaganda tuzilma bazaga mos deb belgilanadi (synced_at). Yozuvlar
+uzluksiz kelsa navbat hech bo'shamaydi - shunda moslik vaqti har bir qo'llangan
+hodisaning clusterTime'idan olinadi: tuzilma o'sha paytgacha bazaga mos.
+
+fresh() - oxirgi moslikdan CHANGE_FEED_MAX_LAG soniyadan kam o'tgan. Change
+stream ishlamasa (standalone server) yoki uzilsa, fresh() False qaytaradi va
+chaqiruvchi to'g'ridan-to'g'ri bazadan o'qiydi.
+"""
+import logging
+import os
+import threading
+import time
+
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+CHANGE_FEED_MAX_LAG = float(os.getenv("CHANGE_FEED_MAX_LAG", 5))
+CHANGE_FEED_AWAIT_MS = int(os.getenv("CHANGE_FEED_AWAIT_MS", 1000))
+CHANGE_FEED_RETRY = float(os.getenv("CHANGE_FEED_RETRY", 10))
+
+# Change stream'lar faqat replica set/sharded cluster'da ishlaydi
+_UNSUPPORTED_CODES = {40573}
+
+
+def _event_age(change: dict):
+    """Hodisa bazada yozilganidan beri o'tgan soniya (clusterTime soniya aniqligida); noma'lum bo'lsa None."""
+    cluster_time = change.get("clusterTime")
+    if cluster_time is None:
+        return None
+    return max(0.0, time.time() - cluster_time.time)
+
+
+class ChangeFeed:
+    """Kolleksiya change stream'i -> xotiradagi tuzilma (kesh, indeks)."""
+
+    def __init__(self, name: str, get_collection, on_reset, on_change,
+                 max_lag: float = CHANGE_FEED_MAX_LAG, await_ms: int = CHANGE_FEED_AWAIT_MS,
+                 retry: float = CHANGE_FEED_RETRY):
+        self.name = name
+        self._get_collection = get_collection
+        self.on_reset = on_reset
+        self.on_change = on_change
+        self.max_lag = max_lag
+        self.await_ms = await_ms
+        self.retry = retry
+        self.synced_at = None  # monotonic; None - moslik tasdiqlanmagan
+        self.supported = True
+        self.events = 0
+        self.resets = 0
+        self._thread = None
+
+    def fresh(self) -> bool:
+        synced_at = self.synced_at
+        return synced_at is not None and time.monotonic() - synced_at <= self.max_lag
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f"feed-{self.name}", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self._follow()
+            except OperationFailure as e:
+                if e.code in _UNSUPPORTED_CODES:
+                    self.synced_at = None
+                    self.supported = False
+                    logger.warning(f"{self.name}: change stream qo'llab-quvvatlanmaydi, o'qishlar bazadan bo'ladi")
+                    return
+                logger.error(f"{self.name}: change stream xatosi: {e}")
+            except Exception as e:
+                logger.error(f"{self.name}: change stream uzildi: {e}")
+            # Uzilish paytidagi o'zgarishlar o'tkazib yuborilgan bo'lishi mumkin - qayta ulanganda to'liq yuklanadi
+            self.synced_at = None
+            time.sleep(self.retry)
+
+    def _follow(self):
+        with self._get_collection().watch(full_document="updateLookup", max_await_time_ms=self.await_ms) as stream:
+            self.on_reset()
+            self.resets += 1
+            while stream.alive:
+                change = stream.try_next()
+                if change is None:
+                    self.synced_at = time.monotonic()
+                    continue
+                self.on_change(change)
+                self.events += 1
+                age = _event_age(change)
+                if age is not None:
+                    self.synced_at = max(self.synced_at or 0.0, time.monotonic() - age)
+
+    def stats(self) -> dict:
+        return {"supported": self.supported, "fresh": self.fresh(), "events": self.events, "resets": self.resets}
@@ -1,36 +1,335 @@
-from pymongo import MongoClient
+from pymongo import ASCENDING, DESCENDING, GEOSPHERE, IndexModel, MongoClient, ReturnDocument, UpdateOne
 from pymongo.errors import ServerSelectionTimeoutError
 import os
-from typing import Optional, Tuple, List
+from typing import Iterator, Optional, Tuple, List
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 
+from adjacency import RING_REGION, route_rings
+from cache import TTLCache
+from changefeed import ChangeFeed
+from geo import coordinates, haversine_km, point
+from ranking import MATCH_TOP_K, compatible_seats, scorer, top_k
+from history import HISTORY_ENABLED, HISTORY_TRIP_FIELDS, TripHistory, bucket_start
+from regions import district_id, district_name, region_id, region_name
+from route_index import RouteIndex
+from subscriptions import ANY_DISTRICT, SubscriptionIndex, select_targets, subscription_key, trip_keys
+from utils import trip_departs_until, trip_departure, utc_now
+
 # Loglashni sozlash
 logger = logging.getLogger(__name__)
 
+# get_user uchun LRU+TTL kesh; save_user/delete_user yozuvni bekor qiladi, boshqa worker'lar
+# yozuvlari users change stream'i orqali bekor qilinadi. Stream ishlamasa kesh yozuvlari
+# faqat USER_CACHE_FALLBACK_TTL soniya ishlatiladi.
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10000))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", 300))
+USER_CACHE_FALLBACK_TTL = float(os.getenv("USER_CACHE_FALLBACK_TTL", 5))
+user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
+# Moslashtirish uchun xotiradagi yo'nalish indeksi; boshqa worker'lar yozuvlari trips change
+# stream'i orqali keladi. Stream ortda qolsa yoki ishlamasa, so'rovlar to'g'ridan-to'g'ri bazaga boradi.
+ROUTE_INDEX_ENABLED = os.getenv("ROUTE_INDEX_ENABLED", "1") == "1"
+route_index = RouteIndex()
+
+# Sayohat jo'nash vaqtidan shuncha soat o'tgach TTL indeksi orqali o'chiriladi
+TRIP_LIFETIME_HOURS = float(os.getenv("TRIP_LIFETIME_HOURS", 24))
+
+# Muddati o'tgan sayohatlarni avval arxiv sweeper'i ko'chiradi; TTL indeksi esa
+# TRIP_TTL_GRACE soniyadan keyin qolganlarini o'chiradi (zaxira)
+HISTORY_SWEEP_INTERVAL = float(os.getenv("HISTORY_SWEEP_INTERVAL", 60))
+# Shuncha soniyada o'chirilmagan band qilish (worker o'lgan) eskirgan hisoblanadi va qayta band qilinadi;
+# TRIP_TTL_GRACE'dan ancha kichik bo'lishi kerak
+HISTORY_CLAIM_TIMEOUT = float(os.getenv("HISTORY_CLAIM_TIMEOUT", 600))
+TRIP_TTL_GRACE = int(os.getenv("TRIP_TTL_GRACE", 3600)) if HISTORY_ENABLED else 0
+trip_history = TripHistory(lambda: get_db().trip_history)
+
+# Yo'nalish obunalari: muddati va foydalanuvchi boshiga limit
+SUBSCRIPTION_DAYS = float(os.getenv("SUBSCRIPTION_DAYS", 7))
+SUBSCRIPTION_MAX_PER_USER = int(os.getenv("SUBSCRIPTION_MAX_PER_USER", 5))
+subscription_index = SubscriptionIndex()
+
 MONGODB_URI = os.getenv("MONGODB_URI")
-if not MONGODB_URI:
-    raise RuntimeError("MONGODB_URI topilmadi. .env faylida MONGODB_URI=... deb qo‘ying.")
+MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "SafarTaxiBot")
+# Ulanish pool'i sozlamalari (PyMongo nomlari bilan)
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", 100))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", 0))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", 0)) or None
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", 10000))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", 0)) or None
+# Webhook ochilishidan oldin shuncha ulanish oldindan ochiladi (0 - o'chirilgan)
+MONGO_WARMUP_CONNECTIONS = int(os.getenv("MONGO_WARMUP_CONNECTIONS", 0))
+
+# Ulanish import paytida emas, connect() (yoki birinchi get_db()) chaqirilganda ochiladi
+_client = None
+_db = None
+_connect_lock = threading.Lock()
+
+def connect(warmup: int = MONGO_WARMUP_CONNECTIONS):
+    """MongoClient yaratib, ulanishni tekshirish; kerak bo'lsa pool'ni isitish."""
+    global _client, _db
+    with _connect_lock:
+        if _db is not None:
+            return _db
+        if not MONGODB_URI:
+            raise RuntimeError("MONGODB_URI topilmadi. .env faylida MONGODB_URI=... deb qo‘ying.")
+        client = MongoClient(
+            MONGODB_URI,
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+            maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+            serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+            socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+        )
+        try:
+            client.admin.command("ping")  # Ulanishni tekshirish
+        except ServerSelectionTimeoutError as e:
+            client.close()
+            raise RuntimeError(f"MongoDB ulanishda xatolik: {e}")
+        _client, _db = client, client[MONGO_DB_NAME]
+        logger.info(f"MongoDB ulandi (pool: {MONGO_MIN_POOL_SIZE}-{MONGO_MAX_POOL_SIZE})")
+    if warmup > 0:
+        warm_up(warmup)
+    return _db
+
+def warm_up(connections: int):
+    """Parallel ping'lar bilan pool'da `connections` tagacha ulanishni oldindan ochish."""
+    connections = min(connections, MONGO_MAX_POOL_SIZE)
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=connections, thread_name_prefix="mongo-warmup") as pool:
+        list(pool.map(lambda _: _client.admin.command("ping"), range(connections)))
+    logger.info(f"MongoDB pool isitildi: {connections} ulanish, {time.monotonic() - started:.2f}s")
+
+def get_db():
+    """Joriy baza obyekti; ulanish hali ochilmagan bo'lsa ochadi."""
+    db = _db
+    return db if db is not None else connect()
+
+def close():
+    """Ulanish pool'ini yopish (worker to'xtaganda)."""
+    global _client, _db
+    trip_history.flush()
+    with _connect_lock:
+        if _client is not None:
+            _client.close()
+        _client, _db = None, None
+
+# ------------------ INDEKSLAR ------------------
+ROUTE_FIELDS = ["role", "from_region", "from_district", "to_region", "to_district"]
+
+# Sayohatlarda viloyat/tuman nomlari emas, regions.py'dagi butun son id'lari saqlanadi.
+# Tashqi API nomlar bilan ishlaydi: yozishda kodlanadi, o'qishda nomga qaytariladi.
+def encode_route(from_region: str, from_district: str, to_region: str, to_district: str) -> Tuple[int, int, int, int]:
+    """Yo'nalish nomlari -> (from_region, from_district, to_region, to_district) id'lari."""
+    try:
+        return (region_id(from_region), district_id(from_region, from_district),
+                region_id(to_region), district_id(to_region, to_district))
+    except KeyError as e:
+        raise ValueError(f"Noma'lum hudud: {e}")
+
+def _decode_route(trip: dict) -> dict:
+    trip["from_region"] = region_name(trip["from_region"])
+    trip["from_district"] = district_name(trip["from_district"])
+    trip["to_region"] = region_name(trip["to_region"])
+    trip["to_district"] = district_name(trip["to_district"])
+    return trip
+
+def _route_query(role: str, from_region: str, from_district: str, to_region: str, to_district: str) -> Optional[dict]:
+    """Yo'nalish bo'yicha trips filteri; noma'lum hudud bo'lsa None (mos sayohat bo'lishi mumkin emas)."""
+    try:
+        ids = encode_route(from_region, from_district, to_region, to_district)
+    except ValueError:
+        return None
+    return {"role": role, **dict(zip(ROUTE_FIELDS[1:], ids))}
+
+def backfill_departures(batch_size: int = 1000) -> int:
+    """Jo'nash vaqti yo'q eski sayohatlarga departs_at = expires_at - TRIP_LIFETIME_HOURS qo'yish.
+
+    departs_until yo'q sayohatlarga ham u qo'yiladi (trip_departs_until); to'ldirilgan hujjatlar sonini qaytaradi.
+    """
+    filled, ops = 0, []
+    lifetime = timedelta(hours=TRIP_LIFETIME_HOURS)
+    legacy = get_db().trips.find({"departs_until": {"$exists": False}}, {"when_mode": 1, "departs_at": 1, "expires_at": 1})
+    for trip in legacy:
+        departs_at = trip.get("departs_at")
+        if departs_at is None:
+            departs_at = trip["expires_at"] - lifetime if trip.get("expires_at") else utc_now()
+        departs_until = trip_departs_until(trip.get("when_mode"), departs_at, trip.get("expires_at"))
+        ops.append(UpdateOne({"_id": trip["_id"]}, {"$set": {"departs_at": departs_at, "departs_until": departs_until}}))
+        if len(ops) >= batch_size:
+            filled += get_db().trips.bulk_write(ops, ordered=False).modified_count
+            ops = []
+    if ops:
+        filled += get_db().trips.bulk_write(ops, ordered=False).modified_count
+    return filled
+
+def migrate_route_ids(batch_size: int = 1000) -> int:
+    """Nomlar bilan saqlangan eski sayohatlarni id'larga o'tkazish; o'tkazilganlar sonini qaytaradi."""
+    migrated, ops = 0, []
+    legacy = get_db().trips.find({"from_region": {"$type": "string"}}, {f: 1 for f in ROUTE_FIELDS[1:]})
+    for trip in legacy:
+        try:
+            ids = encode_route(*(trip[f] for f in ROUTE_FIELDS[1:]))
+        except (KeyError, ValueError) as e:
+            logger.error(f"Sayohat {trip['_id']} ko'chirilmadi: {e}")
+            continue
+        ops.append(UpdateOne({"_id": trip["_id"]}, {"$set": dict(zip(ROUTE_FIELDS[1:], ids))}))
+        if len(ops) >= batch_size:
+            migrated += get_db().trips.bulk_write(ops, ordered=False).modified_count
+            ops = []
+    if ops:
+        migrated += get_db().trips.bulk_write(ops, ordered=False).modified_count
+    return migrated
+
+# Kolleksiya -> e'lon qilingan indekslar. init_db bazadagi indekslarni shu ro'yxatga moslaydi.
+INDEXES = {
+    "users": [
+        IndexModel([("user_id", ASCENDING)], name="user_id_unique", unique=True),
+        IndexModel([("role", ASCENDING)], name="role"),
+    ],
+    "trips": [
+        IndexModel([("user_id", ASCENDING)], name="user_id_unique", unique=True),
+        # departs_at - vaqt oynasi yo'nalish ichida diapazon so'rovi bo'ladi; user_id bilan
+        # birga get_match_page'ning keyset tartibini ham beradi (saralash xotirada bo'lmaydi)
+        IndexModel([(f, ASCENDING) for f in ROUTE_FIELDS + ["departs_at", "user_id"]], name="route"),
+        # Eskirgan sayohatlarni MongoDB o'zi o'chiradi (arxiv yoqilgan bo'lsa - kechikish bilan)
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=TRIP_TTL_GRACE),
+        IndexModel([("archive_claim", ASCENDING)], name="archive_claim", sparse=True),
+        # Yaqin haydovchilarni $near bilan topish uchun (joylashuvsiz hujjatlar indeksga kirmaydi)
+        IndexModel([("location", GEOSPHERE), ("role", ASCENDING)], name="location_2dsphere"),
+    ],
+    "route_subscriptions": [
+        IndexModel([(f, ASCENDING) for f in ROUTE_FIELDS], name="route"),
+        IndexModel([("user_id", ASCENDING)], name="user_id"),
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "trip_history": [
+        IndexModel([("start", DESCENDING), ("role", ASCENDING)], name="start_role"),
+    ],
+}
+
+# explain() bilan tekshiriladigan so'rov shakllari: (kolleksiya, filter)
+_ROUTE_SAMPLE = {"role": "driver", "from_region": 0, "from_district": 0, "to_region": 0, "to_district": 0,
+                 "departs_at": {"$gte": datetime(2000, 1, 1), "$lte": datetime(2000, 1, 2)},
+                 "departs_until": {"$gte": datetime(2000, 1, 1)}, "expires_at": {"$gt": datetime(2000, 1, 1)}}
+QUERY_SHAPES = [
+    ("users", {"user_id": 0}),
+    ("users", {"role": "driver"}),
+    ("trips", {"user_id": 0}),
+    ("trips", _ROUTE_SAMPLE),
+    ("trips", {"location": {"$near": {"$geometry": point(41.3, 69.2), "$maxDistance": 5000}}, "role": "driver"}),
+    ("trip_history", {"start": {"$gte": datetime(2000, 1, 1)}}),
+]
+
+# Indeks xossalari: bular farq qilsa indeks qayta yaratiladi
+_INDEX_OPTIONS = ("unique", "sparse", "expireAfterSeconds", "partialFilterExpression")
+
+def _index_matches(existing: dict, declared: dict) -> bool:
+    if list(existing["key"]) != list(declared["key"].items()):
+        return False
+    return all(existing.get(opt) == declared.get(opt) for opt in _INDEX_OPTIONS)
+
+def ensure_indexes(reconcile: bool = False):
+    """Yetishmayotgan indekslarni yaratish.
 
-try:
-    client = MongoClient(MONGODB_URI, serverSelectionTimeoutMS=5000)
-    client.server_info()  # Ulanishni tekshirish
-    db = client['SafarTaxiBot']
-except ServerSelectionTimeoutError as e:
-    raise RuntimeError(f"MongoDB ulanishda xatolik: {e}")
+    reconcile=True (faqat `python database.py check` / release bosqichida, bitta jarayonda):
+    farq qilganlarini qayta yaratish va ortiqchalarini o'chirish. Worker'lar ishga
+    tushganda hech narsa o'chirmaydi - aks holda parallel worker'lar bir-biriga xalaqit beradi.
+    """
+    for collection_name, models in INDEXES.items():
+        collection = get_db()[collection_name]
+        existing = collection.index_information()
+        declared = {m.document["name"]: m.document for m in models}
+        to_create = []
+        for name, info in existing.items():
+            if name == "_id_":
+                continue
+            if name not in declared or not _index_matches(info, declared[name]):
+                if not reconcile:
+                    logger.warning(f"Indeks e'londan farq qiladi: {collection_name}.{name} "
+                                   f"(`python database.py check` bilan moslang)")
+                    continue
+                logger.info(f"Indeks o'chirilmoqda: {collection_name}.{name}")
+                collection.drop_index(name)
+        for model in models:
+            name = model.document["name"]
+            if name in existing and (not reconcile or _index_matches(existing[name], model.document)):
+                continue
+            logger.info(f"Indeks yaratilmoqda: {collection_name}.{name}")
+            to_create.append(model)
+        if to_create:
+            collection.create_indexes(to_create)
 
-def init_db():
+def _plan_stages(plan):
+    """Explain rejasidagi barcha stage nomlarini qaytaradi."""
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for value in plan.values():
+            yield from _plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from _plan_stages(item)
+
+def check_query_plans():
+    """Har bir so'rov shakli uchun explain(); COLLSCAN bo'lsa RuntimeError."""
+    failures = []
+    for collection_name, query in QUERY_SHAPES:
+        plan = get_db()[collection_name].find(query).explain()
+        stages = set(_plan_stages(plan.get("queryPlanner", {}).get("winningPlan", {})))
+        if "COLLSCAN" in stages:
+            failures.append(f"{collection_name} {sorted(query)}")
+    if failures:
+        raise RuntimeError("Indekssiz so'rovlar (COLLSCAN): " + "; ".join(failures))
+    logger.info(f"So'rov rejalari tekshirildi: {len(QUERY_SHAPES)} ta shakl indeksdan foydalanadi")
+
+def init_db(check_plans: bool = os.getenv("DB_CHECK_PLANS") == "1", reconcile_indexes: bool = False):
+    """Worker ishga tushganda: faqat indekslar (va so'ralsa so'rov rejalari).
+
+    To'liq kolleksiyani ko'rib chiqadigan migratsiyalar bu yerda emas - ular
+    release bosqichida bir marta ishlaydi (migrate, `python database.py check`).
+    """
     logger.info("Ma'lumotlar bazasi ishga tushirilmoqda")
-    # Ma'lumotlar bazasi logikasi (masalan, SQLite)
     try:
-        # Bu yerda DB kodini qo‘shing (agar mavjud bo‘lsa)
-        pass
+        ensure_indexes(reconcile_indexes)
+        if check_plans:
+            check_query_plans()
     except Exception as e:
         logger.error(f"DB xatosi: {e}")
         raise
 
+def migrate():
+    """Eski ma'lumotlarni joriy sxemaga keltirish; takror ishga tushirish xavfsiz.
+
+    Bitta jarayonda (release bosqichi) ishga tushiriladi - worker'lar parallel
+    ravishda bir xil to'liq skanlarni qilmasligi va bir-biriga xalaqit bermasligi uchun.
+    """
+    if get_db().counters.find_one({"_id": USER_COUNTERS_ID}) is None:
+        rebuild_user_counters()
+    # Muddati belgilanmagan eski sayohatlarga muddat qo'yish
+    legacy = get_db().trips.update_many(
+        {"expires_at": {"$exists": False}},
+        {"$set": {"expires_at": utc_now() + timedelta(hours=TRIP_LIFETIME_HOURS)}}
+    )
+    if legacy.modified_count:
+        logger.info(f"{legacy.modified_count} ta eski sayohatga muddat belgilandi")
+    backfilled = backfill_departures()
+    if backfilled:
+        logger.info(f"{backfilled} ta eski sayohatga jo'nash vaqti belgilandi")
+    migrated = migrate_route_ids()
+    if migrated:
+        logger.info(f"{migrated} ta sayohat hudud id'lariga ko'chirildi")
+    subscribed = backfill_trip_subscriptions()
+    if subscribed:
+        logger.info(f"{subscribed} ta ochiq sayohatga obuna yaratildi")
+
 def save_user(user_id: int, role: str, full_name: str, phone: str, car_model: Optional[str] = None, car_color: Optional[str] = None, car_number: Optional[str] = None):
     """Foydalanuvchini saqlash."""
     user_data = {
@@ -42,32 +341,78 @@ def save_user(user_id: int, role: str, full_name: str, phone: str, car_model: Op
         "car_color": car_color,
         "car_number": car_number
     }
-    db.users.replace_one({"user_id": user_id}, user_data, upsert=True)
+    previous = get_db().users.find_one_and_replace(
+        {"user_id": user_id}, user_data, projection={"role": 1}, upsert=True,
+        return_document=ReturnDocument.BEFORE
+    )
+    user_cache.pop(user_id)
+    if previous is None:
+        _inc_user_counters({"total": 1, role: 1})
+    elif previous.get("role") != role:
+        _inc_user_counters({role: 1, previous.get("role"): -1})
 
 def save_trip(user_id: int, role: str, from_region: str, from_district: str, to_region: str, to_district: str,
               mahalla: Optional[str], price: Optional[int], seats: str, when_mode: str, when_date: Optional[str], when_time: Optional[str]):
-    """Sayohatni saqlash."""
+    """Sayohatni saqlash. Jo'nash vaqtidan TRIP_LIFETIME_HOURS o'tgach sayohat o'chadi."""
+    departs_at = trip_departure(when_mode, when_date, when_time)
+    expires_at = departs_at + timedelta(hours=TRIP_LIFETIME_HOURS)
+    from_region_id, from_district_id, to_region_id, to_district_id = encode_route(
+        from_region, from_district, to_region, to_district)
     trip_data = {
         "user_id": user_id,
         "role": role,
-        "from_region": from_region,
-        "from_district": from_district,
-        "to_region": to_region,
-        "to_district": to_district,
+        "from_region": from_region_id,
+        "from_district": from_district_id,
+        "to_region": to_region_id,
+        "to_district": to_district_id,
         "mahalla": mahalla,
         "price": price,
         "seats": seats,
         "when_mode": when_mode,
         "when_date": when_date,
-        "when_time": when_time
+        "when_time": when_time,
+        "departs_at": departs_at,
+        "departs_until": trip_departs_until(when_mode, departs_at, expires_at),
+        "expires_at": expires_at
     }
-    db.trips.replace_one({"user_id": user_id}, trip_data, upsert=True)
+    stored = get_db().trips.find_one_and_replace(
+        {"user_id": user_id}, trip_data, projection={"_id": 0}, upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    route_index.put(trip_data)
+    _put_trip_subscription(trip_data)
+    return _trip_from_doc(stored)
+
+def publish_trip(user_id: int, role: str, from_region: str, from_district: str, to_region: str, to_district: str,
+                 mahalla: Optional[str], price: Optional[int], seats: str, when_mode: str, when_date: Optional[str],
+                 when_time: Optional[str]) -> Tuple[Optional[dict], Optional[dict]]:
+    """Sayohatni saqlab, saqlangan sayohat va muallif profilini qaytarish (profil odatda keshdan)."""
+    trip = save_trip(user_id, role, from_region, from_district, to_region, to_district,
+                     mahalla, price, seats, when_mode, when_date, when_time)
+    return trip, get_user(user_id)
+
+def _on_user_change(change: dict):
+    doc = change.get("fullDocument")
+    if doc and "user_id" in doc:
+        user_cache.pop(doc["user_id"])
+    else:
+        # O'chirilgan hujjatda faqat _id bor - qaysi profil ekani noma'lum
+        user_cache.clear()
+
+users_feed = ChangeFeed("users", lambda: get_db().users, user_cache.clear, _on_user_change)
+
+def _cached_user(user_id: int) -> Optional[dict]:
+    return user_cache.get(user_id, max_age=None if users_feed.fresh() else USER_CACHE_FALLBACK_TTL)
 
 def get_user(user_id: int) -> Optional[dict]:
-    """Foydalanuvchi ma'lumotlarini olish."""
-    user = db.users.find_one({"user_id": user_id})
+    """Foydalanuvchi ma'lumotlarini olish (avval keshdan)."""
+    cached = _cached_user(user_id)
+    if cached is not None:
+        return dict(cached)
+    generation = user_cache.generation
+    user = get_db().users.find_one({"user_id": user_id})
     if user:
-        return {
+        profile = {
             'user_id': user['user_id'],
             'role': user['role'],
             'full_name': user['full_name'],
@@ -76,108 +421,639 @@ def get_user(user_id: int) -> Optional[dict]:
             'car_color': user.get('car_color'),
             'car_number': user.get('car_number')
         }
+        user_cache.set(user_id, profile, generation)
+        return dict(profile)
     return None
 
+def get_users(user_ids: List[int]) -> dict:
+    """Bir nechta profilni olish: keshdagilar keshdan, qolganlari bitta $in so'rovida."""
+    result, missing = {}, []
+    for user_id in user_ids:
+        cached = _cached_user(user_id)
+        if cached is not None:
+            result[user_id] = dict(cached)
+        else:
+            missing.append(user_id)
+    if missing:
+        generation = user_cache.generation
+        for user in get_db().users.find({"user_id": {"$in": missing}}):
+            profile = {
+                'user_id': user['user_id'],
+                'role': user['role'],
+                'full_name': user['full_name'],
+                'phone': user['phone'],
+                'car_model': user.get('car_model'),
+                'car_color': user.get('car_color'),
+                'car_number': user.get('car_number')
+            }
+            user_cache.set(user['user_id'], profile, generation)
+            result[user['user_id']] = dict(profile)
+    return result
+
+def get_user_cache_stats() -> dict:
+    """Profil keshi statistikasi (hit/miss, hajm)."""
+    return {**user_cache.stats(), "feed": users_feed.stats()}
+
+def start_change_feeds():
+    """Boshqa worker'lar yozuvlarini kuzatuvchi change stream thread'larini ishga tushirish."""
+    users_feed.start()
+    subscriptions_feed.start()
+    if ROUTE_INDEX_ENABLED:
+        route_index_feed.start()
+
+# ------------------ STATISTIKA ------------------
+# Foydalanuvchilar soni counters kolleksiyasidagi bitta hujjatda saqlanadi:
+# save_user/delete_user uni $inc bilan yangilaydi, o'qish esa bitta find_one.
+USER_COUNTERS_ID = "users"
+
+def _inc_user_counters(deltas: dict):
+    deltas = {k: v for k, v in deltas.items() if k and v}
+    if deltas:
+        get_db().counters.update_one({"_id": USER_COUNTERS_ID}, {"$inc": deltas}, upsert=True)
+
+def rebuild_user_counters() -> dict:
+    """Hisoblagichlarni users kolleksiyasidan bitta $group aggregation bilan qayta hisoblash."""
+    counts = {"total": 0, "driver": 0, "passenger": 0}
+    for row in get_db().users.aggregate([{"$group": {"_id": "$role", "count": {"$sum": 1}}}]):
+        counts["total"] += row["count"]
+        if row["_id"]:
+            counts[row["_id"]] = row["count"]
+    get_db().counters.replace_one({"_id": USER_COUNTERS_ID}, {"_id": USER_COUNTERS_ID, **counts}, upsert=True)
+    return counts
+
+def get_role_counts() -> dict:
+    """{'total', 'driver', 'passenger'} - o'zgarmas vaqtda."""
+    doc = get_db().counters.find_one({"_id": USER_COUNTERS_ID}) or rebuild_user_counters()
+    return {k: doc.get(k, 0) for k in ("total", "driver", "passenger")}
+
 def get_stats():
     """Statistika olish."""
-    user_count = db.users.count_documents({})
-    driver_count = db.users.count_documents({"role": "driver"})
-    passenger_count = db.users.count_documents({"role": "passenger"})
-    return f"Foydalanuvchilar soni: {user_count}\nHaydovchilar soni: {driver_count}\nYo‘lovchilar soni: {passenger_count}"
+    counts = get_role_counts()
+    return f"Foydalanuvchilar soni: {counts['total']}\nHaydovchilar soni: {counts['driver']}\nYo‘lovchilar soni: {counts['passenger']}"
 
 def get_all_drivers():
     """Barcha haydovchilarni olish."""
-    return list(db.users.find({"role": "driver"}))
+    return list(get_db().users.find({"role": "driver"}))
 
 def get_all_passengers():
     """Barcha yo'lovchilarni olish."""
-    return list(db.users.find({"role": "passenger"}))
-
-def get_matching_passengers(from_region: str, from_district: str, to_region: str, to_district: str) -> List[Tuple[int]]:
-    """Mos yo'lovchilarni topish."""
-    passengers = db.trips.find({
-        "role": "passenger",
-        "from_region": from_region,
-        "from_district": from_district,
-        "to_region": to_region,
-        "to_district": to_district
-    }, {"user_id": 1})
-    return [(p["user_id"],) for p in passengers]
-
-def get_matching_drivers(from_region: str, from_district: str, to_region: str, to_district: str) -> List[Tuple[int]]:
-    """Mos haydovchilarni topish."""
-    drivers = db.trips.find({
-        "role": "driver",
-        "from_region": from_region,
-        "from_district": from_district,
-        "to_region": to_region,
-        "to_district": to_district
-    }, {"user_id": 1})
-    return [(d["user_id"],) for d in drivers]
+    return list(get_db().users.find({"role": "passenger"}))
+
+# Ommaviy xabar va admin ro'yxatlari uchun: faqat kerakli maydonlar, partiyalab o'qiladi
+USER_LIST_FIELDS = {"_id": 0, "user_id": 1, "chat_id": 1, "full_name": 1}
+USER_BATCH_SIZE = int(os.getenv("USER_BATCH_SIZE", 500))
+
+def iter_users(role: Optional[str] = None, batch_size: int = USER_BATCH_SIZE) -> Iterator[dict]:
+    """Foydalanuvchilarni {user_id, chat_id, full_name} ko'rinishida oqim bilan olish.
+
+    Kursor batch_size tadan o'qiydi, shuning uchun xotira foydalanuvchilar soniga bog'liq emas.
+    """
+    query = {"role": role} if role else {}
+    for user in get_db().users.find(query, USER_LIST_FIELDS, batch_size=batch_size):
+        # Shaxsiy chatda chat_id user_id bilan bir xil
+        user.setdefault("chat_id", user["user_id"])
+        yield user
+
+def iter_drivers(batch_size: int = USER_BATCH_SIZE) -> Iterator[dict]:
+    return iter_users("driver", batch_size)
+
+def iter_passengers(batch_size: int = USER_BATCH_SIZE) -> Iterator[dict]:
+    return iter_users("passenger", batch_size)
+
+# Aniq tumanlarda shuncha natija bo'lmasa qidiruv qo'shni tumanlarga/viloyatga kengayadi;
+# MATCH_MAX_RING: 0 - faqat aniq tuman, 1 - qo'shni tumanlar, 2 - butun viloyat
+MATCH_MIN_RESULTS = int(os.getenv("MATCH_MIN_RESULTS", 1))
+MATCH_MAX_RING = int(os.getenv("MATCH_MAX_RING", RING_REGION))
+# Jo'nash vaqtlari shuncha soatdan ko'p farq qilsa sayohatlar mos emas (0 - vaqt hisobga olinmaydi)
+MATCH_TIME_WINDOW_HOURS = float(os.getenv("MATCH_TIME_WINDOW_HOURS", 3))
+# Yaqin haydovchilar qidiriladigan radius (km)
+GEO_RADIUS_KM = float(os.getenv("GEO_RADIUS_KM", 5))
+
+# format_match_info uchun kerakli maydonlar
+MATCH_TRIP_FIELDS = ["user_id", "role", "from_region", "from_district", "to_region", "to_district",
+                     "mahalla", "price", "seats", "when_mode", "when_date", "when_time", "departs_at", "departs_until",
+                     "expires_at", "location"]
+MATCH_USER_FIELDS = ["full_name", "phone", "car_model", "car_color", "car_number"]
+
+def rebuild_route_index():
+    """Yo'nalish indeksini bazadagi sayohatlardan qayta qurish."""
+    route_index.rebuild(lambda: get_db().trips.find({}, {f: 1 for f in MATCH_TRIP_FIELDS}))
+    logger.info(f"Yo'nalish indeksi yuklandi: {len(route_index)} ta sayohat")
+
+def _on_trip_change(change: dict):
+    if change["operationType"] == "delete":
+        route_index.remove_doc(change["documentKey"]["_id"])
+        return
+    doc = change.get("fullDocument")
+    if doc is not None:  # None - hujjat o'chib ulgurgan, delete hodisasi keyin keladi
+        route_index.put({"_id": doc["_id"], **{f: doc[f] for f in MATCH_TRIP_FIELDS if f in doc}})
+
+route_index_feed = ChangeFeed("trips", lambda: get_db().trips, rebuild_route_index, _on_trip_change)
+
+def _route_index_fresh() -> bool:
+    """Indeks boshqa worker'lar yozuvlarini ham ko'rgan (CHANGE_FEED_MAX_LAG ichida)."""
+    return ROUTE_INDEX_ENABLED and route_index_feed.fresh()
+
+def _region_of(district: int) -> int:
+    # Tuman id = viloyat id * 100 + tartib raqami (regions.py)
+    return district // 100
+
+def _departure_window(departs_at: Optional[datetime], departs_until: Optional[datetime] = None):
+    """Nomzodning jo'nash oralig'i kesishishi kerak bo'lgan oraliq (departs_at..departs_until ± oyna)."""
+    if departs_at is None or MATCH_TIME_WINDOW_HOURS <= 0:
+        return None, None
+    tolerance = timedelta(hours=MATCH_TIME_WINDOW_HOURS)
+    return departs_at - tolerance, (departs_until or departs_at) + tolerance
+
+def _departure_filter(departs_from: datetime, departs_to: datetime) -> dict:
+    # Oraliqlar kesishishi: departs_at <= departs_to va departs_until >= departs_from. departs_at'ning
+    # quyi chegarasi ("hozir" oralig'i TRIP_LIFETIME_HOURS'dan uzun emas) route indeksi diapazonini toraytiradi
+    lifetime = timedelta(hours=TRIP_LIFETIME_HOURS)
+    return {"departs_at": {"$gte": departs_from - lifetime, "$lte": departs_to},
+            "departs_until": {"$gte": departs_from}}
+
+def _ring_groups(ranks: dict) -> list:
+    """route_rings natijasi -> [(halqa kaliti, {(from, to), ...})], yaqinidan boshlab."""
+    groups = {}
+    for pair, rank in ranks.items():
+        groups.setdefault(rank, set()).add(pair)
+    return sorted(groups.items())
+
+def _page_key(trip: dict, score) -> tuple:
+    # Sahifalash kaliti: barqaror ball (faqat sayohat va qidiruvning o'z qiymatlaridan) va user_id
+    return score(trip), trip["user_id"]
+
+def _fetch_ring(role: str, pairs: set, departs_from, departs_to, allowed_seats, now: datetime,
+                score, after: Optional[tuple], count: Optional[int]) -> List[dict]:
+    """Bitta halqa guruhidagi sayohatlar _page_key tartibida, `after` kalitidan keyin, ko'pi bilan count ta."""
+    if _route_index_fresh():
+        keys = [(role, _region_of(f), f, _region_of(t), t) for f, t in pairs]
+        # TTL monitor daqiqada bir ishlaydi - muddati o'tganlarni o'zimiz ham chiqarib tashlaymiz
+        trips = [t for t in route_index.lookup_many(keys, departs_from, departs_to)
+                 if t.get("expires_at") and t["expires_at"] > now
+                 and (allowed_seats is None or t.get("seats") in allowed_seats)]
+    else:
+        from_ids = {f for f, _ in pairs}
+        to_ids = {t for _, t in pairs}
+        match = {
+            "role": role,
+            "from_region": {"$in": sorted({_region_of(f) for f in from_ids})},
+            "from_district": {"$in": sorted(from_ids)},
+            "to_region": {"$in": sorted({_region_of(t) for t in to_ids})},
+            "to_district": {"$in": sorted(to_ids)},
+            "expires_at": {"$gt": now}
+        }
+        if departs_from is not None:
+            match.update(_departure_filter(departs_from, departs_to))
+        if allowed_seats is not None:
+            match["seats"] = {"$in": allowed_seats}
+        # Ball bazada hisoblanmaydi - halqaning nomzodlari (route indeksi diapazoni) o'qilib, shu yerda tartiblanadi
+        projection = {"_id": 0, **{f: 1 for f in MATCH_TRIP_FIELDS}}
+        trips = [t for t in get_db().trips.find(match, projection)
+                 if (t["from_district"], t["to_district"]) in pairs]
+    if after is not None:
+        trips = [t for t in trips if _page_key(t, score) > after]
+    return top_k(trips, lambda t: _page_key(t, score), count or 0)
+
+def get_match_page(role: str, from_region: str, from_district: str, to_region: str, to_district: str,
+                   departs_at: Optional[datetime] = None, seats: Optional[str] = None,
+                   after: Optional[list] = None, limit: int = MATCH_TOP_K,
+                   departs_until: Optional[datetime] = None) -> Tuple[List[dict], Optional[list]]:
+    """Mos sayohatlarning bitta sahifasi muallif profili bilan: (sahifa, keyingi kursor).
+
+    departs_at berilsa, faqat jo'nash oralig'i qidiruvchinikidan (departs_at..departs_until,
+    "hozir" sayohatida muddati tugaguncha) MATCH_TIME_WINDOW_HOURS ichida bo'lgan
+    sayohatlar olinadi (indeksda bisect, bazada route indeksi bo'yicha diapazon).
+    seats (qidiruvchining o'rinlari yoki "post") berilsa, sig'imi mos kelmaydiganlar
+    chiqariladi. Aniq tumanlarda MATCH_MIN_RESULTS ta sayohat topilmasa, qidiruv
+    qo'shni tumanlarga, keyin butun viloyatga kengayadi (adjacency.py).
+
+    Sahifalash keyset usulida: sayohatlar (halqa, ball, user_id) tartibida halqama-halqa
+    limit + 1 tadan olinadi - birinchi sahifada eng yaqin halqaning eng yaxshi balli
+    sayohatlari. Ball narx/o'rin/vaqt bo'yicha (ranking.py) va faqat sayohatning o'z
+    qiymatlaridan, shuning uchun yangi nomzodlar eski sayohatlar kalitini o'zgartirmaydi.
+    Kursor - [chegara halqa, halqa kaliti, ball, user_id]; chegara halqa birinchi sahifada
+    aniqlanadi va keyingi sahifalarda o'zgarmaydi, shuning uchun sahifalar bir-birini
+    takrorlamaydi va o'tkazib yubormaydi. Profillar faqat sahifadagilar uchun o'qiladi.
+    """
+    query = _route_query(role, from_region, from_district, to_region, to_district)
+    if query is None:
+        return [], None
+    ranks = route_rings(query["from_district"], query["to_district"], MATCH_MAX_RING)
+    departs_from, departs_to = _departure_window(departs_at, departs_until)
+    allowed_seats = compatible_seats(role, seats)
+    score = scorer(role, seats, departs_at, MATCH_TIME_WINDOW_HOURS, departs_until)
+    now = utc_now()
+    wanted = limit + 1 if limit > 0 else None
+    cutoff = start = after_key = None
+    if after is not None:
+        cutoff, ring, ring_sum, score_after, user_after = after
+        start, after_key = (ring, ring_sum), (score_after, user_after)
+    found = []
+    for rank, pairs in _ring_groups(ranks):
+        if cutoff is not None and rank[0] > cutoff:
+            break
+        if start is not None and rank < start:
+            continue
+        count = wanted
+        if wanted is not None:
+            # Birinchi sahifada chegara halqani aniqlash uchun kamida MATCH_MIN_RESULTS ta kerak
+            count = (wanted if cutoff is not None else max(wanted, MATCH_MIN_RESULTS)) - len(found)
+        trips = _fetch_ring(role, pairs, departs_from, departs_to, allowed_seats, now, score,
+                            after_key if rank == start else None, count)
+        found.extend((rank, trip) for trip in trips)
+        if cutoff is None and len(found) >= MATCH_MIN_RESULTS:
+            cutoff = rank[0]
+        if wanted is not None and len(found) >= wanted:
+            break
+    if cutoff is None:
+        cutoff = MATCH_MAX_RING
+    next_cursor = None
+    if 0 < limit < len(found):
+        found = found[:limit]
+        rank, last = found[-1]
+        next_cursor = [cutoff, *rank, *_page_key(last, score)]
+    users = get_users([t["user_id"] for _, t in found])
+    page = [_decode_route({**t, "ring": rank[0], **{f: users[t["user_id"]].get(f) for f in MATCH_USER_FIELDS}})
+            for rank, t in found if t["user_id"] in users]
+    return page, next_cursor
+
+def get_matches(role: str, from_region: str, from_district: str, to_region: str, to_district: str,
+                departs_at: Optional[datetime] = None, seats: Optional[str] = None,
+                limit: int = MATCH_TOP_K, departs_until: Optional[datetime] = None) -> List[dict]:
+    """Eng mos `limit` ta sayohat muallif profili bilan (get_match_page'ning birinchi sahifasi)."""
+    return get_match_page(role, from_region, from_district, to_region, to_district, departs_at, seats, limit=limit,
+                          departs_until=departs_until)[0]
+
+def set_trip_location(user_id: int, latitude: float, longitude: float) -> Optional[dict]:
+    """Faol sayohatga joylashuvni yozish; sayohat bo'lmasa None."""
+    location = point(latitude, longitude)
+    stored = get_db().trips.find_one_and_update(
+        {"user_id": user_id}, {"$set": {"location": location}}, projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if stored is None:
+        return None
+    route_index.update(user_id, location=location)
+    return _trip_from_doc(stored)
+
+def get_nearby_matches(role: str, from_region: str, to_region: str, latitude: float, longitude: float,
+                       radius_km: float = GEO_RADIUS_KM, departs_at: Optional[datetime] = None,
+                       seats: Optional[str] = None, limit: int = MATCH_TOP_K,
+                       departs_until: Optional[datetime] = None) -> List[dict]:
+    """Berilgan nuqtaga eng yaqin, o'sha viloyatlar yo'nalishidagi sayohatlar (distance_km bilan).
+
+    Indeks bazaga mos bo'lsa - xotiradagi to'r indeksi, aks holda 2dsphere
+    indeksi bo'yicha $near + $maxDistance; ikkalasida ham faqat radius ichi ko'riladi.
+    """
+    try:
+        from_region_id, to_region_id = region_id(from_region), region_id(to_region)
+    except KeyError:
+        return []
+    departs_from, departs_to = _departure_window(departs_at, departs_until)
+    allowed_seats = compatible_seats(role, seats)
+    now = utc_now()
+    if _route_index_fresh():
+        matches = []
+        for distance, trip in route_index.nearby(latitude, longitude, radius_km):
+            trip_from = trip.get("departs_at", now)
+            trip_until = trip.get("departs_until") or trip_from
+            if (trip["role"] != role or trip["from_region"] != from_region_id or trip["to_region"] != to_region_id
+                    or not trip.get("expires_at") or trip["expires_at"] <= now
+                    or (allowed_seats is not None and trip.get("seats") not in allowed_seats)
+                    or (departs_from is not None and not (trip_from <= departs_to and trip_until >= departs_from))):
+                continue
+            matches.append(trip)
+            if len(matches) >= limit:
+                break
+    else:
+        query = {
+            "location": {"$near": {"$geometry": point(latitude, longitude), "$maxDistance": radius_km * 1000}},
+            "role": role,
+            "from_region": from_region_id,
+            "to_region": to_region_id,
+            "expires_at": {"$gt": now},
+        }
+        if departs_from is not None:
+            query.update(_departure_filter(departs_from, departs_to))
+        if allowed_seats is not None:
+            query["seats"] = {"$in": allowed_seats}
+        projection = {"_id": 0, **{f: 1 for f in MATCH_TRIP_FIELDS}}
+        matches = list(get_db().trips.find(query, projection).limit(limit))
+    users = get_users([t["user_id"] for t in matches])
+    return [_decode_route({
+        **t,
+        **{f: users[t["user_id"]].get(f) for f in MATCH_USER_FIELDS},
+        "distance_km": haversine_km(latitude, longitude, *coordinates(t["location"])),
+    }) for t in matches if t["user_id"] in users]
+
+def get_nearby_drivers(from_region: str, to_region: str, latitude: float, longitude: float,
+                       departs_at: Optional[datetime] = None, seats: Optional[str] = None,
+                       departs_until: Optional[datetime] = None) -> List[dict]:
+    """Yo'lovchi joylashuviga eng yaqin faol haydovchilar."""
+    return get_nearby_matches("driver", from_region, to_region, latitude, longitude,
+                              departs_at=departs_at, seats=seats, departs_until=departs_until)
 
 def get_user_trip(user_id: int) -> Optional[dict]:
     """Foydalanuvchining sayohat ma'lumotlarini olish."""
     try:
-        trip = db.trips.find_one({"user_id": user_id})
-        if trip:
-            return {
-                'user_id': trip['user_id'],
-                'role': trip['role'],
-                'from_region': trip['from_region'],
-                'from_district': trip['from_district'],
-                'to_region': trip['to_region'],
-                'to_district': trip['to_district'],
-                'mahalla': trip.get('mahalla'),
-                'price': trip.get('price'),
-                'seats': trip.get('seats'),
-                'when_mode': trip.get('when_mode'),
-                'when_date': trip.get('when_date'),
-                'when_time': trip.get('when_time')
-            }
-        return None
+        return _trip_from_doc(get_db().trips.find_one({"user_id": user_id}))
     except Exception as e:
         print(f"Xatolik: {e}")
         return None
 
+def _trip_from_doc(trip: Optional[dict]) -> Optional[dict]:
+    if not trip:
+        return None
+    return {
+        'user_id': trip['user_id'],
+        'role': trip['role'],
+        'from_region': region_name(trip['from_region']),
+        'from_district': district_name(trip['from_district']),
+        'to_region': region_name(trip['to_region']),
+        'to_district': district_name(trip['to_district']),
+        'mahalla': trip.get('mahalla'),
+        'price': trip.get('price'),
+        'seats': trip.get('seats'),
+        'when_mode': trip.get('when_mode'),
+        'when_date': trip.get('when_date'),
+        'when_time': trip.get('when_time'),
+        'departs_at': trip.get('departs_at'),
+        'departs_until': trip.get('departs_until')
+    }
+
 def update_seats(user_id: int, seats: str):
     """Bo'sh o'rinlarni yangilash."""
-    db.trips.update_one({"user_id": user_id}, {"$set": {"seats": seats}})
+    get_db().trips.update_one({"user_id": user_id}, {"$set": {"seats": seats}})
+    route_index.update(user_id, seats=seats)
+    # Sayohat obunasi ham yangi o'rinlar bilan mos kelishi kerak
+    sub = get_db().route_subscriptions.find_one_and_update(
+        {"_id": _trip_subscription_id(user_id)}, {"$set": {"seats": seats}}, return_document=ReturnDocument.AFTER
+    )
+    if sub:
+        subscription_index.put(sub)
 
 def delete_trip(user_id: int):
-    """Sayohatni o'chirish."""
-    db.trips.delete_one({"user_id": user_id})
+    """Sayohatni o'chirish; tugagan sayohat arxivga yoziladi."""
+    trip = get_db().trips.find_one_and_delete({"user_id": user_id}, projection=_HISTORY_PROJECTION)
+    route_index.remove(user_id)
+    _delete_trip_subscription(user_id)
+    if trip and HISTORY_ENABLED:
+        trip_history.archive(trip, "completed", utc_now())
+
+# ------------------ OBUNALAR ------------------
+# Ikki xil obuna bor: foydalanuvchi o'zi yozilgan (viloyatdan viloyatga, SUBSCRIPTION_DAYS kun)
+# va ochiq sayohat orqali (o'sha yo'nalishdagi qarama-qarshi rol, sayohat muddati bilan).
+# Yangi sayohat haqida xabar oluvchilar xotiradagi to'plamlardan olinadi; boshqa worker'lar
+# yozgan obunalar ularga change stream orqali keladi (subscriptions_feed).
+_OPPOSITE_ROLE = {"driver": "passenger", "passenger": "driver"}
+_TRIP_SUBSCRIPTION_FIELDS = ["user_id", "role", *ROUTE_FIELDS[1:], "seats", "departs_at", "departs_until", "expires_at"]
+
+def _trip_subscription_id(user_id: int) -> str:
+    return f"trip:{user_id}"
+
+def _trip_subscription(trip: dict) -> dict:
+    return {
+        "_id": _trip_subscription_id(trip["user_id"]),
+        "user_id": trip["user_id"],
+        "role": _OPPOSITE_ROLE[trip["role"]],
+        **{f: trip[f] for f in ROUTE_FIELDS[1:]},
+        "seats": trip.get("seats"),
+        "departs_at": trip.get("departs_at"),
+        "departs_until": trip.get("departs_until"),
+        "expires_at": trip["expires_at"],
+        "trip": True,
+    }
+
+def _put_trip_subscription(trip: dict):
+    sub = _trip_subscription(trip)
+    get_db().route_subscriptions.replace_one({"_id": sub["_id"]}, sub, upsert=True)
+    subscription_index.put(sub)
+
+def _delete_trip_subscription(user_id: int):
+    get_db().route_subscriptions.delete_one({"_id": _trip_subscription_id(user_id)})
+    subscription_index.remove(_trip_subscription_id(user_id))
+
+def subscribe_route(user_id: int, role: str, from_region: str, to_region: str,
+                    days: float = SUBSCRIPTION_DAYS) -> Optional[dict]:
+    """`role` rolidagi from_region -> to_region sayohatlariga obuna; limit to'lgan bo'lsa None.
+
+    Shu yo'nalishga qayta obuna bo'lish muddatni yangilaydi.
+    """
+    ids = (region_id(from_region), ANY_DISTRICT, region_id(to_region), ANY_DISTRICT)
+    sub_id = f"{user_id}:{role}:" + ":".join(map(str, ids))
+    now = utc_now()
+    subscriptions = get_db().route_subscriptions
+    if subscriptions.find_one({"_id": sub_id}, {"_id": 1}) is None:
+        active = subscriptions.count_documents({"user_id": user_id, "trip": {"$ne": True}, "expires_at": {"$gt": now}})
+        if active >= SUBSCRIPTION_MAX_PER_USER:
+            return None
+    sub = {"_id": sub_id, "user_id": user_id, "role": role, **dict(zip(ROUTE_FIELDS[1:], ids)),
+           "created_at": now, "expires_at": now + timedelta(days=days)}
+    subscriptions.replace_one({"_id": sub_id}, sub, upsert=True)
+    subscription_index.put(sub)
+    return _decode_route(dict(sub))
+
+def get_user_subscriptions(user_id: int) -> List[dict]:
+    """Foydalanuvchining amaldagi (o'zi yozilgan) obunalari."""
+    subs = get_db().route_subscriptions.find(
+        {"user_id": user_id, "trip": {"$ne": True}, "expires_at": {"$gt": utc_now()}}
+    ).sort("expires_at", ASCENDING)
+    return [_decode_route(sub) for sub in subs]
+
+def unsubscribe_all(user_id: int) -> int:
+    """Foydalanuvchining barcha (o'zi yozilgan) obunalarini bekor qilish; nechtasi o'chganini qaytaradi."""
+    query = {"user_id": user_id, "trip": {"$ne": True}}
+    sub_ids = [sub["_id"] for sub in get_db().route_subscriptions.find(query, {"_id": 1})]
+    if sub_ids:
+        get_db().route_subscriptions.delete_many({"_id": {"$in": sub_ids}})
+    for sub_id in sub_ids:
+        subscription_index.remove(sub_id)
+    return len(sub_ids)
+
+def _subscription_keys(role: str, ids: tuple) -> set:
+    """Sayohat haqida xabar beriladigan obuna kalitlari.
+
+    O'zi yozilgan obunalar - trip_keys (aniq tuman va "istalgan tuman"); sayohat
+    obunalari ro'yxatdagi kengaytirilgan qidiruv kabi qo'shni tumanlardan ham
+    (route_rings, MATCH_MAX_RING) - qo'shni halqalar simmetrik.
+    """
+    keys = set(trip_keys(role, *ids))
+    keys.update((role, _region_of(f), f, _region_of(t), t) for f, t in route_rings(ids[1], ids[3], MATCH_MAX_RING))
+    return keys
+
+def get_route_subscribers(trip: dict) -> List[int]:
+    """Yangi sayohat haqida xabar olishi kerak bo'lgan user_id'lar (obuna to'plamlaridan)."""
+    try:
+        ids = encode_route(trip["from_region"], trip["from_district"], trip["to_region"], trip["to_district"])
+    except ValueError:
+        return []
+    keys = _subscription_keys(trip["role"], ids)
+    now = utc_now()
+    if subscriptions_feed.fresh():
+        subs = subscription_index.lookup(keys)
+    else:
+        subs = get_db().route_subscriptions.find({
+            "role": trip["role"],
+            "from_region": {"$in": sorted({key[1] for key in keys})},
+            "from_district": {"$in": sorted({key[2] for key in keys})},
+            "to_region": {"$in": sorted({key[3] for key in keys})},
+            "to_district": {"$in": sorted({key[4] for key in keys})},
+            "expires_at": {"$gt": now},
+        })
+        subs = [sub for sub in subs if subscription_key(sub) in keys]
+    return sorted(select_targets(subs, trip, now, MATCH_TIME_WINDOW_HOURS))
+
+def rebuild_subscription_index():
+    """Obuna to'plamlarini bazadan qayta qurish."""
+    subscription_index.rebuild(lambda: get_db().route_subscriptions.find({"expires_at": {"$gt": utc_now()}}))
+    logger.info(f"Obunalar yuklandi: {len(subscription_index)} ta")
+
+def _on_subscription_change(change: dict):
+    # Obuna _id'si to'plamdagi kalit bilan bir xil - delete hodisasi uchun ham yetarli
+    if change["operationType"] == "delete":
+        subscription_index.remove(change["documentKey"]["_id"])
+        return
+    doc = change.get("fullDocument")
+    if doc is not None:
+        subscription_index.put(doc)
+
+subscriptions_feed = ChangeFeed("route_subscriptions", lambda: get_db().route_subscriptions,
+                                rebuild_subscription_index, _on_subscription_change)
+
+def backfill_trip_subscriptions(batch_size: int = 1000) -> int:
+    """Sayohat obunasi yo'q ochiq sayohatlarga obuna yaratish; yaratilganlar sonini qaytaradi.
+
+    Obunalar paydo bo'lishidan oldin e'lon qilingan sayohatlar uchun. $setOnInsert
+    bilan - qayta ishga tushirish yoki parallel worker mavjud obunani o'zgartirmaydi.
+    """
+    existing = {sub["_id"] for sub in get_db().route_subscriptions.find({"trip": True}, {"_id": 1})}
+    created, ops = 0, []
+    projection = {"_id": 0, **{f: 1 for f in _TRIP_SUBSCRIPTION_FIELDS}}
+    for trip in get_db().trips.find({"expires_at": {"$gt": utc_now()}}, projection):
+        if _trip_subscription_id(trip["user_id"]) in existing:
+            continue
+        sub = _trip_subscription(trip)
+        ops.append(UpdateOne({"_id": sub.pop("_id")}, {"$setOnInsert": sub}, upsert=True))
+        if len(ops) >= batch_size:
+            created += get_db().route_subscriptions.bulk_write(ops, ordered=False).upserted_count
+            ops = []
+    if ops:
+        created += get_db().route_subscriptions.bulk_write(ops, ordered=False).upserted_count
+    return created
+
+# ------------------ ARXIV ------------------
+_HISTORY_PROJECTION = {"_id": 0, "role": 1, "expires_at": 1, **{f: 1 for f in HISTORY_TRIP_FIELDS}}
+
+def archive_expired_trips() -> int:
+    """Muddati o'tgan sayohatlarni arxivga ko'chirib o'chirish.
+
+    Har bir worker avval sayohatlarni o'z belgisi bilan band qiladi (update_many
+    hujjat darajasida atomar), shuning uchun bitta sayohat ikki marta arxivlanmaydi.
+    Band qilgan worker o'chirishdan oldin o'lsa, HISTORY_CLAIM_TIMEOUT dan keyin
+    sayohatlarni boshqa worker qayta band qiladi - TTL ularni arxivsiz o'chirmaydi.
+    """
+    now = utc_now()
+    claim = f"{os.getpid()}:{time.time_ns()}"
+    claimed = get_db().trips.update_many(
+        {"expires_at": {"$lte": now}, "$or": [
+            {"archive_claim": {"$exists": False}},
+            {"archive_claimed_at": {"$lte": now - timedelta(seconds=HISTORY_CLAIM_TIMEOUT)}},
+        ]},
+        {"$set": {"archive_claim": claim, "archive_claimed_at": now}}
+    )
+    if not claimed.modified_count:
+        return 0
+    archived = 0
+    for trip in get_db().trips.find({"archive_claim": claim}, _HISTORY_PROJECTION):
+        trip_history.archive(trip, "expired", trip["expires_at"])
+        route_index.remove(trip["user_id"])
+        archived += 1
+    get_db().trips.delete_many({"archive_claim": claim})
+    return archived
+
+def start_history_sweeper(interval: float = HISTORY_SWEEP_INTERVAL):
+    """Muddati o'tgan sayohatlarni TTL indeksidan oldin arxivga ko'chirib turish."""
+    if not HISTORY_ENABLED or interval <= 0:
+        return
+    def sweep_loop():
+        while True:
+            time.sleep(interval)
+            try:
+                archived = archive_expired_trips()
+                if archived:
+                    logger.info(f"{archived} ta muddati o'tgan sayohat arxivlandi")
+            except Exception as e:
+                logger.error(f"Sayohatlarni arxivlashda xato: {e}")
+    threading.Thread(target=sweep_loop, name="history-sweeper", daemon=True).start()
+
+def get_route_demand(hours: float = 24, role: Optional[str] = None, limit: int = 10) -> List[dict]:
+    """Oxirgi `hours` soatda eng ko'p tugagan yo'nalishlar (faqat so'nggi bucket'lar o'qiladi)."""
+    since = utc_now() - timedelta(hours=hours)
+    match = {"start": {"$gte": bucket_start(since)}}
+    if role:
+        match["role"] = role
+    pipeline = [
+        {"$match": match},
+        {"$unwind": "$trips"},
+        {"$match": {"trips.ended_at": {"$gte": since}}},
+        {"$group": {
+            "_id": {f: f"$trips.{f}" for f in ROUTE_FIELDS[1:]},
+            "trips": {"$sum": 1},
+            "completed": {"$sum": {"$cond": [{"$eq": ["$trips.reason", "completed"]}, 1, 0]}},
+        }},
+        {"$sort": {"trips": -1}},
+        {"$limit": limit},
+    ]
+    return [_decode_route({**row.pop("_id"), **row}) for row in get_db().trip_history.aggregate(pipeline)]
+
+def get_history_stats() -> dict:
+    """Arxiv yozuvchisi holati (navbat, yozilgan, yo'qolgan)."""
+    return trip_history.stats()
 
 def delete_user(user_id: int):
     """Foydalanuvchini o'chirish."""
-    result = db.users.delete_one({"user_id": user_id})
-    return result.deleted_count
+    deleted = get_db().users.find_one_and_delete({"user_id": user_id}, projection={"role": 1})
+    user_cache.pop(user_id)
+    if deleted is None:
+        return 0
+    unsubscribe_all(user_id)
+    _delete_trip_subscription(user_id)
+    _inc_user_counters({"total": -1, deleted.get("role"): -1})
+    return 1
 
 def get_user_count():
     """Umumiy foydalanuvchilar soni."""
-    return db.users.count_documents({})
+    return get_role_counts()["total"]
 
 def get_driver_count():
     """Haydovchilar soni."""
-    return db.users.count_documents({"role": "driver"})
+    return get_role_counts()["driver"]
 
 def get_passenger_count():
     """Yo‘lovchilar soni."""
-    return db.users.count_documents({"role": "passenger"})
+    return get_role_counts()["passenger"]
 
 def get_all_users():
     """Barcha foydalanuvchilarni olish."""
-    return list(db.users.find())
+    return list(get_db().users.find())
 
 # Admin uchun xabar yuborish uchun kerak bo'lsa
 def get_all_drivers_chat_ids():
-    return [user['chat_id'] for user in db.users.find({"role": "driver"}, {"chat_id": 1}) if 'chat_id' in user]
+    return [user['chat_id'] for user in get_db().users.find({"role": "driver"}, {"chat_id": 1}) if 'chat_id' in user]
 
 def get_all_passengers_chat_ids():
-    return [user['chat_id'] for user in db.users.find({"role": "passenger"}, {"chat_id": 1}) if 'chat_id' in user]
+    return [user['chat_id'] for user in get_db().users.find({"role": "passenger"}, {"chat_id": 1}) if 'chat_id' in user]
 
 def get_all_users_chat_ids():
-    return [user['chat_id'] for user in db.users.find({}, {"chat_id": 1}) if 'chat_id' in user]
+    return [user['chat_id'] for user in get_db().users.find({}, {"chat_id": 1}) if 'chat_id' in user]
 
-# Geolokatsiya uchun haydovchilarni olish (sinov)
-def get_matching_drivers(route: str) -> List[dict]:
-    return [{"name": "Haydovchi 1", "chat_id": "123456789"}, {"name": "Haydovchi 2", "chat_id": "987654321"}]
\ No newline at end of file
+if __name__ == "__main__":
+    # python database.py check - indekslarni moslab (o'chirish/qayta yaratish bilan), so'rov rejalarini
+    # tekshirish va migratsiyalar. Release bosqichida bir marta ishga tushiriladi (Procfile: release)
+    import sys
+    logging.basicConfig(level=logging.INFO)
+    check = "check" in sys.argv[1:]
+    init_db(check_plans=check, reconcile_indexes=check)
+    if check:
+        migrate()
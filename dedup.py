@@ -0,0 +1,67 @@
+# dedup.py
+import logging
+import os
+from datetime import datetime, timezone
+
+from pymongo.errors import DuplicateKeyError
+
+from async_database import run_sync
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+UPDATE_DEDUP_SIZE = int(os.getenv("UPDATE_DEDUP_SIZE", 10000))
+UPDATE_DEDUP_TTL = int(os.getenv("UPDATE_DEDUP_TTL", 3600))
+# "memory" (standart) yoki "mongo" - gunicorn worker'lari orasida umumiy
+UPDATE_DEDUP_STORE = os.getenv("UPDATE_DEDUP_STORE", "memory")
+
+
+class UpdateDeduplicator:
+    """Yaqinda ko'rilgan update_id'larni eslab, Telegram qayta yuborgan update'larni tashlab yuboradi."""
+
+    def __init__(self, maxsize: int = UPDATE_DEDUP_SIZE, ttl: int = UPDATE_DEDUP_TTL,
+                 store: str = UPDATE_DEDUP_STORE):
+        self.local = TTLCache(maxsize, ttl)
+        self.ttl = ttl
+        self.shared = store == "mongo"
+        self.duplicates = 0
+        self._collection = None
+
+    def _mongo(self):
+        if self._collection is None:
+            from database import get_db
+            collection = get_db().webhook_updates
+            collection.create_index("created_at", expireAfterSeconds=self.ttl)
+            self._collection = collection
+        return self._collection
+
+    def _mongo_add(self, update_id: int) -> bool:
+        try:
+            self._mongo().insert_one({"_id": update_id, "created_at": datetime.now(timezone.utc)})
+            return True
+        except DuplicateKeyError:
+            return False
+
+    async def seen(self, update_id: int) -> bool:
+        """update_id avval ko'rilgan bo'lsa True; aks holda uni belgilab False qaytaradi."""
+        if not self.local.add(update_id):
+            self.duplicates += 1
+            return True
+        if self.shared:
+            try:
+                if not await run_sync(self._mongo_add, update_id):
+                    self.duplicates += 1
+                    return True
+            except Exception as e:
+                # Umumiy ombor ishlamasa ham update yo'qolmasin - faqat lokal kesh bilan davom etamiz
+                logger.error(f"Dedup omborida xato: {e}")
+        return False
+
+    async def forget(self, update_id: int):
+        """Qabul qilinmagan update'ni unutish, Telegram qayta yuborganda ishlansin."""
+        self.local.pop(update_id)
+        if self.shared:
+            try:
+                await run_sync(self._mongo().delete_one, {"_id": update_id})
+            except Exception as e:
+                logger.error(f"Dedup omborida xato: {e}")
@@ -0,0 +1,78 @@
+# geo.py
+"""Geolokatsiya yordamchilari va xotiradagi to'r (grid) indeksi.
+
+Joylashuv sayohatda GeoJSON nuqta sifatida saqlanadi:
+{"type": "Point", "coordinates": [longitude, latitude]}.
+GeoGrid nuqtalarni GEO_CELL_DEG gradusli kataklarga bo'ladi; radius so'rovi
+faqat doira atrofidagi kataklarni ko'radi.
+"""
+import math
+import os
+
+GEO_CELL_DEG = float(os.getenv("GEO_CELL_DEG", 0.05))  # ~5.5 km kenglik bo'yicha
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEG = 111.32
+
+
+def point(latitude: float, longitude: float) -> dict:
+    return {"type": "Point", "coordinates": [longitude, latitude]}
+
+
+def coordinates(location: dict):
+    """GeoJSON nuqtadan (latitude, longitude)."""
+    longitude, latitude = location["coordinates"]
+    return latitude, longitude
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+class GeoGrid:
+    """key -> (latitude, longitude) to'r indeksi (thread-safe emas, egasi lock bilan o'raydi)."""
+
+    def __init__(self, cell_deg: float = GEO_CELL_DEG):
+        self.cell_deg = cell_deg
+        self._cells = {}  # (i, j) -> {key: (lat, lon)}
+        self._points = {}  # key -> (i, j)
+
+    def _cell(self, latitude: float, longitude: float):
+        return int(math.floor(latitude / self.cell_deg)), int(math.floor(longitude / self.cell_deg))
+
+    def put(self, key, latitude: float, longitude: float):
+        self.remove(key)
+        cell = self._cell(latitude, longitude)
+        self._cells.setdefault(cell, {})[key] = (latitude, longitude)
+        self._points[key] = cell
+
+    def remove(self, key):
+        cell = self._points.pop(key, None)
+        if cell is None:
+            return
+        bucket = self._cells[cell]
+        bucket.pop(key, None)
+        if not bucket:
+            del self._cells[cell]
+
+    def within(self, latitude: float, longitude: float, radius_km: float) -> list:
+        """Radius ichidagi (masofa_km, key) juftliklari, yaqinidan boshlab."""
+        dlat = radius_km / KM_PER_DEG
+        dlon = radius_km / (KM_PER_DEG * max(math.cos(math.radians(latitude)), 0.01))
+        i_min, j_min = self._cell(latitude - dlat, longitude - dlon)
+        i_max, j_max = self._cell(latitude + dlat, longitude + dlon)
+        found = []
+        for i in range(i_min, i_max + 1):
+            for j in range(j_min, j_max + 1):
+                for key, (lat, lon) in self._cells.get((i, j), {}).items():
+                    distance = haversine_km(latitude, longitude, lat, lon)
+                    if distance <= radius_km:
+                        found.append((distance, key))
+        found.sort()
+        return found
+
+    def __len__(self) -> int:
+        return len(self._points)
@@ -0,0 +1,128 @@
+# history.py
+"""Tugagan va muddati o'tgan sayohatlar arxivi.
+
+Sayohatlar trip_history kolleksiyasida vaqt bo'laklari (bucket) ko'rinishida
+saqlanadi: har bir hujjat bitta rol va HISTORY_BUCKET_MINUTES oralig'idagi
+sayohatlarni `trips` massivida jamlaydi (ko'pi bilan HISTORY_BUCKET_CAP ta).
+Yozuvlar so'rov yo'lida emas - fon thread'i navbatdan partiyalab olib,
+bitta tartibsiz bulk_write bilan yozadi.
+"""
+import logging
+import os
+import queue
+import threading
+from datetime import timedelta
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+HISTORY_ENABLED = os.getenv("HISTORY_ENABLED", "1") == "1"
+HISTORY_BUCKET_MINUTES = int(os.getenv("HISTORY_BUCKET_MINUTES", 60))
+HISTORY_BUCKET_CAP = int(os.getenv("HISTORY_BUCKET_CAP", 500))
+HISTORY_BATCH_SIZE = int(os.getenv("HISTORY_BATCH_SIZE", 500))
+HISTORY_FLUSH_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL", 2))
+HISTORY_QUEUE_SIZE = int(os.getenv("HISTORY_QUEUE_SIZE", 50000))
+
+# Arxivda saqlanadigan sayohat maydonlari (hudud maydonlari id ko'rinishida)
+HISTORY_TRIP_FIELDS = ("user_id", "from_region", "from_district", "to_region", "to_district",
+                       "price", "seats", "when_mode", "departs_at")
+
+
+def bucket_start(when, minutes: int = HISTORY_BUCKET_MINUTES):
+    """Vaqtni bucket boshigacha yaxlitlash."""
+    midnight = when.replace(hour=0, minute=0, second=0, microsecond=0)
+    elapsed = int((when - midnight).total_seconds() // 60)
+    return midnight + timedelta(minutes=elapsed - elapsed % minutes)
+
+
+class TripHistory:
+    """Arxivga yozuvchi: archive() navbatga qo'yadi, fon thread'i bucket'larga yozadi."""
+
+    def __init__(self, get_collection, batch_size: int = HISTORY_BATCH_SIZE,
+                 flush_interval: float = HISTORY_FLUSH_INTERVAL, maxsize: int = HISTORY_QUEUE_SIZE):
+        self._get_collection = get_collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self.archived = 0
+        self.dropped = 0
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="trip-history", daemon=True)
+                    self._thread.start()
+
+    def archive(self, trip: dict, reason: str, ended_at):
+        """Sayohatni arxiv navbatiga qo'yish (bloklamaydi)."""
+        entry = {f: trip.get(f) for f in HISTORY_TRIP_FIELDS}
+        entry.update(role=trip["role"], reason=reason, ended_at=ended_at)
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+            logger.error("Arxiv navbati to'la, sayohat arxivlanmadi")
+            return
+        self._ensure_thread()
+
+    def _drain(self, first=None) -> list:
+        entries = [] if first is None else [first]
+        while len(entries) < self.batch_size:
+            try:
+                entries.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return entries
+
+    def _write(self, entries: list):
+        # Bitta partiyadagi bir bucket'ga tushgan yozuvlar bitta $push bilan qo'shiladi
+        buckets = {}
+        for entry in entries:
+            buckets.setdefault((bucket_start(entry["ended_at"]), entry.pop("role")), []).append(entry)
+        # Bucket HISTORY_BUCKET_CAP'dan oshmasligi uchun yozuvlar bo'laklarga bo'linadi va har bir
+        # bo'lak faqat u sig'adigan bucket'ga qo'shiladi; bunday bucket bo'lmasa yangisi ochiladi
+        ops = [
+            UpdateOne(
+                {"start": start, "role": role, "count": {"$lte": HISTORY_BUCKET_CAP - len(chunk)}},
+                {"$push": {"trips": {"$each": chunk}}, "$inc": {"count": len(chunk)},
+                 "$min": {"first": min(e["ended_at"] for e in chunk)},
+                 "$max": {"last": max(e["ended_at"] for e in chunk)}},
+                upsert=True,
+            )
+            for (start, role), items in buckets.items()
+            for chunk in (items[i:i + HISTORY_BUCKET_CAP] for i in range(0, len(items), HISTORY_BUCKET_CAP))
+        ]
+        self._get_collection().bulk_write(ops, ordered=False)
+        self.archived += len(entries)
+
+    def _flush_batch(self, entries: list):
+        with self._write_lock:
+            try:
+                self._write(entries)
+            except Exception as e:
+                logger.error(f"Arxivga yozishda xato ({len(entries)} ta sayohat): {e}")
+                self.dropped += len(entries)
+
+    def _run(self):
+        while True:
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            self._flush_batch(self._drain(first))
+
+    def flush(self):
+        """Navbatdagi barcha yozuvlarni hozir yozish (to'xtashdan oldin)."""
+        while True:
+            entries = self._drain()
+            if not entries:
+                return
+            self._flush_batch(entries)
+
+    def stats(self) -> dict:
+        return {"pending": self._queue.qsize(), "archived": self.archived, "dropped": self.dropped}
@@ -0,0 +1,143 @@
+# ingest.py
+import asyncio
+import logging
+import os
+from collections import deque
+
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", 1000))
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", 8))
+UPDATE_PUT_TIMEOUT = float(os.getenv("UPDATE_PUT_TIMEOUT", 0.5))
+
+
+class UpdateIngestor:
+    """Webhook update'lari uchun chegaralangan navbat va worker'lar to'plami.
+
+    Navbat to'lsa `submit` False qaytaradi (backpressure) - webhook 503 javob
+    beradi va Telegram update'ni keyinroq qayta yuboradi.
+
+    Bitta chat'ning update'lari qat'iy tartibda, bittadan ishlanadi (chat
+    "yo'lagi"), turli chat'lar esa parallel ishlanadi.
+    """
+
+    def __init__(self, application: Application, maxsize: int = UPDATE_QUEUE_SIZE,
+                 workers: int = UPDATE_WORKERS, put_timeout: float = UPDATE_PUT_TIMEOUT, prepare=None, finish=None):
+        self.application = application
+        self.prepare = prepare  # process_update'dan oldin chaqiriladi (masalan, persistence sinxronizatsiyasi)
+        self.finish = finish  # process_update'dan keyin chaqiriladi (masalan, persistence'ga yozish)
+        self.maxsize = maxsize
+        self.workers = workers
+        self.put_timeout = put_timeout
+        self.queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(maxsize)
+        self._lanes = {}
+        self._tasks = []
+        self.accepted = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+        self.busy = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    async def start(self):
+        for i in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(), name=f"update-worker-{i}"))
+        logger.info(f"Update navbati ishga tushdi: {self.workers} worker, hajmi {self.maxsize}")
+
+    async def stop(self):
+        """Navbatdagi update'larni tugatib, worker'larni to'xtatish."""
+        await self.queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, update) -> bool:
+        try:
+            if self.put_timeout > 0:
+                await asyncio.wait_for(self._slots.acquire(), timeout=self.put_timeout)
+            elif self._slots.locked():
+                raise asyncio.TimeoutError
+            else:
+                await self._slots.acquire()
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            logger.warning(f"Update navbati to'la ({self.maxsize}), update rad etildi")
+            return False
+        self.queue.put_nowait((asyncio.get_running_loop().time(), update))
+        self.accepted += 1
+        return True
+
+    @staticmethod
+    def chat_key(update):
+        """Tartib saqlanadigan kalit: chat_id, bo'lmasa user_id."""
+        chat = getattr(update, "effective_chat", None)
+        if chat:
+            return chat.id
+        user = getattr(update, "effective_user", None)
+        return user.id if user else None
+
+    async def _worker(self):
+        while True:
+            item = await self.queue.get()
+            key = self.chat_key(item[1])
+            if key is not None and key in self._lanes:
+                # Bu chat hozir boshqa worker'da - tartib uchun uning yo'lagiga qo'yamiz
+                self._lanes[key].append(item)
+                continue
+            if key is None:
+                await self._process(item)
+                continue
+            lane = self._lanes[key] = deque()
+            try:
+                await self._process(item)
+                while lane:
+                    await self._process(lane.popleft())
+            finally:
+                del self._lanes[key]
+
+    async def _process(self, item):
+        enqueued_at, update = item
+        waited = asyncio.get_running_loop().time() - enqueued_at
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        self.busy += 1
+        try:
+            try:
+                if self.prepare:
+                    await self.prepare(self.application, update)
+                await self.application.process_update(update)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Update'ni qayta ishlashda xato: {e}")
+            if self.finish:
+                try:
+                    await self.finish(self.application, update)
+                except Exception as e:
+                    logger.error(f"Update'dan keyingi ishlovda xato: {e}")
+        finally:
+            self.busy -= 1
+            self._slots.release()
+            self.queue.task_done()
+
+    def stats(self) -> dict:
+        dequeued = self.processed + self.failed + self.busy
+        return {
+            "queue_depth": self.accepted - dequeued,
+            "queue_size": self.maxsize,
+            "workers": self.workers,
+            "busy_workers": self.busy,
+            "active_chats": len(self._lanes),
+            "lane_backlog": sum(len(lane) for lane in self._lanes.values()),
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "processed": self.processed,
+            "failed": self.failed,
+            "wait_avg_ms": round(self.wait_total / dequeued * 1000, 2) if dequeued else 0.0,
+            "wait_max_ms": round(self.wait_max * 1000, 2),
+        }
@@ -27,15 +27,33 @@ def main_menu_passenger():
 def post_route_menu_driver():
     return ReplyKeyboardMarkup([
         [KeyboardButton("Yo‘lovchilarni ko‘rish"), KeyboardButton("Bo‘sh joylar soni")],
+        [KeyboardButton("Geolokatsiya yuborish"), KeyboardButton("🔔 Obuna bo‘lish")],
         [KeyboardButton("Ketdik"), KeyboardButton("Orqaga")]
     ], resize_keyboard=True)
 
 def post_route_menu_passenger():
     return ReplyKeyboardMarkup([
         [KeyboardButton("Haydovchilarni ko‘rish"), KeyboardButton("Geolokatsiya yuborish")],
+        [KeyboardButton("🔔 Obuna bo‘lish")],
         [KeyboardButton("Ketdik"), KeyboardButton("Orqaga")]
     ], resize_keyboard=True)
 
+def match_page_keyboard(role, has_prev, has_next):
+    """Mosliklar sahifasi ostida: oldingi/keyingi tugmalari va yo'nalishdan keyingi menyu."""
+    nav = []
+    if has_prev:
+        nav.append(KeyboardButton("◀️ Oldingi"))
+    if has_next:
+        nav.append(KeyboardButton("Keyingi ▶️"))
+    menu = post_route_menu_driver() if role == "driver" else post_route_menu_passenger()
+    return ReplyKeyboardMarkup(([nav] if nav else []) + list(menu.keyboard), resize_keyboard=True)
+
+def location_keyboard():
+    return ReplyKeyboardMarkup([
+        [KeyboardButton("Geolokatsiya yuborish", request_location=True)],
+        [KeyboardButton("Orqaga")]
+    ], resize_keyboard=True)
+
 def regions_keyboard():
     from regions import regions
     buttons = [[KeyboardButton(r)] for r in regions.keys()]
@@ -81,10 +99,3 @@ def admin_menu_keyboard():
         [KeyboardButton("Foydalanuvchini o‘chirish"), KeyboardButton("Xabar yuborish")],
         [KeyboardButton("Orqaga")]
     ], resize_keyboard=True)
-
-def driver_selection_keyboard():
-    """Haydovchi tanlash uchun keyboard qaytaradi (masalan, sinov ma'lumotlari)."""
-    drivers = ["Haydovchi 1", "Haydovchi 2", "Haydovchi 3"]  # Database'dan haydovchilar ro'yxatini olish kerak
-    keyboard = [drivers[i:i + 2] for i in range(0, len(drivers), 2)]
-    keyboard.append([KeyboardButton(BTN_BACK)])
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=True)
\ No newline at end of file
@@ -1,13 +1,19 @@
-from flask import Flask, request
-import schedule
-import time
+from flask import Flask, request, jsonify
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route
+import contextlib
+import hmac
+import json
 import asyncio
 import logging
 import requests
+import threading
 import os
 from datetime import datetime, timedelta
 
-from telegram import Update, KeyboardButton, ReplyKeyboardMarkup, ReplyKeyboardRemove
+from telegram import Bot, Update, KeyboardButton, ReplyKeyboardMarkup, ReplyKeyboardRemove
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -26,21 +32,29 @@ logger = logging.getLogger(__name__)
 
 # Global
 app = None
+ingestor = None
 
 # ------------------ DATABASE IMPORTS ------------------
-from database import (
+from async_database import (
+    connect as connect_db,
+    close as close_db,
     init_db,
     get_user,
-    get_stats,
-    get_all_drivers,
-    get_all_passengers,
-    get_matching_passengers,
-    get_matching_drivers,
+    get_role_counts,
+    iter_users,
+    get_match_page,
     get_user_trip,
+    set_trip_location,
+    get_nearby_drivers,
     save_user,
-    save_trip,
+    publish_trip,
     update_seats,
     delete_trip,
+    delete_user,
+    subscribe_route,
+    get_user_subscriptions,
+    unsubscribe_all,
+    get_route_subscribers,
 )
 
 import logging
@@ -53,11 +67,24 @@ logger = logging.getLogger(__name__)
 from regions import regions
 
 # ------------------ UTILS ------------------
-from utils import is_valid_date, format_date, format_time
+from utils import LOCAL_TZ, is_valid_date, format_date, format_time, shorten, split_text
+from ingest import UpdateIngestor
+from dedup import UpdateDeduplicator
+from persistence import MongoPersistence
+from database import (GEO_RADIUS_KM, SUBSCRIPTION_DAYS, get_history_stats, get_user_cache_stats, route_index,
+                      route_index_feed, start_change_feeds, start_history_sweeper, subscription_index,
+                      subscriptions_feed)
+from sharding import SHARD_RING_HEADER, SHARD_WORKER, SHARD_WORKERS, ShardRouter
+from broadcast import Broadcaster, SharedTokenBucket
+
+deduplicator = UpdateDeduplicator()
+# Front rejim: update'lar chat_id bo'yicha worker jarayonlarga uzatiladi (sharding.py)
+shard_router = ShardRouter() if SHARD_WORKERS else None
+# Ommaviy xabarlar uchun umumiy tezlik cheklovchi (broadcast.py)
+broadcaster = Broadcaster(bucket=SharedTokenBucket())
 
 from telegram import Update
 from telegram.ext import ContextTypes
-from database import get_all_users, get_all_drivers, get_all_passengers
 
 BTN_BACK = "Orqaga"
 
@@ -65,6 +92,8 @@ BTN_BACK = "Orqaga"
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 WEBHOOK_URL = os.getenv("WEBHOOK_URL")
 PORT = int(os.getenv("PORT", 10000))
+# /metrics faqat shu token bilan ochiladi (Authorization: Bearer <token>); token bo'lmasa o'chiq
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
 
 if not BOT_TOKEN or not WEBHOOK_URL:
     logger.error("BOT_TOKEN yoki WEBHOOK_URL noto‘g‘ri belgilangan!")
@@ -87,8 +116,10 @@ BTN_CHANGE_SEATS = "Bo‘sh joylar soni"
 BTN_GO = "Ketdik"
 
 BTN_SEE_DRIVERS = "Haydovchilarni ko‘rish"
-SELECT_DRIVER = "Haydivchini tanlash"
 BTN_SEND_GEO = "Geolokatsiya yuborish"
+BTN_NEXT_PAGE = "Keyingi ▶️"
+BTN_PREV_PAGE = "◀️ Oldingi"
+BTN_SUBSCRIBE = "🔔 Obuna bo‘lish"
 
 BTN_BACK = "Orqaga"
 BTN_BACK_TO_MENU = "Asosiy menyu"
@@ -146,6 +177,8 @@ from keyboards import (
     main_menu_passenger,
     post_route_menu_driver,
     post_route_menu_passenger,
+    location_keyboard,
+    match_page_keyboard,
     regions_keyboard,
     districts_keyboard,
     seats_keyboard,
@@ -156,22 +189,104 @@ from keyboards import (
 )
 
 # ------------------ FLASK WEBHOOK ------------------
+# Sync (WSGI) rejim: har bir worker uchun bitta doimiy event loop alohida
+# thread'da ishlaydi va Application'ga egalik qiladi. View faqat update'ni
+# navbatga qo'yadi va darhol 200 qaytaradi.
+bot_loop = None
+bot_loop_lock = threading.Lock()
+
+def ensure_bot_loop():
+    global bot_loop
+    with bot_loop_lock:
+        if bot_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="bot-loop", daemon=True).start()
+            asyncio.run_coroutine_threadsafe(startup(), loop).result()
+            bot_loop = loop
+    return bot_loop
+
+shard_ring = None
+
+async def enqueue_update(data: dict, ring: str = None) -> bool:
+    global shard_ring
+    if ring and ring != shard_ring:
+        # Halqa o'zgardi - chat'lar egasi almashgan bo'lishi mumkin, lokal holat qayta tekshiriladi
+        if shard_ring is not None:
+            app.persistence.forget()
+        shard_ring = ring
+    update_id = data.get("update_id")
+    if update_id is not None and await deduplicator.seen(update_id):
+        return True  # Telegram qayta yuborgan update - javob OK, ishlamaymiz
+    update = Update.de_json(data, app.bot)
+    if not await ingestor.submit(update):
+        if update_id is not None:
+            await deduplicator.forget(update_id)
+        return False
+    return True
+
+front_webhook_ready = False
+
+@flask_app.before_request
+def ensure_front_webhook():
+    # Flask front'da lifespan yo'q - webhook birinchi so'rovda (health check ham) bir marta o'rnatiladi
+    global front_webhook_ready
+    if not shard_router or front_webhook_ready:
+        return
+    with bot_loop_lock:
+        if not front_webhook_ready:
+            asyncio.run(set_front_webhook())
+            front_webhook_ready = True
+
 @flask_app.route('/webhook', methods=['POST'])
-async def webhook():
-    global app
+def webhook():
+    if shard_router:
+        status = shard_router.forward(request.get_data(), request.get_json())
+        return ('OK', 200) if status == 200 else ('Busy', status)
+    loop = ensure_bot_loop()
     if not app:
         return 'Bot not ready', 500
-    update = Update.de_json(request.get_json(), app.bot)
-    asyncio.run(app.process_update(update))
+    ring = request.headers.get(SHARD_RING_HEADER)
+    if not asyncio.run_coroutine_threadsafe(enqueue_update(request.get_json(), ring), loop).result():
+        return 'Busy', 503
     return 'OK', 200
 
+def service_stats() -> dict:
+    if shard_router:
+        return shard_router.stats()
+    stats = ingestor.stats() if ingestor else {}
+    stats["duplicate_updates"] = deduplicator.duplicates
+    stats["user_cache"] = get_user_cache_stats()
+    stats["route_index"] = {"trips": len(route_index), **route_index_feed.stats()}
+    stats["trip_history"] = get_history_stats()
+    stats["route_subscriptions"] = {"subscriptions": len(subscription_index), **subscriptions_feed.stats()}
+    stats["broadcast"] = broadcaster.stats()
+    if app:
+        stats["persistence"] = app.persistence.stats()
+    return stats
+
+def metrics_allowed(authorization) -> bool:
+    if not METRICS_TOKEN or not authorization:
+        return False
+    return hmac.compare_digest(authorization, f"Bearer {METRICS_TOKEN}")
+
+@flask_app.route('/metrics')
+def metrics():
+    if not metrics_allowed(request.headers.get('Authorization')):
+        return 'Not found', 404
+    if not shard_router:
+        ensure_bot_loop()
+    return jsonify(service_stats())
+
 @flask_app.route('/')
-async def home():
+def home():
     return 'Safar Taxi Bot is running', 200
 
 async def keep_alive():
     while True:
-        requests.get(f"{WEBHOOK_URL}/")
+        try:
+            await asyncio.to_thread(requests.get, f"{WEBHOOK_URL}/", timeout=10)
+        except Exception as e:
+            logger.warning(f"Keep-alive so'rovi muvaffaqiyatsiz: {e}")
         await asyncio.sleep(300)  # 5 daqiqada bir
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -222,10 +337,13 @@ def format_trip_info(trip):
             f"Narx: {price_str}\n"
             f"🪑 {seats_str}")
 
+# Kartadagi erkin matn maydonlari (ism, mahalla, mashina) uzunligi chegarasi
+CARD_FIELD_LIMIT = int(os.getenv("CARD_FIELD_LIMIT", 64))
+
 def format_match_info(user, trip, is_driver):
-    full_name, phone = user['full_name'], user['phone']
+    full_name, phone = shorten(user['full_name'], CARD_FIELD_LIMIT), user['phone']
     from_region, from_district, to_region, to_district = trip['from_region'], trip['from_district'], trip['to_region'], trip['to_district']
-    mahalla, when_mode, when_date, when_time = trip['mahalla'], trip['when_mode'], trip['when_date'], trip['when_time']
+    mahalla, when_mode, when_date, when_time = shorten(trip['mahalla'], CARD_FIELD_LIMIT), trip['when_mode'], trip['when_date'], trip['when_time']
     seats = trip['seats']
     when = "Hozir" if when_mode == 'now' else f"{when_date} {when_time}"
     mahalla_str = f", {mahalla}" if mahalla else ""
@@ -233,8 +351,12 @@ def format_match_info(user, trip, is_driver):
                 f"Qayerdan?: {from_region}, {from_district}{mahalla_str}\n"
                 f"Qayerga?: {to_region}, {to_district}\n"
                 f"Qachon?: {when}")
+    if trip.get('ring'):
+        # Aniq tuman emas - qo'shni tuman yoki viloyat bo'yicha topilgan
+        direction += "\n📍 Yaqin hududdan"
     if is_driver:
-        car_model, car_color, car_number, price = user['car_model'], user['car_color'], user['car_number'], trip['price']
+        car_model, car_color, car_number = (shorten(user[f], CARD_FIELD_LIMIT) for f in ('car_model', 'car_color', 'car_number'))
+        price = trip['price']
         seats_str = "Pochta" if seats == "post" else f"{seats} bo‘sh o‘rin"
         return (f"{direction}\n"
                 f"👤 {full_name}\n"
@@ -253,7 +375,7 @@ def format_match_info(user, trip, is_driver):
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.message.from_user
     user_id = user.id
-    saved_user = get_user(user_id)
+    saved_user = await get_user(user_id)
     if not saved_user:
         await update.message.reply_text(
         "Safar Taxi botiga xush kelibsiz!\n\n"
@@ -319,7 +441,7 @@ async def register_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Avtomobil modelini kiriting (Nexia 3, Gentra, Cobalt):", reply_markup=back_keyboard())
         return REGISTER_CAR_MODEL
     else:
-        save_user(update.effective_user.id, role, context.user_data['full_name'], context.user_data['phone'])
+        await save_user(update.effective_user.id, role, context.user_data['full_name'], context.user_data['phone'])
         await update.message.reply_text("Tabriklaymiz! Siz yo'lovchi sifatida muvaffaqiyatli ro‘yxatdan o‘tdingiz! Endi yo‘nalish tanlashingiz mumkin.", reply_markup=main_menu_passenger())
         return ConversationHandler.END
 
@@ -350,7 +472,7 @@ async def register_car_number(update: Update, context: ContextTypes.DEFAULT_TYPE
         await update.message.reply_text("Avtomobil raqami 7—10 belgidagi bo‘lsin:", reply_markup=back_keyboard())
         return REGISTER_CAR_NUMBER
     context.user_data['car_number'] = txt.upper()
-    save_user(update.effective_user.id, context.user_data['role'], context.user_data['full_name'], context.user_data['phone'],
+    await save_user(update.effective_user.id, context.user_data['role'], context.user_data['full_name'], context.user_data['phone'],
               context.user_data['car_model'], context.user_data['car_color'], context.user_data['car_number'])
     await update.message.reply_text("Tabriklaymiz! Siz haydovchi sifatida muvaffaqiyatli ro‘yxatdan o‘tdingiz! Endi yo‘nalish tanlashingiz mumkin.", reply_markup=main_menu_driver())
     return ConversationHandler.END
@@ -362,7 +484,7 @@ async def edit_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # ------------------ CHOOSE ROUTE ------------------
 async def choose_route(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user = get_user(update.effective_user.id)
+    user = await get_user(update.effective_user.id)
     if not user:
         await update.message.reply_text("Iltimos, avval ro‘yxatdan o‘ting.", reply_markup=role_keyboard())
         return CHOOSE_ROLE
@@ -377,7 +499,7 @@ async def from_region(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if user_id in ADMIN_IDS:
             await update.message.reply_text("Admin menyusi:", reply_markup=admin_menu_keyboard())
             return ADMIN_MENU
-        user = get_user(user_id)
+        user = await get_user(user_id)
         if user:
             await update.message.reply_text("Profil menyusi:", reply_markup=show_main_menu_by_role(user['role']))
             return ConversationHandler.END
@@ -499,7 +621,8 @@ async def when_plan_date(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if txt == BTN_BACK:
         await update.message.reply_text("Qachon ketasiz?", reply_markup=when_keyboard())
         return WHEN
-    today = datetime.now()
+    # Sana O'zbekiston vaqti bo'yicha (trip_departure ham UTC+5 deb talqin qiladi)
+    today = datetime.now(LOCAL_TZ).date()
     if txt == BTN_TODAY:
         context.user_data['when_date'] = format_date(today)
     elif txt == BTN_TOMORROW:
@@ -512,7 +635,7 @@ async def when_plan_date(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("Sanani to‘g‘ri kiriting (YYYY-MM-DD):", reply_markup=date_keyboard())
             return WHEN_PLAN_DATE
         try:
-            input_date = datetime.strptime(txt, "%Y-%m-%d")
+            input_date = datetime.strptime(txt, "%Y-%m-%d").date()
             if input_date < today:
                 await update.message.reply_text("O‘tgan sanani tanlab bo‘lmaydi. Iltimos, bugun yoki undan keyingi sanani tanlang:", reply_markup=date_keyboard())
                 return WHEN_PLAN_DATE
@@ -554,7 +677,7 @@ async def save_and_notify(update: Update, context: ContextTypes.DEFAULT_TYPE):
     when_time = context.user_data.get('when_time') if when_mode == 'plan' else None
     seats = context.user_data.get('seats')
     try:
-        save_trip(
+        trip, user = await publish_trip(
             user_id,
             role,
             context.user_data['from_region'],
@@ -571,7 +694,6 @@ async def save_and_notify(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         await update.message.reply_text(f"Yo‘nalishni saqlashda xato yuz berdi: {e}. Iltimos, qaytadan urinib ko‘ring.")
         return ConversationHandler.END
-    trip = get_user_trip(user_id)
     if not trip:
         await update.message.reply_text("Yo‘nalish saqlanmadi. Iltimos, qaytadan urinib ko‘ring.")
         return ConversationHandler.END
@@ -579,44 +701,23 @@ async def save_and_notify(update: Update, context: ContextTypes.DEFAULT_TYPE):
     rm = post_route_menu_driver() if role == "driver" else post_route_menu_passenger()
     await update.message.reply_text("Safar boshlanganida Ketdik tugmasini bosishni unutmang\n Quyidagi tugmalardan foydalaning", reply_markup=rm)
     # Notify matching users
-    user = get_user(user_id)
     if not user:
         await update.message.reply_text("Foydalanuvchi ma'lumotlari topilmadi.")
         return ConversationHandler.END
-    if role == "driver":
-        matches = get_matching_passengers(trip['from_region'], trip['from_district'], trip['to_region'], trip['to_district'])
-        for m in matches:
-            match_id = m[0]
-            match_user = get_user(match_id)
-            if not match_user:
-                continue
-            try:
-                await context.bot.send_message(
-                    chat_id=match_id,
-                    text=f"Yangi haydovchi qo'shildi:\n{format_match_info(user, trip, is_driver=True)}"
-                )
-            except Exception as e:
-                print(f"Xato yuborishda (yo'lovchi {match_id}): {e}")
-    else:
-        matches = get_matching_drivers(trip['from_region'], trip['from_district'], trip['to_region'], trip['to_district'])
-        for m in matches:
-            match_id = m[0]
-            match_user = get_user(match_id)
-            if not match_user:
-                continue
-            try:
-                await context.bot.send_message(
-                    chat_id=match_id,
-                    text=f"Yangi yo'lovchi qo'shildi:\n{format_match_info(user, trip, is_driver=False)}"
-                )
-            except Exception as e:
-                print(f"Xato yuborishda (haydovchi {match_id}): {e}")
+    # Xabar oluvchilar obuna to'plamlaridan olinadi: shu yo'nalishga obuna bo'lganlar
+    # va mos ochiq sayohati borlar (qarama-qarshi rol)
+    is_driver = role == "driver"
+    text = f"Yangi {'haydovchi' if is_driver else 'yo‘lovchi'} qo'shildi:\n{format_match_info(user, trip, is_driver=is_driver)}"
+    # Broadcaster orqali: umumiy tezlik chegarasi, 429 qayta urinish; foydalanuvchi kutib qolmaydi
+    targets = await get_route_subscribers(trip)
+    if targets:
+        context.application.create_task(broadcaster.run(context.bot, targets, text), update=update)
 
 # ------------------ AFTER ROUTE MENU ------------------
 async def after_route_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
     txt = update.message.text
     user_id = update.effective_user.id
-    trip = get_user_trip(user_id)
+    trip = await get_user_trip(user_id)
     role = trip['role'] if trip else context.user_data.get('role')
     if not role:
         await update.message.reply_text("Xatolik: Rol topilmadi. Iltimos, qaytadan boshlang.", reply_markup=role_keyboard())
@@ -625,86 +726,138 @@ async def after_route_router(update: Update, context: ContextTypes.DEFAULT_TYPE)
         if user_id in ADMIN_IDS:
             await update.message.reply_text("Admin menyusi:", reply_markup=admin_menu_keyboard())
             return ADMIN_MENU
-        user = get_user(user_id)
+        user = await get_user(user_id)
         if user:
             await update.message.reply_text("Profil menyusi:", reply_markup=show_main_menu_by_role(user['role']))
             return ConversationHandler.END
         return await start(update, context)
+    if txt in (BTN_NEXT_PAGE, BTN_PREV_PAGE):
+        return await show_match_page(update, context, 1 if txt == BTN_NEXT_PAGE else -1)
+    if txt == BTN_SUBSCRIBE:
+        return await subscribe_trip_route(update, context)
     if role == "driver":
         if txt == BTN_SEE_PASSENGERS:
             return await see_passengers(update, context)
         elif txt == BTN_CHANGE_SEATS:
             await update.message.reply_text("Yangi bo‘sh o‘rinlar sonini yoki pochtani tanlang:", reply_markup=seats_keyboard())
             return CHANGE_SEATS_STATE
+        elif txt == BTN_SEND_GEO:
+            await update.message.reply_text("Geolokatsiyangizni yuboring - yaqin atrofdagi yo‘lovchilar sizni ko‘radi:", reply_markup=location_keyboard())
+            return AFTER_ROUTE_MENU
         elif txt == BTN_GO:
-            delete_trip(user_id)
+            await delete_trip(user_id)
             await update.message.reply_text("Oq yo‘l! Sizga yordam berganimizdan xursandmiz", reply_markup=main_menu_driver())
             return ConversationHandler.END
     else:
         if txt == BTN_SEE_DRIVERS:
             return await see_drivers(update, context)
         elif txt == BTN_SEND_GEO:
-            await update.message.reply_text("Geolokatsiyangizni yuboring:", reply_markup=ReplyKeyboardMarkup([[KeyboardButton("Geolokatsiya yuborish", request_location=True)]], resize_keyboard=True))
+            await update.message.reply_text("Geolokatsiyangizni yuboring:", reply_markup=location_keyboard())
             return AFTER_ROUTE_MENU
         elif txt == BTN_GO:
-            delete_trip(user_id)
+            await delete_trip(user_id)
             await update.message.reply_text("Oq yo‘l! Sizga yordam berganimizdan xursandmiz", reply_markup=main_menu_passenger())
             return ConversationHandler.END
     await update.message.reply_text("Iltimos, quyidagi variantlardan birini tanlang:", reply_markup=post_route_menu_driver() if role == "driver" else post_route_menu_passenger())
     return AFTER_ROUTE_MENU
 
-# ------------------ SEE PASSENGERS / DRIVERS ------------------
-async def see_passengers(update: Update, context: ContextTypes.DEFAULT_TYPE):
+# ------------------ SUBSCRIPTIONS ------------------
+async def subscribe_trip_route(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Joriy yo'nalish (viloyatdan viloyatga) bo'yicha yangi sayohatlarga obuna."""
     user_id = update.effective_user.id
-    trip = get_user_trip(user_id)
+    trip = await get_user_trip(user_id)
     if not trip:
         await update.message.reply_text("Yo‘nalish topilmadi. Iltimos, yo‘nalish tanlang.")
         return await choose_route(update, context)
-    try:
-        matches = get_matching_passengers(trip['from_region'], trip['from_district'], trip['to_region'], trip['to_district'])
-        if not matches:
-            await update.message.reply_text("Kechirasiz, siz tanlagan yo‘nalish bo‘yicha hozircha yo‘lovchi topilmadi. Yo‘lovchi kelganda sizga xabar yuboramiz", reply_markup=post_route_menu_driver())
-            return AFTER_ROUTE_MENU
-        lines = []
-        for m in matches:
-            match_user = get_user(m[0])
-            if match_user:
-                match_trip = get_user_trip(m[0])
-                if match_trip:
-                    lines.append(format_match_info(match_user, match_trip, is_driver=False))
-        if not lines:
-            await update.message.reply_text("Kechirasiz, mos yo‘lovchilar topilmadi.", reply_markup=post_route_menu_driver())
-            return AFTER_ROUTE_MENU
-        await update.message.reply_text("\n\n".join(lines), reply_markup=post_route_menu_driver())
-    except Exception as e:
-        await update.message.reply_text(f"Yo‘lovchilarni ko‘rishda xato: {e}. Iltimos, qaytadan urinib ko‘ring.", reply_markup=post_route_menu_driver())
+    is_driver = trip['role'] == "driver"
+    menu = post_route_menu_driver() if is_driver else post_route_menu_passenger()
+    sub = await subscribe_route(user_id, "passenger" if is_driver else "driver", trip['from_region'], trip['to_region'])
+    if not sub:
+        await update.message.reply_text("Obunalar soni chegarasiga yetdingiz. /obunani_bekor bilan eskilarini bekor qiling.", reply_markup=menu)
         return AFTER_ROUTE_MENU
+    who = "yo‘lovchi" if is_driver else "haydovchi"
+    await update.message.reply_text(
+        f"{sub['from_region']} → {sub['to_region']} yo‘nalishida yangi {who} paydo bo‘lsa, "
+        f"{SUBSCRIPTION_DAYS:g} kun davomida xabar beramiz.",
+        reply_markup=menu
+    )
+    return AFTER_ROUTE_MENU
 
-async def see_drivers(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def list_subscriptions(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    subs = await get_user_subscriptions(update.effective_user.id)
+    if not subs:
+        await update.message.reply_text("Sizda obunalar yo‘q.")
+        return
+    lines = [
+        f"{'🚕' if s['role'] == 'driver' else '🧍'} {s['from_region']} → {s['to_region']} "
+        f"({format_date(s['expires_at'] + LOCAL_TZ.utcoffset(None))} gacha)"
+        for s in subs
+    ]
+    await update.message.reply_text("Obunalaringiz:\n" + "\n".join(lines) + "\n\nBekor qilish: /obunani_bekor")
+
+async def cancel_subscriptions(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    count = await unsubscribe_all(update.effective_user.id)
+    await update.message.reply_text(f"{count} ta obuna bekor qilindi." if count else "Sizda obunalar yo‘q.")
+
+# ------------------ SEE PASSENGERS / DRIVERS ------------------
+# Bitta sahifadagi mosliklar soni (4096 belgidan oshsa sahifa bir nechta xabarga bo'linadi)
+MATCH_PAGE_SIZE = int(os.getenv("MATCH_PAGE_SIZE", 10))
+
+async def show_match_page(update: Update, context: ContextTypes.DEFAULT_TYPE, move: int = 0):
+    """Mosliklar sahifasini ko'rsatish; move: 0 - birinchi, 1 - keyingi, -1 - oldingi sahifa.
+
+    Har bir sahifa boshining kursori user_data['match_cursors'] stekida saqlanadi.
+    """
     user_id = update.effective_user.id
-    trip = get_user_trip(user_id)
+    trip = await get_user_trip(user_id)
     if not trip:
         await update.message.reply_text("Yo‘nalish topilmadi. Iltimos, yo‘nalish tanlang.")
         return await choose_route(update, context)
+    is_driver = trip['role'] == "driver"
+    menu = post_route_menu_driver() if is_driver else post_route_menu_passenger()
+    cursors = context.user_data.get('match_cursors') or [None]
+    if move > 0 and context.user_data.get('match_next'):
+        cursors = cursors + [context.user_data['match_next']]
+    elif move < 0 and len(cursors) > 1:
+        cursors = cursors[:-1]
+    elif move == 0:
+        cursors = [None]
     try:
-        matches = get_matching_drivers(trip['from_region'], trip['from_district'], trip['to_region'], trip['to_district'])
-        if not matches:
-            await update.message.reply_text("Kechirasiz, siz tanlagan yo‘nalish bo‘yicha hozircha haydovchi topilmadi. Haydovchi kelganda sizga xabar yuboramiz", reply_markup=post_route_menu_passenger())
-            return AFTER_ROUTE_MENU
-        lines = []
-        for m in matches:
-            match_user = get_user(m[0])
-            if match_user:
-                match_trip = get_user_trip(m[0])
-                if match_trip:
-                    lines.append(format_match_info(match_user, match_trip, is_driver=True))
-        if not lines:
-            await update.message.reply_text("Kechirasiz, mos haydovchilar topilmadi.", reply_markup=post_route_menu_passenger())
-            return AFTER_ROUTE_MENU
-        await update.message.reply_text("\n\n".join(lines), reply_markup=post_route_menu_passenger())
+        matches, next_cursor = await get_match_page(
+            "passenger" if is_driver else "driver",
+            trip['from_region'], trip['from_district'], trip['to_region'], trip['to_district'],
+            trip.get('departs_at'), trip.get('seats'), after=cursors[-1], limit=MATCH_PAGE_SIZE,
+            departs_until=trip.get('departs_until')
+        )
     except Exception as e:
-        await update.message.reply_text(f"Haydovchilarni ko‘rishda xato: {e}. Iltimos, qaytadan urinib ko‘ring.", reply_markup=post_route_menu_passenger())
+        who = "Yo‘lovchilarni" if is_driver else "Haydovchilarni"
+        await update.message.reply_text(f"{who} ko‘rishda xato: {e}. Iltimos, qaytadan urinib ko‘ring.", reply_markup=menu)
+        return AFTER_ROUTE_MENU
+    context.user_data['match_cursors'] = cursors
+    context.user_data['match_next'] = next_cursor
+    if not matches:
+        if len(cursors) > 1:
+            await update.message.reply_text("Boshqa natija yo‘q.", reply_markup=match_page_keyboard(trip['role'], True, False))
+        elif is_driver:
+            await update.message.reply_text("Kechirasiz, siz tanlagan yo‘nalish bo‘yicha hozircha yo‘lovchi topilmadi. Yo‘lovchi kelganda sizga xabar yuboramiz", reply_markup=menu)
+        else:
+            await update.message.reply_text("Kechirasiz, siz tanlagan yo‘nalish bo‘yicha hozircha haydovchi topilmadi. Haydovchi kelganda sizga xabar yuboramiz", reply_markup=menu)
         return AFTER_ROUTE_MENU
+    # Har bir moslik sayohat va profil maydonlarini birga o'z ichiga oladi
+    lines = [format_match_info(m, m, is_driver=not is_driver) for m in matches]
+    messages = split_text([f"{len(cursors)}-sahifa:"] + lines)
+    for text in messages[:-1]:
+        await update.message.reply_text(text)
+    await update.message.reply_text(
+        messages[-1], reply_markup=match_page_keyboard(trip['role'], len(cursors) > 1, next_cursor is not None)
+    )
+    return AFTER_ROUTE_MENU
+
+async def see_passengers(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    return await show_match_page(update, context)
+
+async def see_drivers(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    return await show_match_page(update, context)
 
 # ------------------ CHANGE SEATS (driver) ------------------
 async def change_seats(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -715,7 +868,7 @@ async def change_seats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if txt == BTN_POST:
         context.user_data['seats'] = "post"
         try:
-            update_seats(update.effective_user.id, "post")
+            await update_seats(update.effective_user.id, "post")
             await update.message.reply_text("Pochta tanlandi.", reply_markup=post_route_menu_driver())
             return AFTER_ROUTE_MENU
         except Exception as e:
@@ -726,7 +879,7 @@ async def change_seats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return CHANGE_SEATS_STATE
     seats = txt
     try:
-        update_seats(update.effective_user.id, seats)
+        await update_seats(update.effective_user.id, seats)
         await update.message.reply_text("Bo‘sh o‘rinlar soni yangilandi.", reply_markup=post_route_menu_driver())
         return AFTER_ROUTE_MENU
     except Exception as e:
@@ -745,7 +898,7 @@ async def handle_help_message(update: Update, context: ContextTypes.DEFAULT_TYPE
         if user_id in ADMIN_IDS:
             await update.message.reply_text("Admin menyusi:", reply_markup=admin_menu_keyboard())
             return ADMIN_MENU
-        user = get_user(user_id)
+        user = await get_user(user_id)
         if user:
             await update.message.reply_text("Profil menyusi:", reply_markup=show_main_menu_by_role(user['role']))
             return ConversationHandler.END
@@ -793,7 +946,7 @@ async def reply_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         target_user_id = int(args[0])
         reply_text = " ".join(args[1:])
-        user = get_user(target_user_id)
+        user = await get_user(target_user_id)
         if not user:
             await update.message.reply_text(f"Foydalanuvchi ID {target_user_id} topilmadi.", reply_markup=admin_menu_keyboard())
             return ConversationHandler.END
@@ -823,27 +976,22 @@ async def admin_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     print(f"Admin menu input: {txt}, user_id: {user_id}")  # Debug uchun tugma matnini ko‘rish
     if txt == BTN_BACK:
-        user = get_user(user_id)
+        user = await get_user(user_id)
         if user:
             await update.message.reply_text("Profil menyusi:", reply_markup=show_main_menu_by_role(user['role']))
             return ConversationHandler.END
         return await start(update, context)
     try:
         if txt == BTN_ADMIN_STATS:
-            s = get_stats()
-            drivers_count, passengers_count = s if s else (0, 0)
+            counts = await get_role_counts()
             await update.message.reply_text(
-                f"Statistika:\nHaydovchilar: {drivers_count}\nYo‘lovchilar: {passengers_count}",
+                f"Statistika:\nHaydovchilar: {counts['driver']}\nYo‘lovchilar: {counts['passenger']}",
                 reply_markup=admin_menu_keyboard()
             )
         elif txt == BTN_ADMIN_DRIVERS:
-            ads = get_all_drivers() or []
-            drivers_text = "\n".join([f"{d[1]} - {d[2]}" for d in ads]) if ads else "Yo‘q"
-            await update.message.reply_text(f"Haydovchilar:\n{drivers_text}", reply_markup=admin_menu_keyboard())
+            await reply_user_list(update, "driver", "Haydovchilar", reply_markup=admin_menu_keyboard())
         elif txt == BTN_ADMIN_PASSENGERS:
-            aps = get_all_passengers() or []
-            passengers_text = "\n".join([f"{p[1]} - {p[2]}" for p in aps]) if aps else "Yo‘q"
-            await update.message.reply_text(f"Yo‘lovchilar:\n{passengers_text}", reply_markup=admin_menu_keyboard())
+            await reply_user_list(update, "passenger", "Yo‘lovchilar", reply_markup=admin_menu_keyboard())
         elif txt == BTN_ADMIN_REPLY:
             await update.message.reply_text(
                 "Foydalanuvchiga xabar yuborish uchun format: <user_id> <xabar>\nMasalan: 123456789 Salom, muammoingiz hal qilindi.",
@@ -858,38 +1006,38 @@ async def admin_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return ADMIN_MENU
 
 async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    from database import get_driver_count, get_passenger_count
-    driver_count = get_driver_count()
-    passenger_count = get_passenger_count()
+    counts = await get_role_counts()
     await update.message.reply_text(
         f"Statistika:\n"
-        f"- Haydovchilar soni: {driver_count}\n"
-        f"- Yo'lovchilar soni: {passenger_count}"
+        f"- Haydovchilar soni: {counts['driver']}\n"
+        f"- Yo'lovchilar soni: {counts['passenger']}"
     )
     return ADMIN_MENU
 
+# Telegram xabar uzunligi 4096 belgi; ro'yxat shu chegaradan oshsa bo'laklab yuboriladi
+MESSAGE_CHUNK_LIMIT = 4000
+
+async def reply_user_list(update: Update, role: str, title: str, reply_markup=None):
+    """Foydalanuvchilar ro'yxatini bazadan oqim bilan o'qib, bo'laklab yuborish."""
+    counts = await get_role_counts()
+    if not counts[role]:
+        await update.message.reply_text(f"{title} topilmadi!", reply_markup=reply_markup)
+        return
+    chunk = f"{title} soni: {counts[role]}\n"
+    async for u in iter_users(role):
+        line = f"ID: {u['chat_id']}, Ism: {u.get('full_name', 'N/A')}\n"
+        if len(chunk) + len(line) > MESSAGE_CHUNK_LIMIT:
+            await update.message.reply_text(chunk)
+            chunk = ""
+        chunk += line
+    await update.message.reply_text(chunk or "—", reply_markup=reply_markup)
+
 async def admin_drivers(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    from database import get_all_drivers
-    drivers = get_all_drivers()
-    if not drivers:
-        await update.message.reply_text("Haydovchilar topilmadi!")
-        return ADMIN_MENU
-    message = f"Haydovchilar soni: {len(drivers)}\n"
-    for d in drivers:
-        message += f"ID: {d.get('chat_id', 'N/A')}, Ism: {d.get('name', 'N/A')}\n"
-    await update.message.reply_text(message)
+    await reply_user_list(update, "driver", "Haydovchilar")
     return ADMIN_MENU
 
 async def admin_passengers(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    from database import get_all_passengers
-    passengers = get_all_passengers()
-    if not passengers:
-        await update.message.reply_text("Yo‘lovchilar topilmadi!")
-        return ADMIN_MENU
-    message = f"Yo‘lovchilar soni: {len(passengers)}\n"
-    for p in passengers:
-        message += f"ID: {p.get('chat_id', 'N/A')}, Ism: {p.get('name', 'N/A')}\n"
-    await update.message.reply_text(message)
+    await reply_user_list(update, "passenger", "Yo‘lovchilar")
     return ADMIN_MENU
 
 async def admin_reply(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -907,7 +1055,7 @@ async def admin_reply(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return ADMIN_REPLY
         target_user_id = int(parts[0])
         reply_text = parts[1]
-        user = get_user(target_user_id)
+        user = await get_user(target_user_id)
         if not user:
             await update.message.reply_text(f"Foydalanuvchi ID {target_user_id} topilmadi. Iltimos, to‘g‘ri ID kiriting.", reply_markup=admin_menu_keyboard())
             return ADMIN_MENU
@@ -942,23 +1090,43 @@ async def send_to_all_groups(update: Update, context: ContextTypes.DEFAULT_TYPE)
     await update.message.reply_text("Iltimos, xabar matnini yuboring:")
     return "SEND_TO_ALL_GROUPS"
 
+async def send_to_users(update: Update, context: ContextTypes.DEFAULT_TYPE, role, message_text: str):
+    """Ommaviy xabarni fon vazifasi sifatida boshlash - admin suhbati bloklanmaydi.
+
+    Yuborish broadcaster orqali (tezlik cheklovi, 429 qayta urinish); jarayon va
+    yakuniy natija adminga xabar qilinadi.
+    """
+    admin_chat_id = update.effective_chat.id
+
+    async def report(progress: dict):
+        # Hisobotlar ham umumiy chegara ichida - ular ham Telegram limitiga kiradi
+        await broadcaster.send(context.bot, admin_chat_id,
+                               f"Yuborilmoqda: {progress['sent']} ta yuborildi, {progress['failed']} ta xato")
+
+    async def run():
+        # Har qanday holatda admin natijani oladi - foydalanuvchilarni o'qish uzilsa ham
+        result = {}
+        try:
+            chat_ids = (user['chat_id'] async for user in iter_users(role))
+            await broadcaster.run(context.bot, chat_ids, message_text, on_progress=report, result=result)
+            logger.info(f"Ommaviy xabar tugadi: {result}")
+            text = f"Xabar yuborildi: {result['sent']} ta, yuborilmadi: {result['failed']} ta (jami {result['total']})"
+        except Exception as e:
+            logger.error(f"Ommaviy xabar to'xtadi: {e} ({result})")
+            text = (f"Xabar yuborish xato bilan to'xtadi: {e}. "
+                    f"Yuborildi: {result.get('sent', 0)} ta, yuborilmadi: {result.get('failed', 0)} ta")
+        if not await broadcaster.send(context.bot, admin_chat_id, text):
+            logger.error(f"Natijani adminga yuborib bo'lmadi: {text}")
+
+    context.application.create_task(run(), update=update)
+
 async def handle_send_to_all_groups(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     message_text = update.message.text
-    from database import get_all_drivers, get_all_passengers
-    drivers = get_all_drivers()
-    passengers = get_all_passengers()
-    all_users = drivers + passengers
-    if not all_users:
+    if not (await get_role_counts())['total']:
         await update.message.reply_text("Hech qanday foydalanuvchi topilmadi!")
         return ADMIN_MENU
-    for user in all_users:
-        try:
-            chat_id = user[0] if isinstance(user, tuple) else user.get('chat_id', 'N/A')
-            await context.bot.send_message(chat_id=chat_id, text=message_text)
-            logger.info(f"Message sent to chat_id {chat_id}")
-        except Exception as e:
-            logger.error(f"Failed to send to {chat_id}: {str(e)}")
-    await update.message.reply_text("Xabar yuborildi!")
+    await send_to_users(update, context, None, message_text)
+    await update.message.reply_text("Xabar yuborish boshlandi. Tugagach natijani yuboraman.", reply_markup=admin_menu_keyboard())
     return ADMIN_MENU
 
 async def send_message_to_drivers(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -970,18 +1138,11 @@ async def send_message_to_drivers(update: Update, context: ContextTypes.DEFAULT_
 
 async def handle_send_to_drivers(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     message_text = update.message.text
-    from database import get_all_drivers
-    drivers = get_all_drivers()
-    if not drivers:
+    if not (await get_role_counts())['driver']:
         await update.message.reply_text("Hech qanday haydovchi topilmadi!")
         return ADMIN_MENU
-    for driver in drivers:
-        try:
-            await context.bot.send_message(chat_id=driver.get('chat_id', 'N/A'), text=message_text)
-            logger.info(f"Message sent to chat_id {driver.get('chat_id', 'N/A')}")
-        except Exception as e:
-            logger.error(f"Failed to send to {driver.get('chat_id', 'N/A')}: {str(e)}")
-    await update.message.reply_text("Xabar haydovchilarga muvaffaqiyatli yuborildi!")
+    await send_to_users(update, context, "driver", message_text)
+    await update.message.reply_text("Xabar yuborish boshlandi. Tugagach natijani yuboraman.", reply_markup=admin_menu_keyboard())
     return ADMIN_MENU
 
 async def send_message_to_passengers(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -993,18 +1154,11 @@ async def send_message_to_passengers(update: Update, context: ContextTypes.DEFAU
 
 async def handle_send_to_passengers(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     message_text = update.message.text
-    from database import get_all_passengers
-    passengers = get_all_passengers()
-    if not passengers:
+    if not (await get_role_counts())['passenger']:
         await update.message.reply_text("Hech qanday yo‘lovchi topilmadi!")
         return ADMIN_MENU
-    for passenger in passengers:
-        try:
-            await context.bot.send_message(chat_id=passenger.get('chat_id', 'N/A'), text=message_text)
-            logger.info(f"Message sent to chat_id {passenger.get('chat_id', 'N/A')}")
-        except Exception as e:
-            logger.error(f"Failed to send to {passenger.get('chat_id', 'N/A')}: {str(e)}")
-    await update.message.reply_text("Xabar yo‘lovchilarga muvaffaqiyatli yuborildi!")
+    await send_to_users(update, context, "passenger", message_text)
+    await update.message.reply_text("Xabar yuborish boshlandi. Tugagach natijani yuboraman.", reply_markup=admin_menu_keyboard())
     return ADMIN_MENU
 
 async def delete_user_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1019,8 +1173,8 @@ async def delete_user_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     
     try:
         target_user_id = int(context.args[0])
-        from database import delete_user
-        deleted_count = delete_user(target_user_id)
+        from async_database import delete_user
+        deleted_count = await delete_user(target_user_id)
         if deleted_count > 0:
             await update.message.reply_text(f"User ID {target_user_id} muvaffaqiyatli o‘chirildi.")
         else:
@@ -1052,35 +1206,20 @@ async def delete_user_input(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return "DELETE_USER_INPUT"
 
     # Foydalanuvchini o'chirish logikasi
-    success = delete_user(user_id)
+    success = await delete_user(user_id)
     if success:
         await update.message.reply_text(f"Foydalanuvchi ID {user_id} muvaffaqiyatli o'chirildi!")
     else:
         await update.message.reply_text(f"Foydalanuvchi ID {user_id} topilmadi yoki o'chirishda xatolik yuz berdi!")
     return ADMIN_MENU  
 
-async def check_expired_trips():
-    from database import delete_expired_trips
-    deleted_count = delete_expired_trips()
-    if deleted_count > 0:
-        print(f"{deleted_count} ta eskirgan trip o‘chirildi.")
-
-def run_schedule():
-    schedule.every(24).hours.do(lambda: asyncio.run(check_expired_trips()))
-    while True:
-        schedule.run_pending()
-        time.sleep(60)    
-
-async def set_webhook():
-    await app.bot.set_webhook(url=WEBHOOK_URL + "/webhook")
-    print("Webhook sozlandi:", WEBHOOK_URL + "/webhook")
-
 route_conv = ConversationHandler(
         entry_points=[
             MessageHandler(filters.Regex(f"^{BTN_EDIT_PROFILE}$"), edit_profile),
             MessageHandler(filters.Regex(f"^{BTN_CHOOSE_ROUTE}$"), choose_route),
             MessageHandler(
-                filters.Regex(f"^{BTN_SEE_PASSENGERS}$|^{BTN_CHANGE_SEATS}$|^{BTN_GO}$|^{BTN_SEE_DRIVERS}$|^{BTN_SEND_GEO}$|^{BTN_BACK}$"),
+                filters.Regex(f"^{BTN_SEE_PASSENGERS}$|^{BTN_CHANGE_SEATS}$|^{BTN_GO}$|^{BTN_SEE_DRIVERS}$|^{BTN_SEND_GEO}$|^{BTN_BACK}$"
+                          f"|^{BTN_NEXT_PAGE}$|^{BTN_PREV_PAGE}$|^{BTN_SUBSCRIBE}$"),
                 after_route_router
             ),
             MessageHandler(filters.Regex(f"^{BTN_HELP}$"), help_cmd),
@@ -1132,6 +1271,8 @@ route_conv = ConversationHandler(
             MessageHandler(filters.Regex(f"^{BTN_BACK_TO_MENU}$"), start),
         ],
         per_chat=True,
+        name="route_conv",
+        persistent=True,
     )
 
 start_conv = ConversationHandler(
@@ -1149,95 +1290,148 @@ start_conv = ConversationHandler(
         },
         fallbacks=[MessageHandler(filters.Regex(f"^{BTN_BACK_TO_MENU}$"), start)],
         per_chat=True,
+        name="start_conv",
+        persistent=True,
     )
 
-async def request_location(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    user = get_user(update.effective_user.id)
-    if not user or user.get('role') != 'passenger':
-        await update.message.reply_text("Siz yo‘lovchi emassiz!")
+async def handle_location(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Joylashuvni sayohatga yozish; yo'lovchiga eng yaqin haydovchilarni ko'rsatish."""
+    location = update.message.location
+    user_id = update.effective_user.id
+    user = await get_user(user_id)
+    trip = await set_trip_location(user_id, location.latitude, location.longitude) if user else None
+    if not trip:
+        await update.message.reply_text("Avval yo‘nalish tanlang, so‘ng geolokatsiya yuboring.")
         return ConversationHandler.END
-    from database import get_matching_drivers
-    drivers = get_matching_drivers(user.get('route')) or [{"name": "Test Driver", "chat_id": 123456789}]  # Sinov
-    if not drivers:
-        await update.message.reply_text("Haydovchi topilmadi!")
+    if user['role'] == "driver":
+        await update.message.reply_text("Geolokatsiya saqlandi! Yaqin atrofdagi yo‘lovchilar sizni ko‘radi.", reply_markup=post_route_menu_driver())
         return ConversationHandler.END
-    keyboard = [[KeyboardButton(driver['name'])] for driver in drivers] + [[KeyboardButton(BTN_BACK)]]
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=True)
-    await update.message.reply_text("Haydovchini tanlang:", reply_markup=reply_markup)
-    context.user_data['drivers'] = drivers
-    return SELECT_DRIVER
-
-async def select_driver(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    selected_driver = update.message.text
-    drivers = context.user_data.get('drivers', [])
-    driver = next((d for d in drivers if d['name'] == selected_driver), None)
-    if not driver or update.message.text == BTN_BACK:
-        await update.message.reply_text("Orqaga qaytildi.", reply_markup=main_menu_keyboard())
+    drivers = await get_nearby_drivers(trip['from_region'], trip['to_region'], location.latitude, location.longitude,
+                                       trip.get('departs_at'), trip.get('seats'), trip.get('departs_until'))
+    if not drivers:
+        await update.message.reply_text(f"{GEO_RADIUS_KM:g} km atrofda bu yo‘nalishda haydovchi topilmadi.", reply_markup=post_route_menu_passenger())
         return ConversationHandler.END
-    context.user_data['selected_driver'] = driver
-    keyboard = [[KeyboardButton("Geolokatsiya yuborish", request_location=True)]]
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=True)
-    await update.message.reply_text("Geolokatsiyangizni yuboring:", reply_markup=reply_markup)
+    lines = [f"{format_match_info(m, m, is_driver=True)}\n📍 {m['distance_km']:.1f} km" for m in drivers]
+    messages = split_text(["Eng yaqin haydovchilar:"] + lines)
+    for text in messages[:-1]:
+        await update.message.reply_text(text)
+    await update.message.reply_text(messages[-1], reply_markup=post_route_menu_passenger())
     return ConversationHandler.END
 
-async def handle_location(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    if update.message.location:
-        latitude = update.message.location.latitude
-        longitude = update.message.location.longitude
-        driver = context.user_data.get('selected_driver')
-        if driver and 'chat_id' in driver:
-            await context.bot.send_message(
-                chat_id=driver['chat_id'],
-                text=f"Yo‘lovchi geolokatsiya: {latitude}, {longitude}"
-            )
-        await update.message.reply_text("Geolokatsiya yuborildi!", reply_markup=main_menu_keyboard())
-    return ConversationHandler.END
+# ------------------ MAIN ------------------
+def build_application() -> Application:
+    application = Application.builder().token(BOT_TOKEN).updater(None).persistence(MongoPersistence(trust_local=SHARD_WORKER)).build()
 
-location_conv = ConversationHandler(
-    entry_points=[MessageHandler(filters.Regex(f"^{BTN_SEND_GEO}$"), request_location)],
-    states={
-        SELECT_DRIVER: [
-            MessageHandler(filters.TEXT & ~filters.COMMAND, select_driver),
-            MessageHandler(filters.LOCATION & ~filters.COMMAND, handle_location)
-        ],
-    },
-    fallbacks=[MessageHandler(filters.Regex(f"^{BTN_BACK}$"), lambda update, context: ConversationHandler.END)],
-    per_chat=True,
-)
+    # Handler larni qo'shish
+    application.add_handler(route_conv)
+    application.add_handler(start_conv)
+    application.add_error_handler(error_handler)
+    application.add_handler(MessageHandler(filters.LOCATION, handle_location))
+    application.add_handler(CommandHandler("reply", reply_command))
+    application.add_handler(CommandHandler("send_all", send_to_all_groups))
+    application.add_handler(CommandHandler("send_drivers", send_message_to_drivers))
+    application.add_handler(CommandHandler("send_passengers", send_message_to_passengers))
+    application.add_handler(CommandHandler("obunalar", list_subscriptions))
+    application.add_handler(CommandHandler("obunani_bekor", cancel_subscriptions))
+    return application
+
+keep_alive_task = None
+
+async def set_webhook(bot):
+    webhook_url = WEBHOOK_URL + "/webhook"
+    await bot.set_webhook(url=webhook_url)
+    logger.info(f"Webhook: {webhook_url}")
 
-# ------------------ MAIN ------------------
-async def main():
-    global app
-    init_db()
+async def set_front_webhook():
+    """Shard front botni ishga tushirmaydi - webhook alohida Bot bilan o'rnatiladi."""
+    async with Bot(BOT_TOKEN) as bot:
+        await set_webhook(bot)
+
+async def startup():
+    """Worker ishga tushganda: DB, Application va webhook'ni tayyorlash."""
+    global app, ingestor, keep_alive_task
+    # Ulanish (va MONGO_WARMUP_CONNECTIONS bo'lsa pool isitish) webhook o'rnatilishidan oldin
+    await connect_db()
+    await init_db()
+    start_change_feeds()
+    start_history_sweeper()
     logger.info("DB ulandi")
 
-    app = Application.builder().token(os.getenv("BOT_TOKEN")).build()
-    await app.initialize()
+    application = build_application()
+    await application.initialize()
+    await application.start()
+    ingestor = UpdateIngestor(application, prepare=application.persistence.sync_conversations,
+                              finish=application.persistence.write_behind)
+    await ingestor.start()
+    application.persistence.start()
     logger.info("Bot yaratildi")
 
-    # Handler larni qo'shish
-    app.add_handler(route_conv)
-    app.add_handler(start_conv)
-    app.add_handler(location_conv)
-    app.add_error_handler(error_handler)
-    app.add_handler(MessageHandler(filters.LOCATION, handle_location))
-    app.add_handler(CommandHandler("reply", reply_command))
-    app.add_handler(CommandHandler("send_all", send_to_all_groups))
-    app.add_handler(CommandHandler("send_drivers", send_message_to_drivers))
-    app.add_handler(CommandHandler("send_passengers", send_message_to_passengers))
-
-    # Webhook sozlash
-    webhook_url = os.getenv("WEBHOOK_URL") + "/webhook"
-    await app.bot.set_webhook(url=webhook_url)
-    logger.info(f"Webhook: {webhook_url}")
+    # Webhook sozlash (front ortidagi worker'lar emas - webhook front manzilida qoladi)
+    if not SHARD_WORKER:
+        await set_webhook(application.bot)
 
     # Keep-alive
-    asyncio.create_task(keep_alive())
+    keep_alive_task = asyncio.create_task(keep_alive())
+    app = application
 
-    # Flask server
-    port = int(os.getenv("PORT", 10000))
-    flask_app.run(host="0.0.0.0", port=port)
+async def shutdown():
+    """Worker to'xtaganda navbatdagi update'larni tugatib, Application'ni yopish."""
+    global app
+    if keep_alive_task:
+        keep_alive_task.cancel()
+    if ingestor:
+        await ingestor.stop()
+    if app:
+        await app.stop()
+        await app.shutdown()
+        app = None
+    await close_db()
+
+# ------------------ ASGI WEBHOOK ------------------
+# Async rejim: `gunicorn -k uvicorn.workers.UvicornWorker main:asgi_app`.
+# Har bir worker'da bitta uzoq yashovchi loop Application'ga egalik qiladi.
+async def asgi_webhook(request: Request):
+    if shard_router:
+        body = await request.body()
+        status = await asyncio.to_thread(shard_router.forward, body, json.loads(body))
+        return PlainTextResponse('OK' if status == 200 else 'Busy', status_code=status)
+    if not app:
+        return PlainTextResponse('Bot not ready', status_code=500)
+    if not await enqueue_update(await request.json(), request.headers.get(SHARD_RING_HEADER)):
+        return PlainTextResponse('Busy', status_code=503)
+    return PlainTextResponse('OK')
+
+async def asgi_home(request: Request):
+    return PlainTextResponse('Safar Taxi Bot is running')
+
+async def asgi_metrics(request: Request):
+    if not metrics_allowed(request.headers.get('Authorization')):
+        return PlainTextResponse('Not found', status_code=404)
+    return JSONResponse(service_stats())
+
+@contextlib.asynccontextmanager
+async def lifespan(_):
+    if shard_router:
+        # Front jarayon botni ishga tushirmaydi - faqat webhook'ni o'rnatadi va uzatadi
+        await set_front_webhook()
+        yield
+        return
+    await startup()
+    try:
+        yield
+    finally:
+        await shutdown()
+
+asgi_app = Starlette(
+    routes=[
+        Route('/webhook', asgi_webhook, methods=['POST']),
+        Route('/', asgi_home),
+        Route('/metrics', asgi_metrics),
+    ],
+    lifespan=lifespan,
+)
 
 if __name__ == "__main__":
-    asyncio.run(main())  # Mahalliy sinov uchun faqat
-# Render’da Gunicorn boshqaradi, bu qatorni o‘chirmaslik kerak
\ No newline at end of file
+    import uvicorn
+    uvicorn.run(asgi_app, host="0.0.0.0", port=PORT)  # Mahalliy sinov uchun
+# Render’da Gunicorn boshqaradi, bu qatorni o‘chirmaslik kerak
@@ -0,0 +1,347 @@
+# persistence.py
+import asyncio
+import copy
+import logging
+import os
+import uuid
+
+import bson
+from pymongo import DeleteOne, ReplaceOne
+from pymongo.errors import ConnectionFailure
+from telegram.ext import BaseHandler, BasePersistence, ConversationHandler, PersistenceInput
+
+from async_database import run_sync
+from changefeed import ChangeFeed
+
+logger = logging.getLogger(__name__)
+
+# PTB'ning davriy update_persistence oralig'i (soniya). Asosiy yozish har bir update
+# oxirida (write_behind) rejalashtiriladi, davriy chaqiruv faqat qolib ketganlarni yozadi.
+PERSISTENCE_FLUSH_INTERVAL = float(os.getenv("PERSISTENCE_FLUSH_INTERVAL", 5))
+# Write-behind oynasi: shu vaqt ichida kelgan barcha o'zgarishlar bitta partiyada yoziladi
+PERSISTENCE_WRITE_DELAY = float(os.getenv("PERSISTENCE_WRITE_DELAY", 0.05))
+
+_MISSING = object()
+
+
+def _doc_id(name: str, key: tuple) -> str:
+    return f"{name}:{':'.join(str(k) for k in key)}"
+
+
+def _owner(key: tuple):
+    # Suhbatlar per_user=True - kalitning oxiri foydalanuvchi id (shaxsiy chat'da chat_id bilan bir xil)
+    return key[-1]
+
+
+def _bson_safe(user_id: int, data: dict) -> dict:
+    """BSON'ga yozib bo'lmaydigan user_data qiymatlarini log bilan tashlab yuborish."""
+    try:
+        bson.encode({"data": data})
+        return data
+    except (bson.errors.InvalidDocument, OverflowError):
+        pass
+    safe = {}
+    for key, value in data.items():
+        try:
+            bson.encode({"data": {key: value}})
+            safe[key] = value
+        except (bson.errors.InvalidDocument, OverflowError) as e:
+            logger.error(f"user_data[{key!r}] ({user_id}) bazaga yozilmaydi, tashlab yuborildi: {e}")
+    return safe
+
+
+class _StoredState(BaseHandler):
+    """Bazadan o'qilgan holatni qaytaruvchi handler.
+
+    ConversationHandler'da holatni o'rnatadigan ochiq setter yo'q - holat
+    handle_update orqali, shu handler qaytargan qiymat sifatida o'rnatiladi.
+    """
+
+    def __init__(self, state):
+        super().__init__(self._stored, block=True)
+        self.state = state
+
+    async def _stored(self, update, context):
+        return ConversationHandler.END if self.state is None else self.state
+
+    def check_update(self, update) -> bool:
+        return False
+
+
+class MongoPersistence(BasePersistence):
+    """ConversationHandler holatlari va user_data uchun MongoDB persistence.
+
+    Har bir foydalanuvchining holati (suhbatlar + user_data) versiya muhri
+    (persistence_stamps) bilan belgilanadi. Lokal nusxa muhr bilan birga
+    saqlanadi va quyidagicha tekshiriladi:
+    - trust_local (SHARD_WORKER): chat faqat shu worker'ga keladi - baza faqat
+      chat birinchi ko'rilganda yoki halqa o'zgarganda (forget) o'qiladi;
+    - aks holda muhrlar change stream'i yangi bo'lsa (fresh) lokal nusxaga
+      ishoniladi - boshqa worker yozgan muhr nusxani eskirgan deb belgilaydi;
+    - stream ishlamasa, bitta arzon find_one muhrni solishtiradi va holat faqat
+      muhr farq qilsa qayta o'qiladi.
+    Yozish: o'zgarishlar PERSISTENCE_WRITE_DELAY oynasida yig'ilib, yangi muhrlar
+    bilan bitta partiyada yoziladi. O'qilgan holatdan farq qilmaydigan qiymatlar
+    yozilmaydi.
+    """
+
+    def __init__(self, update_interval: float = PERSISTENCE_FLUSH_INTERVAL,
+                 write_delay: float = PERSISTENCE_WRITE_DELAY, trust_local: bool = False):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.write_delay = write_delay
+        self.trust_local = trust_local
+        self._stamps = {}  # user_id -> lokal nusxa mos keladigan muhr
+        self._verified = set()  # muhri tekshirilgan, lokal nusxasiga ishonsa bo'ladigan foydalanuvchilar
+        self._stored_conversations = {}  # (name, key) -> bazadagi holat (None - yo'q)
+        self._stored_users = {}  # user_id -> bazadagi user_data
+        self._pending_conversations = {}  # (name, key) -> state yoki None (o'chirish)
+        self._pending_users = {}  # user_id -> data yoki None (o'chirish)
+        self._writing = set()  # hozir yozilayotgan foydalanuvchilar
+        self._flush_task = None
+        self._flush_lock = asyncio.Lock()
+        self._indexed = False
+        self.feed = ChangeFeed("persistence_stamps", lambda: self._db().persistence_stamps,
+                               self._verified.clear, self._on_stamp_change)
+        self.local_hits = 0
+        self.stamp_reads = 0
+        self.reloads = 0
+        self.writes = 0
+
+    def _db(self):
+        from database import get_db
+        db = get_db()
+        if not self._indexed:
+            db.persistence_conversations.create_index("key")
+            self._indexed = True
+        return db
+
+    def start(self):
+        """Boshqa worker'lar yozgan muhrlarni kuzatishni boshlash (trust_local'da kerak emas)."""
+        if not self.trust_local:
+            self.feed.start()
+
+    def forget(self):
+        """Barcha lokal nusxalarni tekshirilmagan deb belgilash (masalan, halqa o'zgarganda)."""
+        self._verified.clear()
+
+    def _on_stamp_change(self, change: dict):
+        doc = change.get("fullDocument")
+        if doc is None:
+            self._verified.discard(change.get("documentKey", {}).get("_id"))
+        elif self._stamps.get(doc["_id"], _MISSING) != doc.get("stamp"):
+            self._verified.discard(doc["_id"])
+
+    # ------------------ O'QISH ------------------
+    async def get_conversations(self, name: str) -> dict:
+        # Holatlar ishga tushishda emas, chat birinchi kelganda yuklanadi (sync_conversations)
+        return {}
+
+    async def get_user_data(self) -> dict:
+        return {}
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    def _unflushed(self, user_id) -> bool:
+        # Yozilmagan (yoki yozilayotgan) o'zgarishlari bor foydalanuvchining lokal nusxasi eng yangisi
+        return (user_id in self._writing or user_id in self._pending_users
+                or any(_owner(key) == user_id for _, key in self._pending_conversations))
+
+    async def sync_conversations(self, application, update):
+        """process_update'dan oldin: lokal nusxa eskirgan bo'lsa, holatni bazadan yangilash."""
+        user = getattr(update, "effective_user", None)
+        if user is None:
+            return
+        user_id = user.id
+        if user_id in self._verified and (self.trust_local or self.feed.fresh()):
+            self.local_hits += 1
+            return
+        if self._unflushed(user_id):
+            self.local_hits += 1
+            return
+        doc = await run_sync(lambda: self._db().persistence_stamps.find_one({"_id": user_id}))
+        self.stamp_reads += 1
+        stamp = doc["stamp"] if doc else None
+        # Qayta o'qishdan oldin belgilanadi: o'qish paytida kelgan hodisa uni yana tekshirilmagan qiladi
+        self._verified.add(user_id)
+        if self._stamps.get(user_id, _MISSING) == stamp:
+            return
+        self._stamps[user_id] = stamp
+        await self._reload(application, update, user_id)
+
+    def _conversation_keys(self, application, update) -> list:
+        chat = getattr(update, "effective_chat", None)
+        user = getattr(update, "effective_user", None)
+        keys = []
+        for group in application.handlers.values():
+            for handler in group:
+                if not (isinstance(handler, ConversationHandler) and handler.persistent and handler.name):
+                    continue
+                key = []
+                if handler.per_chat:
+                    if not chat:
+                        continue
+                    key.append(chat.id)
+                if handler.per_user:
+                    if not user:
+                        continue
+                    key.append(user.id)
+                if key:
+                    keys.append((handler, tuple(key)))
+        return keys
+
+    async def _reload(self, application, update, user_id: int):
+        keys = self._conversation_keys(application, update)
+
+        def read():
+            db = self._db()
+            docs = []
+            if keys:
+                docs = list(db.persistence_conversations.find(
+                    {"key": {"$in": [list(key) for _, key in keys]}}, {"name": 1, "key": 1, "state": 1}))
+            return docs, db.persistence_user_data.find_one({"_id": user_id})
+
+        docs, user_doc = await run_sync(read)
+        self.reloads += 1
+        states = {(d["name"], tuple(d["key"])): d["state"] for d in docs}
+        context = application.context_types.context.from_update(update, application)
+        for handler, key in keys:
+            state = states.get((handler.name, key))
+            self._stored_conversations[(handler.name, key)] = state
+            await handler.handle_update(update, application, (None, key, _StoredState(state), None), context)
+        data = (user_doc or {}).get("data") or {}
+        self._stored_users[user_id] = copy.deepcopy(data)
+        # refresh_user_data faqat handler topilganda chaqiriladi - nusxa shu yerning o'zida yangilanadi
+        user_data = application.user_data[user_id]
+        user_data.clear()
+        user_data.update(data)
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        pass  # user_data sync_conversations'da, faqat muhr o'zgarganda yangilanadi
+
+    async def refresh_chat_data(self, chat_id: int, chat_data) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data) -> None:
+        pass
+
+    # ------------------ YOZISH ------------------
+    async def update_conversation(self, name: str, key: tuple, new_state) -> None:
+        item = (name, key)
+        current = self._pending_conversations.get(item, self._stored_conversations.get(item, _MISSING))
+        if current == new_state:
+            return
+        self._pending_conversations[item] = new_state
+        self._schedule_flush()
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        current = self._pending_users.get(user_id, self._stored_users.get(user_id, _MISSING))
+        if current == data:
+            return
+        # Nusxa: yozish DB thread'ida bo'ladi, handler'lar esa asl lug'atni o'zgartirishda davom etadi
+        self._pending_users[user_id] = copy.deepcopy(_bson_safe(user_id, data))
+        self._schedule_flush()
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._pending_users[user_id] = None
+        self._schedule_flush()
+
+    async def update_chat_data(self, chat_id: int, data) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def update_bot_data(self, data) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def write_behind(self, application, update) -> None:
+        """process_update'dan keyin: o'zgarishlarni navbatdagi partiyaga qo'shish."""
+        await application.update_persistence()
+
+    def _schedule_flush(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.write_delay)
+        await self.flush()
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            conversations, self._pending_conversations = self._pending_conversations, {}
+            users, self._pending_users = self._pending_users, {}
+            if not conversations and not users:
+                return
+            owners = {_owner(key) for _, key in conversations} | set(users)
+            conversation_ops = []
+            for (name, key), state in conversations.items():
+                doc_id = _doc_id(name, key)
+                if state is None:
+                    conversation_ops.append(DeleteOne({"_id": doc_id}))
+                else:
+                    conversation_ops.append(ReplaceOne(
+                        {"_id": doc_id}, {"_id": doc_id, "name": name, "key": list(key), "state": state}, upsert=True))
+            user_ops = []
+            for user_id, data in users.items():
+                if data is None:
+                    user_ops.append(DeleteOne({"_id": user_id}))
+                else:
+                    user_ops.append(ReplaceOne({"_id": user_id}, {"_id": user_id, "data": data}, upsert=True))
+            stamp_ops = []
+            for owner in owners:
+                stamp = uuid.uuid4().hex
+                # Lokal muhr yozishdan oldin: o'z yozuvimiz haqidagi hodisa nusxani eskirgan deb belgilamaydi
+                self._stamps[owner] = stamp
+                self._verified.add(owner)
+                stamp_ops.append(ReplaceOne({"_id": owner}, {"_id": owner, "stamp": stamp}, upsert=True))
+            self._writing |= owners
+            try:
+                await run_sync(self._write, conversation_ops, user_ops, stamp_ops)
+            except ConnectionFailure as e:
+                logger.error(f"Persistence yozishda ulanish xatosi, keyinroq qayta yoziladi: {e}")
+                # Yozilmagan o'zgarishlarni qaytaramiz (yangilari ustun)
+                self._pending_conversations = {**conversations, **self._pending_conversations}
+                self._pending_users = {**users, **self._pending_users}
+                return
+            except Exception as e:
+                # Boshqa xatolar qayta urinishda ham takrorlanadi - partiya tashlab yuboriladi
+                logger.error(f"Persistence yozishda xato, {len(conversation_ops) + len(user_ops)} ta yozuv tashlab yuborildi: {e}")
+                self._verified -= owners
+                return
+            finally:
+                self._writing -= owners
+            self._stored_conversations.update(conversations)
+            self._stored_users.update(users)
+            self.writes += 1
+
+    def _write(self, conversation_ops, user_ops, stamp_ops):
+        db = self._db()
+        if conversation_ops:
+            db.persistence_conversations.bulk_write(conversation_ops, ordered=False)
+        if user_ops:
+            db.persistence_user_data.bulk_write(user_ops, ordered=False)
+        # Muhrlar oxirida: boshqa worker yangi muhrni ko'rsa, ma'lumot allaqachon yozilgan
+        db.persistence_stamps.bulk_write(stamp_ops, ordered=False)
+
+    def stats(self) -> dict:
+        return {
+            "local_hits": self.local_hits,
+            "stamp_reads": self.stamp_reads,
+            "reloads": self.reloads,
+            "writes": self.writes,
+            "pending": len(self._pending_conversations) + len(self._pending_users),
+            "stamps_feed": self.feed.stats(),
+        }
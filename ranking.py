@@ -0,0 +1,94 @@
+# ranking.py
+"""Mos sayohatlarni o'rin sig'imi bo'yicha saralash va baholash.
+
+Haydovchi seats - bo'sh o'rinlar soni ("1".."6") yoki "post" (faqat pochta),
+yo'lovchi seats - yo'lovchilar soni yoki "post" (pochta jo'natish).
+Ball qancha kichik bo'lsa, moslik shuncha yaxshi; natijadan faqat eng yaxshi
+MATCH_TOP_K tasi heapq.nsmallest bilan olinadi (to'liq saralashsiz).
+Ball faqat sayohatning o'z qiymatlari va qidiruv parametrlaridan hisoblanadi
+(narx MATCH_PRICE_SCALE'ga nisbatan), boshqa nomzodlarga bog'liq emas - shuning
+uchun u sahifalash kaliti bo'la oladi.
+"""
+import heapq
+import os
+
+MAX_SEATS = 6
+POST = "post"
+SEAT_VALUES = [str(n) for n in range(1, MAX_SEATS + 1)]
+
+MATCH_TOP_K = int(os.getenv("MATCH_TOP_K", 10))
+MATCH_WEIGHT_PRICE = float(os.getenv("MATCH_WEIGHT_PRICE", 1))
+MATCH_WEIGHT_SEATS = float(os.getenv("MATCH_WEIGHT_SEATS", 1))
+MATCH_WEIGHT_TIME = float(os.getenv("MATCH_WEIGHT_TIME", 1))
+# Shu narx (so'm) va undan qimmati to'liq narx jarimasini oladi
+MATCH_PRICE_SCALE = float(os.getenv("MATCH_PRICE_SCALE", 200000))
+
+
+def _seat_count(seats):
+    return int(seats) if seats in SEAT_VALUES else None
+
+
+def compatible_seats(role: str, own_seats):
+    """`role` rolidagi nomzodlar uchun ruxsat etilgan seats qiymatlari (None - cheklov yo'q).
+
+    own_seats - qidirayotgan foydalanuvchining (qarama-qarshi rol) seats qiymati.
+    """
+    if role == "driver":
+        # Yo'lovchi haydovchi qidiryapti: pochtani har qanday haydovchi oladi,
+        # odamlar uchun esa bo'sh o'rin yetarli bo'lishi kerak
+        party = _seat_count(own_seats)
+        return SEAT_VALUES[party - 1:] if party else None
+    if own_seats == POST:
+        return [POST]
+    free = _seat_count(own_seats)
+    return [POST] + SEAT_VALUES[:free] if free else None
+
+
+def _seat_penalty(driver_seats, passenger_seats) -> float:
+    # Haydovchi o'rinlarining qancha qismi bo'sh qolishi (0 - to'liq to'ladi)
+    free, party = _seat_count(driver_seats), _seat_count(passenger_seats)
+    if not free or not party:
+        return 0.5
+    return (free - party) / free
+
+
+def departure_gap(departs_at, departs_until, other_at, other_until) -> float:
+    """Ikki jo'nash oralig'i orasidagi masofa sekundlarda (kesishsa 0).
+
+    departs_until yo'q bo'lsa oraliq bitta nuqta - departs_at.
+    """
+    departs_until = departs_until or departs_at
+    other_until = other_until or other_at
+    return max((other_at - departs_until).total_seconds(), (departs_at - other_until).total_seconds(), 0.0)
+
+
+def scorer(role: str, own_seats, departs_at, window_hours: float, departs_until=None):
+    """Qidiruv uchun ball funksiyasi: narx, o'rin mosligi va jo'nash vaqti farqi."""
+    window = window_hours * 3600
+
+    def score(trip: dict) -> float:
+        price = trip.get("price")
+        if not price:
+            price_penalty = 0.5  # "Kelishiladi"
+        else:
+            price_penalty = min(price / MATCH_PRICE_SCALE, 1.0)
+        if role == "driver":
+            seat_penalty = _seat_penalty(trip.get("seats"), own_seats)
+        else:
+            seat_penalty = _seat_penalty(own_seats, trip.get("seats"))
+        if departs_at is not None and window > 0 and trip.get("departs_at"):
+            gap = departure_gap(departs_at, departs_until, trip["departs_at"], trip.get("departs_until"))
+            time_penalty = min(gap / window, 1.0)
+        else:
+            time_penalty = 0.0
+        return (MATCH_WEIGHT_PRICE * price_penalty + MATCH_WEIGHT_SEATS * seat_penalty
+                + MATCH_WEIGHT_TIME * time_penalty)
+
+    return score
+
+
+def top_k(items, key, k: int = MATCH_TOP_K) -> list:
+    """Eng kichik kalitli k ta element (k <= 0 bo'lsa hammasi, saralangan)."""
+    if k <= 0:
+        return sorted(items, key=key)
+    return heapq.nsmallest(k, items, key=key)
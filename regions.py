@@ -15,4 +15,38 @@ regions = {
     "Sirdaryo viloyati": ["Guliston shahri", "Yangiyer shahri", "Shirin shahri", "Oqoltin tumani", "Boyovut tumani", "Guliston tumani", "Mirzaobod tumani", "Sardoba tumani", "Sirdaryo tumani", "Sayxunobod tumani", "Xovos tumani"],
     "Farg'ona viloyati": ["Farg'ona shahri", "Marg'ilon shahri", "Quvasoy shahri", "Qo'qon shahri", "Bog'dod tumani", "Beshariq tumani", "Buvayda tumani", "Dang'ara tumani", "Oltiariq tumani", "O'zbekiston tumani", "Rishton tumani", "So'x tumani", "Toshloq tumani", "Uchko'prik tumani", "Farg'ona tumani", "Furqat tumani", "Qo'shtepa tumani", "Quva tumani", "Yozyovon tumani"],
     "Xorazm viloyati": ["Urganch shahri", "Xiva shahri", "Bog'ot tumani", "Gurlan tumani", "Qoshko'pir tumani", "Urganch tumani", "Xazarasp tumani", "Xiva tumani", "Xonqa tumani", "Shovot tumani", "Yangiariq tumani", "Yangibozor tumani"]
-}
\ No newline at end of file
+}
+
+# ------------------ ID'LAR ------------------
+# Bazada nomlar o'rniga butun sonlar saqlanadi:
+#   viloyat id = ro'yxatdagi tartib raqami (1, 2, ...)
+#   tuman id   = viloyat id * 100 + viloyat ichidagi tartib raqami
+# Id'lar saqlangan hujjatlarda yashaydi - yangi viloyat/tumanni faqat ro'yxat oxiriga qo'shing.
+REGION_IDS = {name: i for i, name in enumerate(regions, 1)}
+REGION_NAMES = {i: name for name, i in REGION_IDS.items()}
+DISTRICT_IDS = {
+    (region, district): REGION_IDS[region] * 100 + j
+    for region, districts in regions.items()
+    for j, district in enumerate(districts, 1)
+}
+DISTRICT_NAMES = {i: district for (_, district), i in DISTRICT_IDS.items()}
+
+
+def region_id(name: str) -> int:
+    """Viloyat nomi -> id (noma'lum nom uchun KeyError)."""
+    return REGION_IDS[name]
+
+
+def district_id(region: str, district: str) -> int:
+    """(viloyat, tuman) nomlari -> tuman id (noma'lum nom uchun KeyError)."""
+    return DISTRICT_IDS[(region, district)]
+
+
+def region_name(value) -> str:
+    """Viloyat id -> nom; migratsiya qilinmagan eski hujjatlardagi satr o'zgarmaydi."""
+    return REGION_NAMES.get(value, value) if isinstance(value, int) else value
+
+
+def district_name(value) -> str:
+    """Tuman id -> nom; migratsiya qilinmagan eski hujjatlardagi satr o'zgarmaydi."""
+    return DISTRICT_NAMES.get(value, value) if isinstance(value, int) else value
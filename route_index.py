@@ -0,0 +1,171 @@
+# route_index.py
+import bisect
+import threading
+from datetime import datetime, timedelta
+
+from geo import GeoGrid, coordinates
+
+ROUTE_KEY_FIELDS = ("role", "from_region", "from_district", "to_region", "to_district")
+
+
+def route_key(trip: dict) -> tuple:
+    return tuple(trip[f] for f in ROUTE_KEY_FIELDS)
+
+
+def _departure(trip: dict) -> datetime:
+    # Jo'nash vaqti yo'q eski yozuvlar vaqt oynasiga hech qachon tushmaydi
+    return trip.get("departs_at") or datetime.min
+
+
+def _departs_until(trip: dict) -> datetime:
+    return trip.get("departs_until") or _departure(trip)
+
+
+class RouteIndex:
+    """Faol sayohatlar indeksi: (role, from_region, from_district, to_region, to_district) -> {user_id: trip}.
+
+    Har bir yo'nalish uchun (departs_at, user_id) tartiblangan ro'yxati ham
+    saqlanadi - vaqt oynasidagi sayohatlar bisect bilan olinadi. "Hozir"
+    sayohatlari departs_at..departs_until oralig'ida jo'naydi, shuning uchun
+    bisect eng uzun oraliq (_max_span) qadar oldinroqdan boshlanadi. Joylashuvi
+    bor sayohatlar GeoGrid'da ham turadi (nearby).
+
+    save_trip/update_seats/delete_trip uni yangilab boradi, boshqa worker'lar
+    yozuvlari change stream orqali keladi (put/remove_doc), rebuild esa bazadagi
+    holatni to'liq qayta yuklaydi. Qayta yuklash paytidagi lokal yozuvlar
+    jurnalga olinadi va yangi nusxaga qo'llanadi, shuning uchun yo'qolmaydi.
+    """
+
+    def __init__(self):
+        self._routes = {}  # route_key -> {user_id: trip}
+        self._times = {}  # route_key -> [(departs_at, user_id)] tartiblangan
+        self._keys = {}  # user_id -> route_key
+        self._grid = GeoGrid()  # user_id -> joylashuv
+        self._doc_ids = {}  # hujjat _id -> user_id (change stream'dagi delete faqat _id beradi)
+        self._journal = None  # rebuild paytida: user_id -> trip yoki None
+        self._max_span = timedelta(0)  # eng uzun departs_at..departs_until oralig'i (kamaymaydi)
+        self._lock = threading.Lock()
+        self.loaded = False
+
+    def _put(self, routes, times, keys, grid, trip):
+        self._remove(routes, times, keys, grid, trip["user_id"])
+        key = route_key(trip)
+        routes.setdefault(key, {})[trip["user_id"]] = trip
+        bisect.insort(times.setdefault(key, []), (_departure(trip), trip["user_id"]))
+        keys[trip["user_id"]] = key
+        if trip.get("departs_at"):
+            self._max_span = max(self._max_span, _departs_until(trip) - trip["departs_at"])
+        if trip.get("location"):
+            grid.put(trip["user_id"], *coordinates(trip["location"]))
+
+    @staticmethod
+    def _remove(routes, times, keys, grid, user_id):
+        grid.remove(user_id)
+        key = keys.pop(user_id, None)
+        if key is None:
+            return
+        bucket = routes.get(key)
+        if bucket is not None:
+            trip = bucket.pop(user_id, None)
+            if trip is not None:
+                slots = times[key]
+                del slots[bisect.bisect_left(slots, (_departure(trip), user_id))]
+            if not bucket:
+                del routes[key]
+                del times[key]
+
+    def put(self, trip: dict):
+        trip = dict(trip)
+        doc_id = trip.pop("_id", None)
+        with self._lock:
+            if doc_id is not None:
+                self._doc_ids[doc_id] = trip["user_id"]
+            self._put(self._routes, self._times, self._keys, self._grid, trip)
+            if self._journal is not None:
+                self._journal[trip["user_id"]] = trip
+
+    def update(self, user_id: int, **fields):
+        with self._lock:
+            key = self._keys.get(user_id)
+            if key is None:
+                return
+            trip = dict(self._routes[key][user_id], **fields)
+            self._routes[key][user_id] = trip
+            if fields.get("location"):
+                self._grid.put(user_id, *coordinates(fields["location"]))
+            if self._journal is not None:
+                self._journal[user_id] = trip
+
+    def remove(self, user_id: int):
+        with self._lock:
+            self._remove(self._routes, self._times, self._keys, self._grid, user_id)
+            if self._journal is not None:
+                self._journal[user_id] = None
+
+    def remove_doc(self, doc_id):
+        """Bazadan o'chirilgan hujjat bo'yicha sayohatni chiqarish."""
+        with self._lock:
+            user_id = self._doc_ids.pop(doc_id, None)
+        if user_id is not None:
+            self.remove(user_id)
+
+    def lookup(self, role: str, from_region, from_district, to_region, to_district) -> list:
+        with self._lock:
+            bucket = self._routes.get((role, from_region, from_district, to_region, to_district))
+            return [dict(t) for t in bucket.values()] if bucket else []
+
+    def lookup_many(self, keys, departs_from: datetime = None, departs_to: datetime = None) -> list:
+        """Bir nechta yo'nalish kalitlari bo'yicha sayohatlar (bitta lock ostida).
+
+        departs_from/departs_to berilsa, faqat jo'nash oralig'i shu oraliq bilan kesishadiganlari.
+        """
+        if departs_from is None:
+            with self._lock:
+                return [dict(t) for key in keys for t in self._routes.get(key, {}).values()]
+        result = []
+        with self._lock:
+            for key in keys:
+                slots = self._times.get(key)
+                if not slots:
+                    continue
+                bucket = self._routes[key]
+                lo = bisect.bisect_left(slots, (departs_from - self._max_span,))
+                hi = bisect.bisect_right(slots, (departs_to, float("inf")))
+                result.extend(dict(bucket[user_id]) for _, user_id in slots[lo:hi]
+                              if _departs_until(bucket[user_id]) >= departs_from)
+        return result
+
+    def nearby(self, latitude: float, longitude: float, radius_km: float) -> list:
+        """Radius ichida joylashuvi bor sayohatlar: [(masofa_km, trip)], yaqinidan boshlab."""
+        with self._lock:
+            return [(distance, dict(self._routes[self._keys[user_id]][user_id]))
+                    for distance, user_id in self._grid.within(latitude, longitude, radius_km)]
+
+    def rebuild(self, load_trips):
+        """load_trips() bazadagi barcha faol sayohatlarni qaytaradi (lock'siz chaqiriladi)."""
+        with self._lock:
+            self._journal = {}
+        try:
+            routes, times, keys, grid = {}, {}, {}, GeoGrid(self._grid.cell_deg)
+            doc_ids = {}
+            for trip in load_trips():
+                trip = dict(trip)
+                doc_id = trip.pop("_id", None)
+                if doc_id is not None:
+                    doc_ids[doc_id] = trip["user_id"]
+                self._put(routes, times, keys, grid, trip)
+            with self._lock:
+                for user_id, trip in self._journal.items():
+                    if trip is None:
+                        self._remove(routes, times, keys, grid, user_id)
+                    else:
+                        self._put(routes, times, keys, grid, trip)
+                self._routes, self._times, self._keys, self._grid = routes, times, keys, grid
+                self._doc_ids = doc_ids
+                self.loaded = True
+        finally:
+            with self._lock:
+                self._journal = None
+
+    def __len__(self) -> int:
+        return len(self._keys)
@@ -0,0 +1,186 @@
+# sharding.py
+"""chat_id bo'yicha update'larni doimiy worker jarayonlarga taqsimlash.
+
+Front rejim: SHARD_WORKERS=http://127.0.0.1:8001,http://127.0.0.1:8002 bo'lsa,
+/webhook update'ni o'zi ishlamaydi - chat_id consistent hashing orqali bitta
+worker'ga biriktiriladi va update o'sha worker'ning /webhook manziliga
+uzatiladi. Worker'lar SHARD_WORKERS'siz, lekin SHARD_WORKER=1 bilan ishga
+tushiriladi: ular update'larni o'zi ishlaydi, webhook'ni esa faqat front
+o'rnatadi. Har bir chat'ning keshlari bitta jarayonda qoladi.
+Worker qo'shilsa yoki o'chsa, faqat ~1/N chat boshqa worker'ga o'tadi.
+
+Worker'larda MongoPersistence lokal holatga ishonadi (trust_local) va
+bazaga faqat write-behind bilan yozadi. Baza chat birinchi ko'rilganda yoki
+egalik o'zgarganda o'qiladi: front har bir update bilan halqa versiyasini
+(SHARD_RING_HEADER) yuboradi, versiya o'zgarsa worker barcha chat'larni
+qayta tekshiradi - har biri uchun bitta muhr o'qiladi.
+"""
+import bisect
+import hashlib
+import logging
+import os
+import threading
+import time
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+SHARD_WORKERS = [w.strip().rstrip("/") for w in os.getenv("SHARD_WORKERS", "").split(",") if w.strip()]
+SHARD_WORKER = os.getenv("SHARD_WORKER") == "1"  # front ortidagi worker: webhook'ni o'rnatmaydi
+SHARD_VNODES = int(os.getenv("SHARD_VNODES", 100))
+SHARD_TIMEOUT = float(os.getenv("SHARD_TIMEOUT", 5))
+SHARD_RETRY_INTERVAL = float(os.getenv("SHARD_RETRY_INTERVAL", 30))
+SHARD_RING_HEADER = "X-Shard-Ring"
+
+# Update turlari va ulardagi chat (yoki foydalanuvchi) joylashuvi
+_CHAT_PATHS = (
+    ("message", "chat"),
+    ("edited_message", "chat"),
+    ("channel_post", "chat"),
+    ("edited_channel_post", "chat"),
+    ("business_message", "chat"),
+    ("edited_business_message", "chat"),
+    ("my_chat_member", "chat"),
+    ("chat_member", "chat"),
+    ("chat_join_request", "chat"),
+    ("callback_query", "from"),
+    ("inline_query", "from"),
+    ("chosen_inline_result", "from"),
+    ("shipping_query", "from"),
+    ("pre_checkout_query", "from"),
+    ("poll_answer", "user"),
+)
+
+
+def payload_chat_id(data: dict):
+    """Xom update JSON'idan chat_id (yoki user_id) ni topish."""
+    for kind, field in _CHAT_PATHS:
+        obj = data.get(kind)
+        if obj:
+            if kind == "callback_query" and obj.get("message"):
+                return obj["message"]["chat"]["id"]
+            if obj.get(field):
+                return obj[field]["id"]
+    return data.get("update_id")
+
+
+def _hash(value: str) -> int:
+    return int(hashlib.md5(value.encode()).hexdigest()[:16], 16)
+
+
+class HashRing:
+    """Virtual node'li consistent hashing halqasi."""
+
+    def __init__(self, nodes=(), vnodes: int = SHARD_VNODES):
+        self.vnodes = vnodes
+        self._points = []  # tartiblangan hash'lar
+        self._owners = {}  # hash -> node
+        self.nodes = set()
+        self.version = ""  # a'zolar ro'yxatining hash'i - halqa o'zgarganini bildiradi
+        for node in nodes:
+            self.add_node(node)
+
+    def add_node(self, node: str):
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        for i in range(self.vnodes):
+            point = _hash(f"{node}#{i}")
+            self._owners[point] = node
+            bisect.insort(self._points, point)
+        self._bump()
+
+    def remove_node(self, node: str):
+        if node not in self.nodes:
+            return
+        self.nodes.discard(node)
+        for i in range(self.vnodes):
+            point = _hash(f"{node}#{i}")
+            if self._owners.get(point) == node:
+                del self._owners[point]
+                self._points.pop(bisect.bisect_left(self._points, point))
+        self._bump()
+
+    def _bump(self):
+        self.version = f"{_hash(','.join(sorted(self.nodes))):x}"
+
+    def get_node(self, key):
+        if not self._points:
+            return None
+        idx = bisect.bisect(self._points, _hash(str(key))) % len(self._points)
+        return self._owners[self._points[idx]]
+
+
+class ShardRouter:
+    """Front jarayon: update'ni chat egasi bo'lgan worker'ga uzatadi."""
+
+    def __init__(self, workers=SHARD_WORKERS, timeout: float = SHARD_TIMEOUT,
+                 retry_interval: float = SHARD_RETRY_INTERVAL):
+        self.workers = list(workers)
+        self.ring = HashRing(self.workers)
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self._local = threading.local()  # requests.Session thread-safe emas - har bir thread'ga alohida
+        self._down = {}  # node -> o'chgan vaqt
+        self._lock = threading.Lock()
+        self.forwarded = 0
+        self.failed = 0
+
+    @property
+    def session(self) -> requests.Session:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def _revive(self):
+        # O'chgan worker'lar vaqti-vaqti bilan tekshiriladi va halqaga qaytariladi
+        now = time.monotonic()
+        for node, since in list(self._down.items()):
+            if now - since < self.retry_interval:
+                continue
+            try:
+                self.session.get(f"{node}/", timeout=self.timeout).raise_for_status()
+            except requests.RequestException:
+                self._down[node] = now
+                continue
+            with self._lock:
+                self._down.pop(node, None)
+                self.ring.add_node(node)
+            logger.info(f"Shard worker qaytdi: {node}")
+
+    def _mark_down(self, node: str):
+        with self._lock:
+            self.ring.remove_node(node)
+            self._down[node] = time.monotonic()
+        logger.error(f"Shard worker javob bermadi, halqadan chiqarildi: {node}")
+
+    def forward(self, body: bytes, data: dict) -> int:
+        """Update'ni egasi bo'lgan worker'ga yuborib, uning HTTP status kodini qaytaradi."""
+        if self._down:
+            self._revive()
+        with self._lock:
+            node = self.ring.get_node(payload_chat_id(data))
+            version = self.ring.version
+        if node is None:
+            self.failed += 1
+            return 503
+        try:
+            response = self.session.post(f"{node}/webhook", data=body, timeout=self.timeout,
+                                         headers={"Content-Type": "application/json", SHARD_RING_HEADER: version})
+        except requests.RequestException:
+            # Chat'lar qolgan worker'larga o'tadi; Telegram update'ni qayta yuborganda yangi egasi ishlaydi
+            self._mark_down(node)
+            self.failed += 1
+            return 503
+        self.forwarded += 1
+        return response.status_code
+
+    def stats(self) -> dict:
+        return {
+            "shard_workers": sorted(self.ring.nodes),
+            "shard_down": sorted(self._down),
+            "forwarded": self.forwarded,
+            "forward_failed": self.failed,
+        }
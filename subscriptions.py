@@ -0,0 +1,120 @@
+# subscriptions.py
+"""Yo'nalish obunalari va obunachilar to'plamlari.
+
+Yangi sayohat e'lon qilinganda mos foydalanuvchilarni qidirish o'rniga,
+obunachilar oldindan kalit bo'yicha to'plamlarga ajratib qo'yiladi; xabar
+oluvchilar sayohatning to'rtta kaliti bo'yicha to'g'ridan-to'g'ri olinadi.
+"""
+import threading
+from datetime import datetime, timedelta
+
+from ranking import compatible_seats, departure_gap
+
+# Obuna kaliti: (role, from_region, from_district, to_region, to_district);
+# tuman o'rnida 0 - viloyatning istalgan tumani
+ANY_DISTRICT = 0
+SUBSCRIPTION_KEY_FIELDS = ("role", "from_region", "from_district", "to_region", "to_district")
+
+
+def subscription_key(sub: dict) -> tuple:
+    return tuple(sub[f] for f in SUBSCRIPTION_KEY_FIELDS)
+
+
+def trip_keys(role: str, from_region: int, from_district: int, to_region: int, to_district: int) -> list:
+    """Sayohatga mos keladigan barcha obuna kalitlari (aniq tuman va "istalgan tuman")."""
+    return [(role, from_region, fd, to_region, td)
+            for fd in (from_district, ANY_DISTRICT) for td in (to_district, ANY_DISTRICT)]
+
+
+class SubscriptionIndex:
+    """Obunachilar to'plamlari: obuna kaliti -> {sub_id: obuna}.
+
+    Yangi sayohat uchun xabar oluvchilar to'rtta kalit bo'yicha to'plamlardan
+    olinadi. Qayta yuklash (rebuild) RouteIndex kabi jurnal bilan ishlaydi.
+    """
+
+    def __init__(self):
+        self._sets = {}  # key -> {sub_id: sub}
+        self._keys = {}  # sub_id -> key
+        self._journal = None
+        self._lock = threading.Lock()
+        self.loaded = False
+
+    @staticmethod
+    def _put(sets, keys, sub):
+        SubscriptionIndex._remove(sets, keys, sub["_id"])
+        key = subscription_key(sub)
+        sets.setdefault(key, {})[sub["_id"]] = sub
+        keys[sub["_id"]] = key
+
+    @staticmethod
+    def _remove(sets, keys, sub_id):
+        key = keys.pop(sub_id, None)
+        if key is None:
+            return
+        bucket = sets.get(key)
+        if bucket is not None:
+            bucket.pop(sub_id, None)
+            if not bucket:
+                del sets[key]
+
+    def put(self, sub: dict):
+        sub = dict(sub)
+        with self._lock:
+            self._put(self._sets, self._keys, sub)
+            if self._journal is not None:
+                self._journal[sub["_id"]] = sub
+
+    def remove(self, sub_id):
+        with self._lock:
+            self._remove(self._sets, self._keys, sub_id)
+            if self._journal is not None:
+                self._journal[sub_id] = None
+
+    def lookup(self, keys) -> list:
+        with self._lock:
+            return [dict(sub) for key in keys for sub in self._sets.get(key, {}).values()]
+
+    def rebuild(self, load_subscriptions):
+        with self._lock:
+            self._journal = {}
+        try:
+            sets, keys = {}, {}
+            for sub in load_subscriptions():
+                self._put(sets, keys, dict(sub))
+            with self._lock:
+                for sub_id, sub in self._journal.items():
+                    if sub is None:
+                        self._remove(sets, keys, sub_id)
+                    else:
+                        self._put(sets, keys, sub)
+                self._sets, self._keys = sets, keys
+                self.loaded = True
+        finally:
+            with self._lock:
+                self._journal = None
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+
+def select_targets(subs, trip: dict, now: datetime, window_hours: float) -> set:
+    """Obunalardan sayohat haqida xabar oladigan user_id'lar.
+
+    Sayohat orqali yaratilgan obunalarda obunachining o'z jo'nash vaqti va
+    o'rinlari saqlanadi - ular yangi sayohatga mos kelishi kerak.
+    """
+    targets = set()
+    for sub in subs:
+        if sub["user_id"] == trip["user_id"] or sub["expires_at"] <= now:
+            continue
+        if sub.get("seats") is not None:
+            allowed = compatible_seats(trip["role"], sub["seats"])
+            if allowed is not None and trip.get("seats") not in allowed:
+                continue
+        if sub.get("departs_at") is not None and trip.get("departs_at") is not None and window_hours > 0:
+            gap = departure_gap(sub["departs_at"], sub.get("departs_until"), trip["departs_at"], trip.get("departs_until"))
+            if gap > timedelta(hours=window_hours).total_seconds():
+                continue
+        targets.add(sub["user_id"])
+    return targets
@@ -0,0 +1,56 @@
+from adjacency import (DISTRICT_CENTERS, DISTRICT_RINGS, NEIGHBOURS, RING_EXACT, RING_NEIGHBOUR, RING_REGION,
+                       route_rings)
+from regions import DISTRICT_IDS, district_id, regions
+
+
+def test_every_district_has_a_center():
+    assert {(r, d) for r, ds in DISTRICT_CENTERS.items() for d in ds} == set(DISTRICT_IDS)
+
+
+def test_every_district_has_a_neighbour():
+    lonely = [key for key, did in DISTRICT_IDS.items() if not NEIGHBOURS[did]]
+    assert lonely == []
+
+
+def test_neighbours_are_symmetric():
+    for did, neighbours in NEIGHBOURS.items():
+        assert did not in neighbours
+        for other in neighbours:
+            assert did in NEIGHBOURS[other]
+
+
+def test_nearby_districts_are_neighbours():
+    chilonzor = district_id("Toshkent shahri", "Chilonzor tumani")
+    assert district_id("Toshkent shahri", "Uchtepa tumani") in NEIGHBOURS[chilonzor]
+    urgut = district_id("Samarqand viloyati", "Urgut tumani")
+    assert district_id("Samarqand viloyati", "Toyloq tumani") in NEIGHBOURS[urgut]
+    # Uzoq, siyrak hudud - eng yaqin tuman baribir qo'shni
+    moynoq = district_id("Qoraqalpog'iston Respublikasi", "Mo'ynoq tumani")
+    assert district_id("Qoraqalpog'iston Respublikasi", "Qo'ng'irot tumani") in NEIGHBOURS[moynoq]
+
+
+def test_far_districts_are_not_neighbours():
+    urgut = district_id("Samarqand viloyati", "Urgut tumani")
+    assert district_id("Samarqand viloyati", "Paxtachi tumani") not in NEIGHBOURS[urgut]
+
+
+def test_rings_widen_to_neighbours_before_region():
+    for region, districts in regions.items():
+        for district in districts:
+            did = district_id(region, district)
+            rings = DISTRICT_RINGS[did]
+            assert rings[did] == RING_EXACT
+            assert {district_id(region, d) for d in districts} <= set(rings)
+            assert all(rings[n] == RING_NEIGHBOUR for n in NEIGHBOURS[did])
+            assert RING_NEIGHBOUR in rings.values()
+            assert all(ring == RING_REGION for d, ring in rings.items() if d != did and d not in NEIGHBOURS[did])
+
+
+def test_route_rings_pair_ring_is_the_larger_end():
+    chilonzor = district_id("Toshkent shahri", "Chilonzor tumani")
+    uchtepa = district_id("Toshkent shahri", "Uchtepa tumani")
+    urgut = district_id("Samarqand viloyati", "Urgut tumani")
+    rings = route_rings(chilonzor, urgut, RING_NEIGHBOUR)
+    assert rings[(chilonzor, urgut)] == (RING_EXACT, 0)
+    assert rings[(uchtepa, urgut)] == (RING_NEIGHBOUR, 1)
+    assert all(rank[0] <= RING_NEIGHBOUR for rank in rings.values())
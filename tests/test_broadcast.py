@@ -0,0 +1,205 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from pymongo.errors import ServerSelectionTimeoutError
+from telegram.error import BadRequest, ChatMigrated, Forbidden, NetworkError, RetryAfter, TelegramError
+
+import broadcast
+from broadcast import Broadcaster, SharedTokenBucket, TokenBucket
+
+
+class FakeBot:
+    """send_message har chaqiruvda navbatdagi natijani qaytaradi (xato bo'lsa ko'taradi)."""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = []
+
+    async def send_message(self, chat_id, text):
+        self.calls.append(chat_id)
+        outcome = self.outcomes.pop(0) if self.outcomes else None
+        if isinstance(outcome, BaseException):
+            raise outcome
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    calls = []
+    real_sleep = asyncio.sleep
+
+    async def fake_sleep(seconds, *args, **kwargs):
+        calls.append(seconds)
+        await real_sleep(0)
+
+    monkeypatch.setattr(broadcast.asyncio, "sleep", fake_sleep)
+    return calls
+
+
+def make(max_retries=3):
+    return Broadcaster(rate=1000, burst=1000, chat_interval=0, concurrency=5, max_retries=max_retries)
+
+
+def test_bucket_gives_burst_then_waits():
+    async def scenario():
+        bucket = TokenBucket(rate=50, capacity=2)
+        start = time.monotonic()
+        await bucket.acquire()
+        await bucket.acquire()
+        burst = time.monotonic() - start
+        await bucket.acquire()
+        return burst, time.monotonic() - start
+
+    burst, total = asyncio.run(scenario())
+    assert burst < 0.01
+    assert total >= 0.015
+
+
+def test_bucket_pause_blocks_tokens():
+    async def scenario():
+        bucket = TokenBucket(rate=100, capacity=5)
+        bucket.pause(0.1)
+        start = time.monotonic()
+        await bucket.acquire()
+        return time.monotonic() - start
+
+    assert asyncio.run(scenario()) >= 0.09
+
+
+def test_send_succeeds_first_time(sleeps):
+    sender, bot = make(), FakeBot(None)
+    assert asyncio.run(sender.send(bot, 1, "x"))
+    assert sender.stats() == {"active": 0, "sent": 1, "failed": 0, "retried": 0}
+
+
+def test_send_retries_after_429(sleeps):
+    sender, bot = make(), FakeBot(RetryAfter(0), None)
+    assert asyncio.run(sender.send(bot, 1, "x"))
+    assert bot.calls == [1, 1]
+    assert sender.retried == 1
+
+
+def test_blocked_chat_is_not_retried(sleeps):
+    for error in (Forbidden("blocked"), BadRequest("chat not found"), TelegramError("other")):
+        sender, bot = make(), FakeBot(error)
+        assert not asyncio.run(sender.send(bot, 1, "x"))
+        assert bot.calls == [1]
+        assert sender.failed == 1
+
+
+def test_network_errors_back_off_but_not_after_last_attempt(sleeps):
+    sender, bot = make(max_retries=2), FakeBot(NetworkError("a"), NetworkError("b"), NetworkError("c"))
+    assert not asyncio.run(sender.send(bot, 1, "x"))
+    assert len(bot.calls) == 3
+    assert sleeps == [1, 2]
+    assert (sender.retried, sender.failed) == (2, 1)
+
+
+def test_migrated_chat_is_resent_to_new_id(sleeps):
+    sender, bot = make(), FakeBot(ChatMigrated(-100), None)
+    assert asyncio.run(sender.send(bot, 1, "x"))
+    assert bot.calls == [1, -100]
+
+
+def test_unexpected_error_counts_as_failure(sleeps):
+    sender, bot = make(), FakeBot(ValueError("boom"))
+    assert not asyncio.run(sender.send(bot, 1, "x"))
+    assert sender.failed == 1
+
+
+def test_run_counts_results_from_list(sleeps):
+    sender, bot = make(), FakeBot(None, Forbidden("blocked"), None)
+    result = asyncio.run(sender.run(bot, [1, 2, 3], "x"))
+    assert result == {"total": 3, "sent": 2, "failed": 1}
+    assert sender.active == 0
+
+
+def test_run_keeps_partial_result_when_source_fails(sleeps):
+    async def chat_ids():
+        yield 1
+        yield 2
+        raise RuntimeError("db down")
+
+    async def scenario():
+        result = {}
+        with pytest.raises(RuntimeError):
+            await make().run(FakeBot(), chat_ids(), "x", result=result)
+        return result
+
+    assert asyncio.run(scenario()) == {"total": 2, "sent": 2, "failed": 0}
+
+
+class LockedCollection:
+    """mongomock kolleksiyasi ustidan qulf - haqiqiy MongoDB'dagi kabi har bir amal atomik."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.lock = threading.Lock()
+
+    def find_one_and_update(self, *args, **kwargs):
+        with self.lock:
+            return self.collection.find_one_and_update(*args, **kwargs)
+
+    def update_one(self, *args, **kwargs):
+        with self.lock:
+            return self.collection.update_one(*args, **kwargs)
+
+
+@pytest.fixture
+def buckets():
+    mongomock = pytest.importorskip("mongomock")
+    collection = LockedCollection(mongomock.MongoClient().db.broadcast_buckets)
+    return lambda **kwargs: SharedTokenBucket(get_collection=lambda: collection, **kwargs)
+
+
+def test_shared_bucket_gives_one_worker_the_full_rate(buckets):
+    async def scenario():
+        bucket = buckets(rate=100, capacity=5, lease=5)
+        start = time.monotonic()
+        for _ in range(30):
+            await bucket.acquire()
+        return time.monotonic() - start
+
+    # To'liq tezlikda ~0.25 s; worker'lar soniga bo'lingan bucket bilan 1 s dan oshardi
+    assert asyncio.run(scenario()) < 0.6
+
+
+def test_shared_bucket_is_split_between_workers(buckets):
+    async def worker(bucket, n):
+        for _ in range(n):
+            await bucket.acquire()
+
+    async def scenario():
+        first, second = buckets(rate=100, capacity=5, lease=5), buckets(rate=100, capacity=5, lease=5)
+        start = time.monotonic()
+        await asyncio.gather(worker(first, 20), worker(second, 20))
+        return time.monotonic() - start
+
+    # 40 ta token, 5 tasi portlash: kamida (40 - 5) / 100 sekund
+    assert asyncio.run(scenario()) >= 0.33
+
+
+def test_retry_after_pauses_every_worker(buckets):
+    async def scenario():
+        first, second = buckets(rate=100, capacity=5, lease=1), buckets(rate=100, capacity=5, lease=1)
+        await first.acquire()
+        first.pause(0.3)
+        await asyncio.sleep(0.05)  # to'xtatish bazaga yozilishi
+        start = time.monotonic()
+        await second.acquire()
+        return time.monotonic() - start
+
+    assert asyncio.run(scenario()) >= 0.2
+
+
+def test_shared_bucket_falls_back_when_database_is_down():
+    def down():
+        raise ServerSelectionTimeoutError("no servers")
+
+    async def scenario():
+        bucket = SharedTokenBucket(rate=100, capacity=5, get_collection=down)
+        await bucket.acquire()
+        return bucket.fallbacks
+
+    assert asyncio.run(scenario()) == 1
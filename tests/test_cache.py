@@ -0,0 +1,58 @@
+import time
+
+from cache import TTLCache
+
+
+def test_size_cap_evicts_least_recently_used():
+    cache = TTLCache(maxsize=3, ttl=60)
+    for key in "abc":
+        cache.set(key, key.upper())
+    cache.get("a")  # "a" endi eng yangi
+    cache.set("d", "D")
+    assert len(cache) == 3
+    assert "b" not in cache
+    assert [cache.get(k) for k in "acd"] == ["A", "C", "D"]
+
+
+def test_entries_expire_after_ttl():
+    cache = TTLCache(maxsize=10, ttl=0.05)
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    time.sleep(0.06)
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_max_age_treats_older_entries_as_missing():
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set("a", 1)
+    time.sleep(0.03)
+    assert cache.get("a", max_age=0.01) is None
+    assert cache.get("a", max_age=10) == 1
+
+
+def test_generation_blocks_stale_write_after_pop():
+    cache = TTLCache(maxsize=10, ttl=60)
+    generation = cache.generation
+    # O'qish davom etayotganda boshqa worker yozuvni bekor qildi
+    cache.pop("a")
+    cache.set("a", "eski", generation=generation)
+    assert cache.get("a") is None
+    cache.set("a", "yangi", generation=cache.generation)
+    assert cache.get("a") == "yangi"
+
+
+def test_clear_bumps_generation():
+    cache = TTLCache(maxsize=10, ttl=60)
+    generation = cache.generation
+    cache.set("a", 1)
+    cache.clear()
+    assert cache.generation == generation + 1
+    cache.set("b", 2, generation=generation)
+    assert len(cache) == 0
+
+
+def test_add_reports_whether_key_was_new():
+    cache = TTLCache(maxsize=10, ttl=60)
+    assert cache.add("a") is True
+    assert cache.add("a") is False
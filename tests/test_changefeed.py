@@ -0,0 +1,83 @@
+import threading
+import time
+
+from bson import Timestamp
+
+from changefeed import ChangeFeed
+
+
+class FakeStream:
+    """Har bir try_next'da yangi hodisa qaytaradi - getMore hech qachon bo'sh emas."""
+
+    def __init__(self, stop: threading.Event, lag: float = 0.0):
+        self.stop = stop
+        self.lag = lag
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    @property
+    def alive(self):
+        return not self.stop.is_set()
+
+    def try_next(self):
+        time.sleep(0.001)
+        self.count += 1
+        return {"_id": self.count, "operationType": "update", "fullDocument": {"n": self.count},
+                "clusterTime": Timestamp(int(time.time() - self.lag), 1)}
+
+
+class FakeCollection:
+    def __init__(self, stream):
+        self.stream = stream
+
+    def watch(self, **kwargs):
+        return self.stream
+
+
+def run_feed(stream, max_lag, seconds):
+    applied = []
+    feed = ChangeFeed("test", lambda: FakeCollection(stream), lambda: None, applied.append, max_lag=max_lag)
+    feed.start()
+    time.sleep(seconds)
+    return feed, applied
+
+
+def test_feed_stays_fresh_under_continuous_changes():
+    stop = threading.Event()
+    try:
+        feed, applied = run_feed(FakeStream(stop), max_lag=1.5, seconds=2.5)
+        assert applied
+        assert feed.fresh()
+    finally:
+        stop.set()
+
+
+def test_feed_is_stale_when_changes_lag_behind():
+    stop = threading.Event()
+    try:
+        feed, applied = run_feed(FakeStream(stop, lag=10), max_lag=1.5, seconds=0.3)
+        assert applied
+        assert not feed.fresh()
+    finally:
+        stop.set()
+
+
+def test_empty_batch_marks_feed_synced():
+    stop = threading.Event()
+
+    class QuietStream(FakeStream):
+        def try_next(self):
+            time.sleep(0.001)
+            return None
+
+    try:
+        feed, applied = run_feed(QuietStream(stop), max_lag=1, seconds=0.1)
+        assert not applied
+        assert feed.fresh()
+    finally:
+        stop.set()
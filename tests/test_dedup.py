@@ -0,0 +1,35 @@
+import asyncio
+import time
+
+from dedup import UpdateDeduplicator
+
+
+def test_repeated_update_ids_are_dropped():
+    async def scenario():
+        dedup = UpdateDeduplicator(maxsize=100, ttl=60, store="memory")
+        results = [await dedup.seen(update_id) for update_id in (1, 2, 1, 3, 2, 1)]
+        return results, dedup.duplicates
+
+    results, duplicates = asyncio.run(scenario())
+    assert results == [False, False, True, False, True, True]
+    assert duplicates == 3
+
+
+def test_forgotten_update_is_processed_again():
+    async def scenario():
+        dedup = UpdateDeduplicator(maxsize=100, ttl=60, store="memory")
+        await dedup.seen(7)
+        await dedup.forget(7)
+        return await dedup.seen(7)
+
+    assert asyncio.run(scenario()) is False
+
+
+def test_update_ids_expire_after_ttl():
+    async def scenario():
+        dedup = UpdateDeduplicator(maxsize=100, ttl=0.05, store="memory")
+        await dedup.seen(7)
+        time.sleep(0.06)
+        return await dedup.seen(7)
+
+    assert asyncio.run(scenario()) is False
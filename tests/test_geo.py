@@ -0,0 +1,42 @@
+from geo import GeoGrid, coordinates, haversine_km, point
+
+TASHKENT = (41.311, 69.280)
+
+
+def test_haversine_known_distance():
+    # Toshkent - Samarqand ~ 270 km to'g'ri chiziqda
+    assert 260 < haversine_km(*TASHKENT, 39.654, 66.959) < 280
+    assert haversine_km(*TASHKENT, *TASHKENT) == 0
+
+
+def test_point_roundtrip():
+    assert coordinates(point(41.3, 69.2)) == (41.3, 69.2)
+
+
+def test_within_returns_only_points_in_radius_nearest_first():
+    grid = GeoGrid(cell_deg=0.05)
+    grid.put("near", 41.315, 69.285)
+    grid.put("mid", 41.35, 69.30)
+    grid.put("far", 41.60, 69.60)
+    found = grid.within(*TASHKENT, radius_km=10)
+    assert [key for _, key in found] == ["near", "mid"]
+    assert found[0][0] < found[1][0] <= 10
+
+
+def test_within_crosses_cell_boundaries():
+    grid = GeoGrid(cell_deg=0.01)
+    grid.put("a", 41.309, 69.279)
+    grid.put("b", 41.321, 69.291)
+    assert {key for _, key in grid.within(41.315, 69.285, radius_km=2)} == {"a", "b"}
+
+
+def test_put_moves_and_remove_deletes():
+    grid = GeoGrid()
+    grid.put("a", *TASHKENT)
+    grid.put("a", 39.654, 66.959)
+    assert grid.within(*TASHKENT, radius_km=5) == []
+    assert len(grid) == 1
+    grid.remove("a")
+    grid.remove("a")
+    assert len(grid) == 0
+    assert grid.within(39.654, 66.959, radius_km=5) == []
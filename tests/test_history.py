@@ -0,0 +1,75 @@
+from datetime import datetime
+
+import history
+from history import TripHistory, bucket_start
+
+
+class FakeCollection:
+    def __init__(self):
+        self.batches = []
+
+    def bulk_write(self, ops, ordered=True):
+        self.batches.append(ops)
+
+
+def trip(user_id, role="driver"):
+    return {"user_id": user_id, "role": role, "from_region": 1, "from_district": 101, "to_region": 3,
+            "to_district": 304, "price": 50000, "seats": "4", "when_mode": "now", "departs_at": None}
+
+
+def make_archive(collection):
+    archive = TripHistory(lambda: collection)
+    # Fon thread'i o'rniga flush() bilan yoziladi
+    archive._ensure_thread = lambda: None
+    return archive
+
+
+def test_bucket_start_rounds_down_to_bucket():
+    when = datetime(2030, 1, 1, 10, 47, 12)
+    assert bucket_start(when, 60) == datetime(2030, 1, 1, 10)
+    assert bucket_start(when, 15) == datetime(2030, 1, 1, 10, 45)
+    assert bucket_start(datetime(2030, 1, 1, 0, 0), 60) == datetime(2030, 1, 1)
+
+
+def test_entries_are_grouped_by_bucket_and_role():
+    collection = FakeCollection()
+    archive = make_archive(collection)
+    ended = [datetime(2030, 1, 1, 10, 5), datetime(2030, 1, 1, 10, 50), datetime(2030, 1, 1, 11, 5)]
+    archive.archive(trip(1), "expired", ended[0])
+    archive.archive(trip(2), "finished", ended[1])
+    archive.archive(trip(3, role="passenger"), "expired", ended[1])
+    archive.archive(trip(4), "expired", ended[2])
+    archive.flush()
+    ops = [op for batch in collection.batches for op in batch]
+    keys = sorted((op._filter["start"], op._filter["role"], op._doc["$inc"]["count"]) for op in ops)
+    assert keys == [(datetime(2030, 1, 1, 10), "driver", 2), (datetime(2030, 1, 1, 10), "passenger", 1),
+                    (datetime(2030, 1, 1, 11), "driver", 1)]
+    first = next(op for op in ops if op._filter["role"] == "driver" and op._doc["$inc"]["count"] == 2)
+    assert first._doc["$min"]["first"] == ended[0]
+    assert first._doc["$max"]["last"] == ended[1]
+    assert all("role" not in entry for op in ops for entry in op._doc["$push"]["trips"]["$each"])
+    assert archive.archived == 4
+
+
+def test_large_groups_are_split_by_bucket_cap(monkeypatch):
+    monkeypatch.setattr(history, "HISTORY_BUCKET_CAP", 3)
+    collection = FakeCollection()
+    archive = make_archive(collection)
+    for user_id in range(7):
+        archive.archive(trip(user_id), "expired", datetime(2030, 1, 1, 10, user_id))
+    archive.flush()
+    ops = collection.batches[0]
+    assert [op._doc["$inc"]["count"] for op in ops] == [3, 3, 1]
+    # Har bir bo'lak faqat u sig'adigan bucket'ga yoziladi
+    assert [op._filter["count"] for op in ops] == [{"$lte": 0}, {"$lte": 0}, {"$lte": 2}]
+
+
+def test_write_errors_are_counted_as_dropped():
+    class Broken:
+        def bulk_write(self, ops, ordered=True):
+            raise RuntimeError("down")
+
+    archive = make_archive(Broken())
+    archive.archive(trip(1), "expired", datetime(2030, 1, 1, 10))
+    archive.flush()
+    assert archive.stats()["dropped"] == 1
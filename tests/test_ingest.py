@@ -0,0 +1,111 @@
+import asyncio
+import random
+from types import SimpleNamespace
+
+from ingest import UpdateIngestor
+
+
+class FakeApplication:
+    """process_update tasodifiy vaqt ishlaydi; tartib va parallellikni yozib boradi."""
+
+    def __init__(self, delay: float = 0.005):
+        self.delay = delay
+        self.order = {}
+        self.running = 0
+        self.max_running = 0
+        self.running_chats = set()
+        self.overlaps = 0
+
+    async def process_update(self, update):
+        chat = update.effective_chat.id
+        if chat in self.running_chats:
+            self.overlaps += 1
+        self.running_chats.add(chat)
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(random.uniform(0, self.delay))
+        self.order.setdefault(chat, []).append(update.seq)
+        self.running -= 1
+        self.running_chats.discard(chat)
+
+
+def make_update(chat_id, seq):
+    return SimpleNamespace(effective_chat=SimpleNamespace(id=chat_id), effective_user=None, seq=seq)
+
+
+def test_updates_of_one_chat_keep_order_across_workers():
+    app = FakeApplication()
+
+    async def scenario():
+        ingestor = UpdateIngestor(app, maxsize=1000, workers=4)
+        await ingestor.start()
+        for seq in range(20):
+            for chat in range(5):
+                assert await ingestor.submit(make_update(chat, seq))
+        await ingestor.stop()
+        return ingestor
+
+    ingestor = asyncio.run(scenario())
+    assert app.order == {chat: list(range(20)) for chat in range(5)}
+    assert app.overlaps == 0
+    assert 1 < app.max_running <= 4
+    assert ingestor.processed == 100
+
+
+def test_queue_bound_rejects_when_full():
+    app = FakeApplication(delay=0)
+
+    async def scenario():
+        ingestor = UpdateIngestor(app, maxsize=2, workers=1, put_timeout=0)
+        accepted = [await ingestor.submit(make_update(1, seq)) for seq in range(3)]
+        await ingestor.start()
+        await ingestor.queue.join()
+        # Ishlangan update'lar o'rni bo'shaydi
+        accepted.append(await ingestor.submit(make_update(1, 3)))
+        await ingestor.stop()
+        return accepted, ingestor
+
+    accepted, ingestor = asyncio.run(scenario())
+    assert accepted == [True, True, False, True]
+    assert ingestor.rejected == 1
+    assert app.order[1] == [0, 1, 3]
+
+
+def test_put_timeout_waits_for_a_free_slot():
+    app = FakeApplication(delay=0)
+
+    async def scenario():
+        ingestor = UpdateIngestor(app, maxsize=1, workers=1, put_timeout=1)
+        await ingestor.submit(make_update(1, 0))
+        await ingestor.start()
+        accepted = await ingestor.submit(make_update(1, 1))
+        await ingestor.stop()
+        return accepted
+
+    assert asyncio.run(scenario()) is True
+
+
+def test_prepare_and_finish_wrap_processing_and_survive_errors():
+    calls = []
+
+    class FailingApplication:
+        async def process_update(self, update):
+            calls.append(("process", update.seq))
+            raise RuntimeError("boom")
+
+    async def prepare(application, update):
+        calls.append(("prepare", update.seq))
+
+    async def finish(application, update):
+        calls.append(("finish", update.seq))
+
+    async def scenario():
+        ingestor = UpdateIngestor(FailingApplication(), workers=1, prepare=prepare, finish=finish)
+        await ingestor.start()
+        await ingestor.submit(make_update(1, 0))
+        await ingestor.stop()
+        return ingestor
+
+    ingestor = asyncio.run(scenario())
+    assert calls == [("prepare", 0), ("process", 0), ("finish", 0)]
+    assert ingestor.failed == 1
@@ -0,0 +1,94 @@
+from datetime import timedelta
+
+import pytest
+
+import database
+from route_index import RouteIndex
+
+ROUTE = ("Toshkent shahri", "Chilonzor tumani", "Samarqand viloyati", "Urgut tumani")
+NEIGHBOUR = ("Toshkent shahri", "Bektemir tumani", "Samarqand viloyati", "Urgut tumani")
+
+
+@pytest.fixture
+def index(monkeypatch):
+    index = RouteIndex()
+    monkeypatch.setattr(database, "route_index", index)
+    monkeypatch.setattr(database, "_route_index_fresh", lambda: True)
+    monkeypatch.setattr(database, "get_users", lambda ids: {i: {"full_name": f"U{i}"} for i in ids})
+    monkeypatch.setattr(database, "MATCH_MAX_RING", 1)
+    monkeypatch.setattr(database, "MATCH_MIN_RESULTS", 1)
+    return index
+
+
+def add_trip(index, user_id, route=ROUTE, hours=0, price=50000):
+    now = database.utc_now()
+    ids = database.encode_route(*route)
+    index.put({"user_id": user_id, "role": "driver", **dict(zip(database.ROUTE_FIELDS[1:], ids)),
+               "price": price, "seats": "4", "when_mode": "plan", "departs_at": now + timedelta(hours=hours),
+               "expires_at": now + timedelta(hours=24 + hours)})
+
+
+def all_pages(limit, on_page=None):
+    seen, cursor = [], None
+    while True:
+        page, cursor = database.get_match_page("driver", *ROUTE, after=cursor, limit=limit)
+        seen.append([m["user_id"] for m in page])
+        if on_page:
+            on_page(len(seen))
+        if cursor is None:
+            return seen
+
+
+def test_pages_cover_every_trip_once(index):
+    for user_id in range(7):
+        add_trip(index, user_id, hours=user_id % 3, price=40000 + 1000 * user_id)
+    pages = all_pages(3)
+    assert [len(p) for p in pages] == [3, 3, 1]
+    assert sorted(u for p in pages for u in p) == list(range(7))
+
+
+def test_pages_are_stable_when_trips_arrive_between_pages(index):
+    for user_id in range(6):
+        add_trip(index, user_id, hours=1)
+
+    def on_page(n):
+        # Sahifalar orasida eng arzon sayohat qo'shiladi - ko'rilgan sahifalar buzilmasligi kerak
+        if n == 1:
+            add_trip(index, 100, hours=0, price=1000)
+
+    pages = all_pages(2, on_page)
+    seen = [u for p in pages for u in p]
+    assert len(seen) == len(set(seen))
+    assert set(range(6)) <= set(seen)
+
+
+def test_first_page_has_best_scored_trips(index):
+    # Ertaroq jo'naydiganlar qimmat - birinchi sahifada eng arzonlari bo'lishi kerak
+    for user_id in range(6):
+        add_trip(index, user_id, hours=user_id, price=150000 - 20000 * user_id)
+    pages = all_pages(2)
+    assert pages == [[5, 4], [3, 2], [1, 0]]
+
+
+def test_ring_cutoff_is_kept_across_pages(index):
+    for user_id in range(3):
+        add_trip(index, user_id)
+
+    def on_page(n):
+        # Birinchi sahifa aniq tumandan iborat - keyin qo'shni tuman sayohati qo'shilsa ham kirmaydi
+        if n == 1:
+            add_trip(index, 200, route=NEIGHBOUR)
+
+    pages = all_pages(2, on_page)
+    assert sorted(u for p in pages for u in p) == [0, 1, 2]
+
+
+def test_search_widens_to_neighbours_when_exact_is_empty(index):
+    add_trip(index, 1, route=NEIGHBOUR)
+    add_trip(index, 2, route=NEIGHBOUR, hours=1)
+    page, cursor = database.get_match_page("driver", *ROUTE, limit=1)
+    assert [m["user_id"] for m in page] == [1]
+    assert page[0]["ring"] == 1
+    page, cursor = database.get_match_page("driver", *ROUTE, after=cursor, limit=1)
+    assert [m["user_id"] for m in page] == [2]
+    assert cursor is None
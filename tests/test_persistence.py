@@ -0,0 +1,265 @@
+import asyncio
+import time
+from datetime import datetime
+
+import pytest
+from pymongo import DeleteOne
+from telegram import Chat, Message, Update, User
+from telegram.ext import Application, CommandHandler, ConversationHandler, MessageHandler, filters
+
+from persistence import MongoPersistence
+
+ASKING, WAITING_SEATS = 1, 2
+
+
+class FakeCollection:
+    """Persistence ishlatadigan find_one/find/bulk_write'ning kichik xotiradagi nusxasi."""
+
+    def __init__(self):
+        self.docs = {}
+        self.reads = 0
+        self.bulk_writes = []
+
+    def create_index(self, *args, **kwargs):
+        pass
+
+    def find_one(self, query):
+        self.reads += 1
+        return self.docs.get(query["_id"])
+
+    def find(self, query, projection=None):
+        self.reads += 1
+        keys = query["key"]["$in"]
+        return [d for d in self.docs.values() if d["key"] in keys]
+
+    def bulk_write(self, ops, ordered=True):
+        self.bulk_writes.append(ops)
+        for op in ops:
+            if isinstance(op, DeleteOne):
+                self.docs.pop(op._filter["_id"], None)
+            else:
+                self.docs[op._filter["_id"]] = op._doc
+
+
+class FakeDB:
+    def __init__(self):
+        self.persistence_conversations = FakeCollection()
+        self.persistence_user_data = FakeCollection()
+        self.persistence_stamps = FakeCollection()
+
+    @property
+    def reads(self):
+        return (self.persistence_conversations.reads + self.persistence_user_data.reads
+                + self.persistence_stamps.reads)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakeDB()
+    monkeypatch.setattr(MongoPersistence, "_db", lambda self: fake)
+    return fake
+
+
+async def noop(update, context):
+    return None
+
+
+def make_app(persistence):
+    application = Application.builder().token("123:abc").updater(None).persistence(persistence).build()
+    conv = ConversationHandler(
+        entry_points=[CommandHandler("start", noop)],
+        states={ASKING: [MessageHandler(filters.TEXT, noop)], WAITING_SEATS: [MessageHandler(filters.TEXT, noop)]},
+        fallbacks=[],
+        name="route_conv",
+        persistent=True,
+    )
+    application.add_handler(conv)
+    return application, conv
+
+
+def make_update(update_id, user_id, text="salom"):
+    user = User(user_id, "Ali", False)
+    chat = Chat(user_id, Chat.PRIVATE)
+    message = Message(update_id, datetime.now(), chat, from_user=user, text=text)
+    return Update(update_id, message=message)
+
+
+def state_of(conv, update):
+    check = conv.check_update(update)
+    return check[0] if check else None
+
+
+def store(db, user_id, stamp, state=None, data=None):
+    db.persistence_stamps.docs[user_id] = {"_id": user_id, "stamp": stamp}
+    doc_id = f"route_conv:{user_id}:{user_id}"
+    if state is None:
+        db.persistence_conversations.docs.pop(doc_id, None)
+    else:
+        db.persistence_conversations.docs[doc_id] = {
+            "_id": doc_id, "name": "route_conv", "key": [user_id, user_id], "state": state}
+    db.persistence_user_data.docs[user_id] = {"_id": user_id, "data": data or {}}
+
+
+def test_first_sight_loads_state_and_user_data(db):
+    store(db, 7, "s1", state=ASKING, data={"role": "driver"})
+    persistence = MongoPersistence(write_delay=0)
+    application, conv = make_app(persistence)
+
+    async def scenario():
+        update = make_update(1, 7)
+        await persistence.sync_conversations(application, update)
+        return state_of(conv, update), dict(application.user_data[7])
+
+    state, user_data = asyncio.run(scenario())
+    assert state == ASKING
+    assert user_data == {"role": "driver"}
+    assert persistence.reloads == 1
+
+
+def test_same_stamp_costs_one_read(db):
+    store(db, 7, "s1", state=ASKING)
+    persistence = MongoPersistence(write_delay=0)
+    application, conv = make_app(persistence)
+
+    async def scenario():
+        await persistence.sync_conversations(application, make_update(1, 7))
+        reads = db.reads
+        await persistence.sync_conversations(application, make_update(2, 7))
+        return db.reads - reads
+
+    assert asyncio.run(scenario()) == 1
+    assert persistence.reloads == 1
+
+
+def test_foreign_stamp_reloads_state(db):
+    store(db, 7, "s1", state=ASKING)
+    persistence = MongoPersistence(write_delay=0)
+    application, conv = make_app(persistence)
+
+    async def scenario():
+        await persistence.sync_conversations(application, make_update(1, 7))
+        # Boshqa worker suhbatni davom ettirdi va yangi muhr yozdi
+        store(db, 7, "s2", state=WAITING_SEATS)
+        update = make_update(2, 7)
+        await persistence.sync_conversations(application, update)
+        moved = state_of(conv, update)
+        # ...so'ng suhbatni tugatdi
+        store(db, 7, "s3")
+        update = make_update(3, 7)
+        await persistence.sync_conversations(application, update)
+        return moved, state_of(conv, update)
+
+    moved, ended = asyncio.run(scenario())
+    assert moved == WAITING_SEATS
+    assert ended is None
+    assert persistence.reloads == 3
+
+
+def test_fresh_feed_trusts_local_until_foreign_stamp(db):
+    store(db, 7, "s1", state=ASKING)
+    persistence = MongoPersistence(write_delay=0)
+    application, conv = make_app(persistence)
+
+    async def scenario():
+        await persistence.sync_conversations(application, make_update(1, 7))
+        persistence.feed.synced_at = time.monotonic()
+        reads = db.reads
+        await persistence.sync_conversations(application, make_update(2, 7))
+        trusted = db.reads - reads
+        persistence._on_stamp_change({"fullDocument": {"_id": 7, "stamp": "s2"}})
+        store(db, 7, "s2", state=WAITING_SEATS)
+        update = make_update(3, 7)
+        await persistence.sync_conversations(application, update)
+        return trusted, state_of(conv, update)
+
+    trusted, state = asyncio.run(scenario())
+    assert trusted == 0
+    assert state == WAITING_SEATS
+
+
+def test_own_stamp_event_keeps_local_copy(db):
+    persistence = MongoPersistence(write_delay=0)
+    application, conv = make_app(persistence)
+
+    async def scenario():
+        await persistence.update_conversation("route_conv", (7, 7), ASKING)
+        await persistence.flush()
+        stamp = db.persistence_stamps.docs[7]["stamp"]
+        persistence._on_stamp_change({"fullDocument": {"_id": 7, "stamp": stamp}})
+        persistence.feed.synced_at = time.monotonic()
+        reads = db.reads
+        await persistence.sync_conversations(application, make_update(1, 7))
+        return db.reads - reads
+
+    assert asyncio.run(scenario()) == 0
+
+
+def test_trust_local_reads_only_on_first_sight_and_after_forget(db):
+    store(db, 7, "s1", state=ASKING)
+    persistence = MongoPersistence(write_delay=0, trust_local=True)
+    application, conv = make_app(persistence)
+
+    async def scenario():
+        counts = []
+        for update_id in (1, 2, 3):
+            reads = db.reads
+            await persistence.sync_conversations(application, make_update(update_id, 7))
+            counts.append(db.reads - reads)
+        persistence.forget()
+        reads = db.reads
+        await persistence.sync_conversations(application, make_update(4, 7))
+        counts.append(db.reads - reads)
+        return counts
+
+    # Birinchi marta: muhr + suhbatlar + user_data; halqa o'zgargach: faqat muhr (o'zgarmagan)
+    assert asyncio.run(scenario()) == [3, 0, 0, 1]
+
+
+def test_writes_are_batched_with_new_stamps(db):
+    persistence = MongoPersistence(write_delay=0.02)
+
+    async def scenario():
+        await persistence.update_conversation("route_conv", (7, 7), ASKING)
+        await persistence.update_user_data(7, {"role": "driver"})
+        await persistence.update_conversation("route_conv", (8, 8), WAITING_SEATS)
+        await persistence.drop_user_data(9)
+        await asyncio.sleep(0.1)
+
+    asyncio.run(scenario())
+    assert len(db.persistence_conversations.bulk_writes) == 1
+    assert len(db.persistence_user_data.bulk_writes) == 1
+    assert len(db.persistence_stamps.bulk_writes) == 1
+    assert set(db.persistence_stamps.docs) == {7, 8, 9}
+    assert db.persistence_conversations.docs["route_conv:8:8"]["state"] == WAITING_SEATS
+    assert persistence._stamps[7] == db.persistence_stamps.docs[7]["stamp"]
+
+
+def test_unchanged_values_are_not_rewritten(db):
+    store(db, 7, "s1", state=ASKING, data={"role": "driver"})
+    persistence = MongoPersistence(write_delay=0)
+    application, conv = make_app(persistence)
+
+    async def scenario():
+        await persistence.sync_conversations(application, make_update(1, 7))
+        await persistence.update_conversation("route_conv", (7, 7), ASKING)
+        await persistence.update_user_data(7, {"role": "driver"})
+        await persistence.flush()
+
+    asyncio.run(scenario())
+    assert db.persistence_stamps.docs[7]["stamp"] == "s1"
+    assert not db.persistence_conversations.bulk_writes
+    assert not db.persistence_user_data.bulk_writes
+
+
+def test_unflushed_changes_win_over_database(db):
+    store(db, 7, "s1", state=ASKING)
+    persistence = MongoPersistence(write_delay=10)
+    application, conv = make_app(persistence)
+
+    async def scenario():
+        await persistence.update_conversation("route_conv", (7, 7), WAITING_SEATS)
+        reads = db.reads
+        await persistence.sync_conversations(application, make_update(1, 7))
+        return db.reads - reads
+
+    assert asyncio.run(scenario()) == 0
@@ -0,0 +1,66 @@
+from datetime import datetime, timedelta
+
+from ranking import POST, SEAT_VALUES, compatible_seats, departure_gap, scorer, top_k
+
+
+def test_passenger_party_needs_enough_free_seats():
+    assert compatible_seats("driver", "3") == ["3", "4", "5", "6"]
+    assert compatible_seats("driver", "6") == ["6"]
+
+
+def test_parcel_goes_with_any_driver():
+    assert compatible_seats("driver", POST) is None
+    assert compatible_seats("driver", None) is None
+
+
+def test_driver_sees_parcels_and_parties_that_fit():
+    assert compatible_seats("passenger", "2") == [POST, "1", "2"]
+    assert compatible_seats("passenger", "6") == [POST] + SEAT_VALUES
+
+
+def test_parcel_only_driver_sees_only_parcels():
+    assert compatible_seats("passenger", POST) == [POST]
+
+
+def test_top_k_returns_smallest_in_order():
+    assert top_k([5, 1, 4, 2, 3], key=lambda x: x, k=3) == [1, 2, 3]
+
+
+def test_top_k_without_limit_sorts_everything():
+    assert top_k([3, 1, 2], key=lambda x: -x, k=0) == [3, 2, 1]
+
+
+def test_top_k_with_fewer_items_than_k():
+    assert top_k([2, 1], key=lambda x: x, k=10) == [1, 2]
+
+
+def test_departure_gap_is_zero_for_overlapping_spans():
+    t = datetime(2030, 1, 1, 10)
+    assert departure_gap(t, t + timedelta(hours=24), t + timedelta(hours=5), None) == 0
+    assert departure_gap(t, None, t, None) == 0
+
+
+def test_departure_gap_between_disjoint_spans():
+    t = datetime(2030, 1, 1, 10)
+    assert departure_gap(t, t + timedelta(hours=1), t + timedelta(hours=3), None) == 2 * 3600
+    assert departure_gap(t + timedelta(hours=3), None, t, t + timedelta(hours=1)) == 2 * 3600
+
+
+def test_scorer_prefers_cheaper_and_closer_in_time():
+    t = datetime(2030, 1, 1, 10)
+    cheap = {"price": 40000, "seats": "4", "departs_at": t}
+    dear = {"price": 60000, "seats": "4", "departs_at": t}
+    late = {"price": 40000, "seats": "4", "departs_at": t + timedelta(hours=2)}
+    score = scorer("driver", "4", t, 3)
+    assert score(cheap) < score(dear)
+    assert score(cheap) < score(late)
+
+
+def test_score_does_not_depend_on_other_candidates():
+    t = datetime(2030, 1, 1, 10)
+    trip = {"price": 50000, "seats": "4", "departs_at": t}
+    score = scorer("driver", "4", t, 3)
+    before = score(trip)
+    # Arzonroq yoki qimmatroq nomzodlar paydo bo'lishi kalitni o'zgartirmaydi - sahifalash uchun shart
+    assert scorer("driver", "4", t, 3)(trip) == before
+    assert score({"price": 10 ** 9, "seats": "4", "departs_at": t}) > before
@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta
+
+from route_index import RouteIndex
+
+NOW = datetime(2030, 1, 1, 10)
+KEY = ("driver", 1, 108, 3, 304)
+
+
+def trip(user_id, hours=0, **fields):
+    return {"user_id": user_id, "role": "driver", "from_region": 1, "from_district": 108, "to_region": 3,
+            "to_district": 304, "departs_at": NOW + timedelta(hours=hours), **fields}
+
+
+def ids(trips):
+    return sorted(t["user_id"] for t in trips)
+
+
+def test_lookup_many_uses_departure_window():
+    index = RouteIndex()
+    for user_id, hours in [(1, -5), (2, 0), (3, 2), (4, 5)]:
+        index.put(trip(user_id, hours))
+    assert ids(index.lookup_many([KEY], NOW - timedelta(hours=3), NOW + timedelta(hours=3))) == [2, 3]
+    assert ids(index.lookup_many([KEY])) == [1, 2, 3, 4]
+
+
+def test_now_trip_matches_over_its_span():
+    index = RouteIndex()
+    index.put(trip(1, -10, departs_until=NOW + timedelta(hours=14)))
+    index.put(trip(2, -10))
+    assert ids(index.lookup_many([KEY], NOW - timedelta(hours=3), NOW + timedelta(hours=3))) == [1]
+
+
+def test_put_replaces_previous_trip_of_user():
+    index = RouteIndex()
+    index.put(trip(1))
+    index.put({**trip(1), "to_district": 305})
+    assert index.lookup(*KEY) == []
+    assert len(index) == 1
+
+
+def test_remove_doc_uses_document_id():
+    index = RouteIndex()
+    index.put({"_id": "doc-1", **trip(1)})
+    index.remove_doc("doc-1")
+    assert len(index) == 0
+    index.remove_doc("unknown")
+
+
+def test_rebuild_applies_journal_of_concurrent_writes():
+    index = RouteIndex()
+    index.put(trip(9))
+    index.put(trip(3, seats="4"))
+
+    def load():
+        # Qayta yuklash paytida: yangi sayohat, o'chirilgan sayohat va yangilangan o'rinlar
+        index.put(trip(2))
+        index.remove(1)
+        index.update(3, seats="2")
+        yield {"_id": "d1", **trip(1)}
+        yield {"_id": "d3", **trip(3, seats="4")}
+
+    index.rebuild(load)
+    assert ids(index.lookup_many([KEY])) == [2, 3]
+    # Bazadan eski qiymat o'qilgan bo'lsa ham jurnaldagi yangisi qoladi
+    assert {t["user_id"]: t.get("seats") for t in index.lookup(*KEY)}[3] == "2"
+    index.remove_doc("d3")
+    assert ids(index.lookup_many([KEY])) == [2]
+
+
+def test_rebuild_drops_trips_missing_from_database():
+    index = RouteIndex()
+    index.put(trip(1))
+    index.rebuild(lambda: [trip(2)])
+    assert ids(index.lookup_many([KEY])) == [2]
@@ -0,0 +1,54 @@
+from sharding import HashRing, payload_chat_id
+
+NODES = ["http://w1", "http://w2", "http://w3"]
+KEYS = range(5000)
+
+
+def owners(ring):
+    return {key: ring.get_node(key) for key in KEYS}
+
+
+def test_adding_a_node_moves_only_its_share():
+    ring = HashRing(NODES)
+    before = owners(ring)
+    ring.add_node("http://w4")
+    after = owners(ring)
+    moved = [key for key in KEYS if before[key] != after[key]]
+    # Ko'chganlar faqat yangi worker'ga o'tadi, va taxminan 1/4 qismi
+    assert all(after[key] == "http://w4" for key in moved)
+    assert 0.15 < len(moved) / len(KEYS) < 0.35
+
+
+def test_removing_a_node_moves_only_its_chats():
+    ring = HashRing(NODES)
+    before = owners(ring)
+    ring.remove_node("http://w2")
+    after = owners(ring)
+    for key in KEYS:
+        if before[key] != "http://w2":
+            assert after[key] == before[key]
+        else:
+            assert after[key] in {"http://w1", "http://w3"}
+
+
+def test_ring_is_deterministic_and_version_tracks_members():
+    first, second = HashRing(NODES), HashRing(reversed(NODES))
+    assert owners(first) == owners(second)
+    assert first.version == second.version
+    version = first.version
+    first.remove_node("http://w1")
+    assert first.version != version
+    first.add_node("http://w1")
+    assert first.version == version
+
+
+def test_empty_ring_has_no_owner():
+    assert HashRing().get_node(1) is None
+
+
+def test_payload_chat_id():
+    assert payload_chat_id({"update_id": 1, "message": {"chat": {"id": 42}, "from": {"id": 7}}}) == 42
+    assert payload_chat_id({"update_id": 1, "callback_query": {"from": {"id": 7},
+                                                             "message": {"chat": {"id": 42}}}}) == 42
+    assert payload_chat_id({"update_id": 1, "inline_query": {"from": {"id": 7}}}) == 7
+    assert payload_chat_id({"update_id": 1}) == 1
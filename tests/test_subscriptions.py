@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta
+
+from subscriptions import ANY_DISTRICT, SubscriptionIndex, select_targets, trip_keys
+
+NOW = datetime(2030, 1, 1, 10)
+
+
+def sub(sub_id, user_id, from_district=108, to_district=304, **fields):
+    return {"_id": sub_id, "user_id": user_id, "role": "driver", "from_region": 1, "from_district": from_district,
+            "to_region": 3, "to_district": to_district, "expires_at": NOW + timedelta(days=1), **fields}
+
+
+def trip(user_id=1, **fields):
+    return {"user_id": user_id, "role": "driver", "seats": "4", "departs_at": NOW, **fields}
+
+
+def test_trip_keys_cover_exact_and_any_district():
+    assert set(trip_keys("driver", 1, 108, 3, 304)) == {
+        ("driver", 1, 108, 3, 304),
+        ("driver", 1, ANY_DISTRICT, 3, 304),
+        ("driver", 1, 108, 3, ANY_DISTRICT),
+        ("driver", 1, ANY_DISTRICT, 3, ANY_DISTRICT),
+    }
+
+
+def test_select_targets_skips_author_and_expired():
+    subs = [sub("a", 1), sub("b", 2), sub("c", 3, expires_at=NOW)]
+    assert select_targets(subs, trip(user_id=1), NOW, 3) == {2}
+
+
+def test_select_targets_checks_seats():
+    subs = [sub("a", 2, seats="3"), sub("b", 3, seats="5"), sub("c", 4)]
+    assert select_targets(subs, trip(seats="4"), NOW, 3) == {2, 4}
+
+
+def test_select_targets_checks_departure_window():
+    subs = [sub("a", 2, departs_at=NOW + timedelta(hours=2)), sub("b", 3, departs_at=NOW + timedelta(hours=5))]
+    assert select_targets(subs, trip(), NOW, 3) == {2}
+    assert select_targets(subs, trip(), NOW, 0) == {2, 3}
+
+
+def test_select_targets_now_trip_spans_until_expiry():
+    posted = NOW - timedelta(hours=5)
+    subs = [sub("a", 2, departs_at=posted, departs_until=posted + timedelta(hours=24))]
+    assert select_targets(subs, trip(), NOW, 3) == {2}
+
+
+def test_index_lookup_by_keys():
+    index = SubscriptionIndex()
+    index.put(sub("a", 2))
+    index.put(sub("b", 3, from_district=ANY_DISTRICT, to_district=ANY_DISTRICT))
+    index.put(sub("c", 4, to_district=305))
+    found = index.lookup(trip_keys("driver", 1, 108, 3, 304))
+    assert sorted(s["_id"] for s in found) == ["a", "b"]
+    index.remove("a")
+    assert [s["_id"] for s in index.lookup(trip_keys("driver", 1, 108, 3, 304))] == ["b"]
+
+
+def test_index_put_moves_subscription_to_new_key():
+    index = SubscriptionIndex()
+    index.put(sub("a", 2))
+    index.put(sub("a", 2, to_district=305))
+    assert index.lookup([("driver", 1, 108, 3, 304)]) == []
+    assert len(index) == 1
+
+
+def test_rebuild_keeps_writes_made_while_loading():
+    index = SubscriptionIndex()
+    index.put(sub("gone", 5))
+
+    def load():
+        # Bazadan o'qilayotganda boshqa yozuvlar keladi
+        index.put(sub("new", 2))
+        index.remove("old")
+        yield sub("old", 3)
+        yield sub("kept", 4)
+
+    index.rebuild(load)
+    found = sorted(s["_id"] for s in index.lookup(trip_keys("driver", 1, 108, 3, 304)))
+    assert found == ["kept", "new"]
+    assert index.loaded
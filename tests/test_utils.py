@@ -0,0 +1,20 @@
+from utils import TELEGRAM_TEXT_LIMIT, shorten, split_text
+
+
+def test_shorten_keeps_short_text_and_cuts_long():
+    assert shorten("Chilonzor", 64) == "Chilonzor"
+    assert shorten(None, 64) == ""
+    cut = shorten("x" * 100, 10)
+    assert len(cut) == 10 and cut.endswith("…")
+
+
+def test_split_text_stays_under_limit_without_breaking_cards():
+    cards = [f"karta {i}\n" + "m" * 1500 for i in range(10)]
+    messages = split_text(["1-sahifa:"] + cards)
+    assert len(messages) > 1
+    assert all(len(m) <= TELEGRAM_TEXT_LIMIT for m in messages)
+    assert "\n\n".join(messages) == "\n\n".join(["1-sahifa:"] + cards)
+
+
+def test_split_text_fits_small_page_in_one_message():
+    assert split_text(["1-sahifa:", "a", "b"]) == ["1-sahifa:\n\na\n\nb"]
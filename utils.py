@@ -1,5 +1,8 @@
 # utils.py
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+
+# O'zbekiston vaqti (UTC+5, yozgi vaqt yo'q)
+LOCAL_TZ = timezone(timedelta(hours=5))
 
 def is_valid_date(date_str: str) -> bool:
     try:
@@ -12,4 +15,42 @@ def format_date(dt: datetime) -> str:
     return dt.strftime("%Y-%m-%d")
 
 def format_time(dt: datetime) -> str:
-    return dt.strftime("%H:%M")
\ No newline at end of file
+    return dt.strftime("%H:%M")
+
+def utc_now() -> datetime:
+    # Bazada naive UTC saqlanadi - pymongo ham shunday qaytaradi
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def trip_departure(when_mode: str, when_date: str, when_time: str) -> datetime:
+    if when_mode == 'plan' and when_date and when_time:
+        local = datetime.strptime(f"{when_date} {when_time}", "%Y-%m-%d %H:%M").replace(tzinfo=LOCAL_TZ)
+        return local.astimezone(timezone.utc).replace(tzinfo=None)
+    return utc_now()
+
+def trip_departs_until(when_mode: str, departs_at: datetime, expires_at: datetime) -> datetime:
+    # "Hozir" sayohati e'lon qilingandan muddati tugaguncha istalgan payt jo'nashi mumkin
+    if when_mode == 'now' and expires_at:
+        return expires_at
+    return departs_at
+
+# Telegram bitta xabar matni uchun chegara (belgi)
+TELEGRAM_TEXT_LIMIT = 4096
+
+def shorten(text, limit: int) -> str:
+    """Erkin matnni (mahalla, ism, ...) `limit` belgigacha qisqartirish."""
+    text = "" if text is None else str(text)
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+def split_text(parts: list, separator: str = "\n\n", limit: int = TELEGRAM_TEXT_LIMIT) -> list:
+    """Qismlarni (kartalarni) `limit`dan oshmaydigan xabarlarga yig'ish; qism ikkiga bo'linmaydi."""
+    messages, current = [], ""
+    for part in parts:
+        part = shorten(part, limit)
+        if current and len(current) + len(separator) + len(part) > limit:
+            messages.append(current)
+            current = part
+        else:
+            current = current + separator + part if current else part
+    if current:
+        messages.append(current)
+    return messages